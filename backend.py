@@ -11,92 +11,245 @@ Requires:
 - Environment variables for GROQ_API_KEY.
 
 Run this server:
-   uvicorn server_with_mcp_client:app --host 0.0.0.0 --port 8080
+   python backend.py                      # WEB_WORKERS processes on PORT (default 8080)
+   uvicorn backend:app --host 0.0.0.0 --port 8080 --workers 4
+
+Tool schemas and chat sessions are kept in the SQLite SharedCache, so every worker
+process sees the same ones. SIGHUP to the parent process reloads the workers one at a time.
 """
 from __future__ import annotations
 
 import os
+import sys
 import json
 import asyncio
 from contextlib import AsyncExitStack
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
 # --- FastAPI Imports ---
-from fastapi import FastAPI, HTTPException, Body
+from urllib.parse import urljoin
+from fastapi import FastAPI, HTTPException, Body, Depends, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
 # --- LangChain & MCP Imports ---
+# fastmcp, LangChain and Groq together take seconds to import, so they are imported
+# where first used (normally by the warm-up task) instead of at module load
 from dotenv import load_dotenv
-from fastmcp.client.client import Client
-from langchain_groq import ChatGroq
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+
+if TYPE_CHECKING:
+    from fastmcp.client.client import Client
+    from langchain_groq import ChatGroq
+    from langchain_core.messages import HumanMessage, AIMessage
+
+# Shared server utilities live next to the FastAPI backend
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+import metrics
+import tracing
+import llm_transport
+from shared_cache import SharedCache
+import admission
+import singleflight
+import model_router
 
 # --- Global Configuration ---
 load_dotenv()
 MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://localhost:8005/mcp/")
+# Image uploads are forwarded here; tools then get the short image_ref, never the bytes
+MCP_BLOB_URL = os.getenv("MCP_BLOB_URL", urljoin(MCP_SERVER_URL, "/blobs"))
 LLM_MODEL = "llama-3.1-8b-instant"
+# Calls still unanswered after the hedge delay also go to this model; empty disables hedging
+HEDGE_LLM_MODEL = os.getenv("GROQ_HEDGE_MODEL", "llama-3.3-70b-versatile")
+# Discover tools and build the LLM in the background once the server is up
+WARM_UP = os.getenv("WARM_UP", "1") == "1"
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30"))
+
+# Discovered tool schemas (and which tools are read-only) per MCP server URL,
+# so only one worker pays for discovery
+tool_schema_cache = SharedCache("mcp_tools", ttl=int(os.getenv("TOOL_SCHEMA_TTL", "300")))
+# Identical concurrent calls to read-only tools share one upstream call
+read_only_tool_calls = singleflight.AsyncGroup("mcp_tool")
+# Conversation history per session_id, for clients that do not resend it
+session_store = SharedCache("chat_sessions", ttl=int(os.getenv("SESSION_TTL", "86400")))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "40"))
+# Concurrent Groq conversations; requests beyond it queue briefly or get a 503
+groq_budget = admission.ConcurrencyBudget(f"groq:{LLM_MODEL}")
 
 # ==============================================================================
 # SECTION 1: MCP CLIENT LOGIC (Adapted from your mcp_http_chat.py)
 # ==============================================================================
 
 # Helper functions to discover and call MCP tools
-async def list_mcp_tools(url: str) -> List[Dict[str, Any]]:
-    async with Client(url) as client:
+def _mcp_client(url: str) -> Client:
+    from fastmcp.client.client import Client
+    from fastmcp.client.transports import StreamableHttpTransport
+
+    # Send the current trace context so the tool server's spans join this trace
+    return Client(StreamableHttpTransport(url, headers=tracing.inject_headers()))
+
+async def list_mcp_tools(url: str) -> List[Any]:
+    async with _mcp_client(url) as client:
         return await client.list_tools()
 
-async def get_langchain_tools(url: str) -> List[Any]:
-    from langchain_core.tools import tool as lc_tool_decorator
-    mcp_tools = await list_mcp_tools(url)
-    lc_tools = []
-    for t in mcp_tools:
-        name = t.get("name")
-        description = t.get("description", "")
-        # Create a dummy function with the correct name for LangChain
-        # The actual call is routed through _execute_tool later
-        dummy_func = lambda: None
-        dummy_func.__name__ = name
-        dummy_func.__doc__ = description
-        lc_tools.append(lc_tool_decorator(dummy_func))
-    return lc_tools
+async def get_langchain_tools(url: str) -> List[Dict[str, Any]]:
+    return to_openai_tools(await list_mcp_tools(url))
+
+def to_openai_tools(mcp_tools: List[Any]) -> List[Dict[str, Any]]:
+    # Bind the tools in OpenAI function format so the model sees each tool's real
+    # input schema; the actual call is routed through _execute_tool later
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": t.name,
+                "description": t.description or "",
+                "parameters": t.inputSchema or {"type": "object", "properties": {}},
+            },
+        }
+        for t in mcp_tools
+    ]
+
+def read_only_tool_names(mcp_tools: List[Any]) -> List[str]:
+    # Only tools the server marks readOnlyHint are safe to coalesce
+    return [
+        t.name for t in mcp_tools
+        if getattr(t, "annotations", None) is not None and t.annotations.readOnlyHint
+    ]
 
 async def call_mcp_tool(url: str, name: str, params: Dict[str, Any]) -> Any:
-    async with Client(url) as client:
-        return await client.call(name, params)
+    with tracing.span(f"mcp.call_tool {name}", **{"mcp.tool": name, "mcp.url": url}), \
+            metrics.timed(metrics.TOOL_CALL_LATENCY, metrics.TOOL_CALLS, tool=name, side="client"):
+        async with AsyncExitStack() as stack:
+            # Session setup is its own span so it can be told apart from the tool's run time
+            with tracing.span("mcp.handshake"):
+                client = await stack.enter_async_context(_mcp_client(url))
+            result = await client.call_tool(name, params)
+    # Prefer the structured result; fall back to the text content blocks
+    data = getattr(result, "data", None)
+    if data is not None:
+        return data
+    content = getattr(result, "content", result)
+    return "\n".join(getattr(block, "text", str(block)) for block in content)
 
 class MCPGroqChat:
     """A reusable class to manage conversation state and tool interaction."""
-    def __init__(self, url: str, llm_model: str = LLM_MODEL, temperature: float = 0):
+    def __init__(self, url: str, llm_model: str = LLM_MODEL, temperature: float = 0,
+                 transport: Optional[llm_transport.LLMTransport] = None,
+                 hedge_model: Optional[str] = HEDGE_LLM_MODEL):
         self.url = url
         self.llm_model = llm_model
+        self.hedge_model = hedge_model or None
         self.temperature = temperature
+        self.transport = transport or llm_transport.transport
+        # Chat model class; None means langchain_groq.ChatGroq, imported on first use
+        self.chat_model_cls: Optional[type] = None
         self.lc_tools: List[Any] = []
+        self.read_only_tools: set = set()
         self.llm: Optional[ChatGroq] = None
         self.llm_with_tools: Optional[Any] = None
+        self.hedge_llm: Optional[ChatGroq] = None
+        self.hedge_llm_with_tools: Optional[Any] = None
+        self.router = model_router.HedgedRouter("groq_chat")
+        self._init_lock: Optional[asyncio.Lock] = None
 
     async def initialize(self):
         """Discovers tools and initializes the LLM. Should be called once on startup."""
-        print(f"🔌 Connecting to MCP server at {self.url} to discover tools...")
         try:
-            tools_info = await list_mcp_tools(self.url)
-            print("✅ MCP Tools discovered:")
-            for t in tools_info:
-                print(f" - {t['name']}: {t.get('description', '')}")
+            cached = await asyncio.to_thread(tool_schema_cache.get, self.url)
+            if cached is not None:
+                # Another worker discovered them recently
+                self.lc_tools = cached["tools"]
+                self.read_only_tools = set(cached["read_only"])
+                print(f"✅ {len(self.lc_tools)} MCP tool schemas loaded from the shared cache")
+            else:
+                print(f"🔌 Connecting to MCP server at {self.url} to discover tools...")
+                tools_info = await list_mcp_tools(self.url)
+                print("✅ MCP Tools discovered:")
+                for t in tools_info:
+                    print(f" - {t.name}: {t.description or ''}")
 
-            self.lc_tools = await get_langchain_tools(self.url)
-            self.llm = ChatGroq(model=self.llm_model, temperature=self.temperature)
+                self.lc_tools = to_openai_tools(tools_info)
+                self.read_only_tools = set(read_only_tool_names(tools_info))
+                await asyncio.to_thread(tool_schema_cache.set, self.url, {
+                    "tools": self.lc_tools, "read_only": sorted(self.read_only_tools)
+                })
+            self.llm = self._new_llm()
             self.llm_with_tools = self.llm.bind_tools(self.lc_tools)
+            if self.hedge_model:
+                self.hedge_llm = self._new_llm(self.hedge_model)
+                self.hedge_llm_with_tools = self.hedge_llm.bind_tools(self.lc_tools)
             print("✅ Groq LLM initialized and bound to tools.")
         except Exception as e:
             print(f"❌ Error during MCPGroqChat initialization: {e}")
             print("❌ The application might not function correctly without tools.")
             # Continue without tools if MCP server is down
-            self.llm = ChatGroq(model=self.llm_model, temperature=self.temperature)
+            self.llm = self._new_llm()
+            self.llm_with_tools = self.llm
+            if self.hedge_model:
+                self.hedge_llm = self.hedge_llm_with_tools = self._new_llm(self.hedge_model)
+
+    async def ensure_initialized(self):
+        """Runs `initialize` once; concurrent callers wait for the same run."""
+        if self.llm is not None:
+            return
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if self.llm is None:
+                await self.initialize()
+
+    def _new_llm(self, llm_model: Optional[str] = None) -> ChatGroq:
+        chat_model_cls = self.chat_model_cls
+        if chat_model_cls is None:
+            from langchain_groq import ChatGroq
+            chat_model_cls = ChatGroq
+        # Replayed calls never reach Groq, so a placeholder key is enough offline
+        kwargs = {"api_key": "replay"} if self.transport.offline else {}
+        return chat_model_cls(model=llm_model or self.llm_model, temperature=self.temperature, **kwargs)
+
+    def _route(self, step: str, messages: List[Any], tools: bool = True) -> AIMessage:
+        """Runs one Groq call on the primary model, hedged with the alternate one."""
+        def backend(llm_model: str, llm: Any) -> tuple:
+            model = llm if tools else llm.bind_tools([], tool_choice="none")
+            # Groq answers are not streamed, so a call that lost the race just finishes unused
+            return llm_model, lambda cancelled: self._invoke(
+                model, messages, step, None if tools else "none", llm_model)
+
+        primary = backend(self.llm_model, self.llm_with_tools if tools else self.llm)
+        alternate = None
+        if self.hedge_llm is not None:
+            alternate = backend(self.hedge_model, self.hedge_llm_with_tools if tools else self.hedge_llm)
+        ai_msg, _ = self.router.call(primary, alternate)
+        return ai_msg
+
+    def _invoke(self, model: Any, messages: List[Any], step: str, tool_choice: Optional[str] = None,
+                llm_model: Optional[str] = None) -> AIMessage:
+        """Runs one Groq call through the record/replay transport."""
+        from langchain_core.messages import message_to_dict, messages_from_dict, messages_to_dict
+
+        llm_model = llm_model or self.llm_model
+        request = {
+            "model": llm_model,
+            "temperature": self.temperature,
+            "tools": [] if tool_choice == "none" else self.lc_tools,
+            "tool_choice": tool_choice,
+            "messages": messages_to_dict(messages),
+        }
+        with tracing.span("groq.invoke", model=llm_model, step=step), \
+                metrics.timed(metrics.LLM_REQUEST_LATENCY, metrics.LLM_REQUESTS, provider="groq", model=llm_model):
+            return self.transport.call(
+                "groq", request, lambda: model.invoke(messages),
+                encode=message_to_dict, decode=lambda d: messages_from_dict([d])[0],
+            )
 
     async def _execute_tool(self, name: str, arguments: Dict[str, Any]) -> str:
         """Calls the tool via the MCP server and serializes the result."""
-        result = await call_mcp_tool(self.url, name, arguments)
+        if name in self.read_only_tools:
+            key = json.dumps([self.url, name, arguments], sort_keys=True, default=str)
+            result, _ = await read_only_tool_calls.do(key, lambda: call_mcp_tool(self.url, name, arguments))
+        else:
+            result = await call_mcp_tool(self.url, name, arguments)
         if isinstance(result, (dict, list)):
             try:
                 return json.dumps(result, ensure_ascii=False)
@@ -106,13 +259,23 @@ class MCPGroqChat:
 
     async def process(self, user_input: str, history: List[AIMessage | HumanMessage]) -> str:
         """Processes a single user message, handling the full tool-calling loop."""
+        # A request that arrives before the warm-up has finished waits for it
+        await self.ensure_initialized()
         if self.llm is None or self.llm_with_tools is None:
              raise RuntimeError("MCPGroqChat not initialized. Cannot process messages.")
 
+        with tracing.span("MCPGroqChat.process", history_length=len(history)):
+            return await self._process(user_input, history)
+
+    async def _process(self, user_input: str, history: List[AIMessage | HumanMessage]) -> str:
+        from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+
         messages: List[AIMessage | HumanMessage | ToolMessage] = history + [HumanMessage(content=user_input)]
 
         # 1. First LLM call to decide if a tool is needed
-        ai_msg = self.llm_with_tools.invoke(messages)
+        # Off the event loop so concurrent conversations (and identical requests,
+        # which the transport coalesces) overlap
+        ai_msg = await asyncio.to_thread(self._route, "plan", messages)
         messages.append(ai_msg)
 
         # 2. If the model wants to call tools, execute them
@@ -128,8 +291,7 @@ class MCPGroqChat:
                 messages.append(ToolMessage(content=out_text, tool_call_id=tc.get("id", f"call_{i}")))
 
             # 3. Second LLM call with tool results to get a final answer
-            final_model = self.llm.bind_tools([], tool_choice="none")
-            final_msg = final_model.invoke(messages)
+            final_msg = await asyncio.to_thread(self._route, "answer", messages, False)
             return final_msg.content if isinstance(final_msg.content, str) else str(final_msg.content)
 
         # No tools were called, return the initial response
@@ -142,11 +304,6 @@ class MCPGroqChat:
 # Create a global instance of our chat client
 mcp_chat_client = MCPGroqChat(url=MCP_SERVER_URL)
 
-@asyncio.on_event("startup")
-async def startup_event():
-    """Initializes the MCP chat client when the FastAPI app starts."""
-    await mcp_chat_client.initialize()
-
 # --- Pydantic Models for API ---
 class ChatMessage(BaseModel):
     role: str = Field(description="'user' or 'assistant'")
@@ -158,9 +315,18 @@ class ChatRequest(BaseModel):
         default_factory=list,
         description="Optional prior conversation messages for context",
     )
+    session_id: Optional[str] = Field(
+        None,
+        description="Optional session whose stored history is used and extended, on any worker",
+    )
+    image_ref: Optional[str] = Field(
+        None,
+        description="Optional image uploaded through /images, for tools that take an image_ref",
+    )
 
 class ChatResponse(BaseModel):
     reply: str
+    session_id: Optional[str] = None
 
 # --- FastAPI App and Endpoints ---
 app = FastAPI(title="Unified Agent API with MCP Client")
@@ -173,30 +339,92 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup_event():
+    """
+    Starts initializing the MCP chat client when the FastAPI app starts.
+
+    Not awaited, so /health answers while the tools are discovered; /chat waits for it.
+    """
+    if WARM_UP:
+        app.state.warm_up = asyncio.create_task(mcp_chat_client.ensure_initialized())
+
+# Per-route latency histograms and the /metrics endpoint
+metrics.install(app)
+# Request spans and the /debug/traces/{trace_id} breakdown
+tracing.install(app)
+
 @app.get("/health")
 def health() -> dict:
     """Liveness check endpoint."""
-    return {"status": "ok", "mcp_server_url": MCP_SERVER_URL}
+    return {"status": "ok", "mcp_server_url": MCP_SERVER_URL, "ready": mcp_chat_client.llm is not None}
+
+@app.post("/images")
+async def upload_image(image: UploadFile = File(...)) -> dict:
+    """
+    Upload a photo once and get the image_ref to send with /chat
+    """
+    import httpx
+
+    data = await image.read()
+    async with httpx.AsyncClient(timeout=30) as client:
+        response = await client.post(MCP_BLOB_URL, content=data,
+                                     headers={"Content-Type": "application/octet-stream"})
+    if response.status_code != 200:
+        # The blob server answers errors in JSON, but a proxy in front of it (e.g. a 502) may not
+        try:
+            detail = response.json().get("error")
+        except ValueError:
+            detail = response.text
+        raise HTTPException(status_code=response.status_code, detail=detail)
+    return response.json()
 
-@app.post("/chat", response_model=ChatResponse)
+@app.post("/chat", response_model=ChatResponse, dependencies=[Depends(admission.admit(groq_budget))])
 async def agent_chat(req: ChatRequest) -> ChatResponse:
     """
     Main chat endpoint to send a message and get a reply from the agent.
     """
+    from langchain_core.messages import HumanMessage, AIMessage
+
     try:
+        history = list(req.history)
+        if req.session_id:
+            stored = await asyncio.to_thread(session_store.get, req.session_id, [])
+            history = [ChatMessage(**m) for m in stored] + history
+
         # Convert Pydantic models to LangChain messages for history
         history_messages = []
-        for msg in req.history:
+        for msg in history:
             if msg.role == 'user':
                 history_messages.append(HumanMessage(content=msg.content))
             elif msg.role == 'assistant':
                 history_messages.append(AIMessage(content=msg.content))
         
+        # Only the reference reaches the LLM; the image itself stays on the tool server
+        message = req.message
+        if req.image_ref:
+            message += f"\n\n[Attached image: image_ref={req.image_ref}]"
+
         # Process the new message using the initialized client
-        reply_text = await mcp_chat_client.process(req.message, history_messages)
+        reply_text = await mcp_chat_client.process(message, history_messages)
+
+        if req.session_id:
+            history += [ChatMessage(role="user", content=message), ChatMessage(role="assistant", content=reply_text)]
+            await asyncio.to_thread(
+                session_store.set, req.session_id,
+                [m.model_dump() for m in history[-SESSION_MAX_MESSAGES:]]
+            )
         
-        return ChatResponse(reply=reply_text)
+        return ChatResponse(reply=reply_text, session_id=req.session_id)
         
     except Exception as e:
         print(f"Error in /chat endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+if __name__ == "__main__":
+    import uvicorn
+    # Workers import the app themselves, so it is passed by name
+    uvicorn.run(
+        "backend:app", host="0.0.0.0", port=int(os.getenv("PORT", "8080")),
+        workers=WEB_WORKERS, timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT
+    )
@@ -0,0 +1,193 @@
+"""
+Admission control for the LLM-backed endpoints.
+
+Two checks run before a request is allowed to wait on a model:
+
+- a token bucket per client (ADMISSION_RATE requests/s, bursts of ADMISSION_BURST);
+  an empty bucket is answered with 429 and the seconds until the next token
+- a concurrency budget per upstream model (MODEL_CONCURRENCY calls in flight); when
+  the expected queueing delay exceeds MAX_QUEUE_WAIT seconds, or a queued request
+  has waited that long, it is answered with 503
+
+Both rejections carry Retry-After and are counted in requests_shed_total. Limits
+are per worker process. ADMISSION_RATE=0 or MODEL_CONCURRENCY=0 disables a check.
+
+Usage (FastAPI):
+    gemini_budget = admission.ConcurrencyBudget("gemini")
+
+    @app.post("/api/chat", dependencies=[Depends(admission.admit(gemini_budget))])
+"""
+
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request
+
+import metrics
+
+ADMISSION_RATE = float(os.getenv("ADMISSION_RATE", "2"))
+ADMISSION_BURST = int(os.getenv("ADMISSION_BURST", "10"))
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "8"))
+MAX_QUEUE_WAIT = float(os.getenv("MAX_QUEUE_WAIT", "5"))
+# Only honour X-Forwarded-For behind a proxy that sets it
+ADMISSION_TRUST_PROXY = os.getenv("ADMISSION_TRUST_PROXY", "0") == "1"
+# Buckets kept for at most this many clients; the least recently seen are dropped
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "10000"))
+
+SHED_REQUESTS = metrics.counter(
+    "requests_shed_total", "Requests rejected by admission control", ("budget", "reason"))
+ADMISSION_IN_FLIGHT = metrics.gauge(
+    "admission_in_flight", "Requests holding a model concurrency slot", ("budget",))
+ADMISSION_QUEUED = metrics.gauge(
+    "admission_queued", "Requests waiting for a model concurrency slot", ("budget",))
+ADMISSION_WAIT = metrics.histogram(
+    "admission_queue_wait_seconds", "Time admitted requests waited for a slot", ("budget",))
+
+
+class Rejected(Exception):
+    """Raised when a request is shed; carries the status and Retry-After to send"""
+
+    def __init__(self, status_code, reason, retry_after):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        Take one token; returns 0 on success, else the seconds until one is available
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ClientRateLimiter:
+    """
+    One token bucket per client key, bounded to `max_clients` buckets
+    """
+
+    def __init__(self, rate=ADMISSION_RATE, burst=ADMISSION_BURST, max_clients=ADMISSION_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+
+    def check(self, client, budget="client"):
+        if self.rate <= 0:
+            return
+        bucket = self._buckets.pop(client, None) or TokenBucket(self.rate, self.burst)
+        self._buckets[client] = bucket
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        wait = bucket.take()
+        if wait:
+            SHED_REQUESTS.inc(budget=budget, reason="rate_limited")
+            raise Rejected(429, "Too many requests from this client", wait)
+
+
+class ConcurrencyBudget:
+    """
+    Caps concurrent calls to one upstream model and sheds requests that would queue too long.
+
+    The expected delay for a new request is the queue ahead of it divided by the
+    limit, times the recent average time a slot is held.
+    """
+
+    def __init__(self, name, limit=MODEL_CONCURRENCY, max_queue_wait=MAX_QUEUE_WAIT):
+        self.name = name
+        self.limit = limit
+        self.max_queue_wait = max_queue_wait
+        self.in_flight = 0
+        self.queued = 0
+        # Moving average of slot hold time, seeded with a typical LLM call
+        self.service_time = 1.0
+        self._semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+
+    def expected_wait(self):
+        # Requests already waiting count too: they may not have taken their slot yet
+        ahead = self.in_flight + self.queued - self.limit
+        if ahead < 0:
+            return 0.0
+        return (ahead + 1) / self.limit * self.service_time
+
+    async def acquire(self):
+        expected = self.expected_wait()
+        if expected > self.max_queue_wait:
+            SHED_REQUESTS.inc(budget=self.name, reason="queue_full")
+            raise Rejected(503, f"{self.name} is overloaded", expected)
+
+        start = time.perf_counter()
+        self.queued += 1
+        ADMISSION_QUEUED.set(self.queued, budget=self.name)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_queue_wait)
+        except asyncio.TimeoutError:
+            SHED_REQUESTS.inc(budget=self.name, reason="queue_timeout")
+            raise Rejected(503, f"Timed out waiting for {self.name}", self.expected_wait()) from None
+        finally:
+            self.queued -= 1
+            ADMISSION_QUEUED.set(self.queued, budget=self.name)
+        ADMISSION_WAIT.observe(time.perf_counter() - start, budget=self.name)
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight, budget=self.name)
+
+    def release(self, held):
+        self.service_time = 0.8 * self.service_time + 0.2 * held
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight, budget=self.name)
+        self._semaphore.release()
+
+
+def client_key(request: Request):
+    if ADMISSION_TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+# Shared by every admitted route in the process, so a client's budget spans endpoints
+rate_limiter = ClientRateLimiter()
+
+
+def admit(budget=None, limiter=rate_limiter):
+    """
+    FastAPI dependency that rate-limits the client and holds a slot of `budget`
+    for the duration of the request
+    """
+    bounded = budget is not None and budget.limit > 0
+
+    async def dependency(request: Request):
+        try:
+            limiter.check(client_key(request), budget.name if budget else "client")
+            if bounded:
+                await budget.acquire()
+        except Rejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e),
+                                headers={"Retry-After": str(e.retry_after)})
+        if not bounded:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            budget.release(time.perf_counter() - start)
+
+    return dependency
@@ -1,10 +1,28 @@
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from db import create_test_table, populate_table, create_complaints_table, populate_complaints_table, get_all_complaints, add_complaint
+from fastapi.responses import FileResponse, StreamingResponse
+from db import create_test_table, populate_table, create_complaints_table, populate_complaints_table, get_all_complaints, add_complaint, update_complaint_statuses, get_complaint_changes, archive_resolved_complaints, get_table_version, get_tile_version, get_tile_cells
 from gemini_service import GeminiReportGenerator, get_sample_pothole_report
+from image_pipeline import ImagePreprocessor, THUMBNAIL_DIR
+from jobs import JobQueue, JobWorkerPool, RetryableJobError, JOB_POLL_INTERVAL
+from shared_cache import SharedCache
+import admission
+import responses
+from triage import TriageClassifier
+from export import export_complaints, FORMATS as EXPORT_FORMATS
+from tiles import TILE_MAX_ZOOM, cell_zoom
+import metrics
+import tracing
+import os
 import json
+import time
 import base64
-from typing import Optional
+import hashlib
+import asyncio
+import sqlite3
+import threading
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
 
 app = FastAPI()
 
@@ -17,15 +35,212 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Gemini service
-try:
-    gemini_service = GeminiReportGenerator()
-    gemini_available = True
-except Exception as e:
-    print(f"Gemini service initialization failed: {e}")
-    gemini_available = False
+# Per-route latency histograms and the /metrics endpoint
+metrics.install(app)
+# Request spans and the /debug/traces/{trace_id} breakdown
+tracing.install(app)
 
-@app.post("/api/chat")
+# Slow clients are built by a background warm-up after startup (or by the first request
+# that needs them), so the server accepts traffic without waiting on them
+WARM_UP = os.getenv("WARM_UP", "1") == "1"
+
+# `python app.py` serving mode: WEB_WORKERS processes share the port. Each builds its
+# own clients; state that must be seen by all of them lives in SharedCache. SIGHUP to
+# the parent replaces the workers one at a time, each finishing in-flight requests
+# for up to GRACEFUL_SHUTDOWN_TIMEOUT seconds.
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30"))
+
+# Generated reports by message and image, shared across workers; 0 disables the cache
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", "3600"))
+report_cache = SharedCache("reports", ttl=REPORT_CACHE_TTL)
+
+# Encoded /api/complaints bodies, rebuilt only when the complaints table version changes
+listing_cache = responses.VersionedCache()
+
+# Encoded heatmap tiles, least recently used evicted; each is rebuilt only when its own
+# counts change
+TILE_CACHE_SIZE = int(os.getenv("TILE_CACHE_SIZE", "4096"))
+tile_cache = responses.VersionedCache(TILE_CACHE_SIZE, name="complaint_tiles")
+
+# Seconds between runs that move old resolved complaints out of the hot table; 0 disables
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "3600"))
+
+# Gemini service, initialized on first use; gemini_available stays None until then
+gemini_service = None
+gemini_available = None
+_gemini_lock = threading.Lock()
+
+# Answers confidently classified text-only messages without calling Gemini
+triage_classifier = TriageClassifier()
+
+# Bounds concurrent Gemini calls from /api/chat and sheds requests that would queue too long
+gemini_budget = admission.ConcurrencyBudget("gemini")
+
+def get_gemini_service():
+    """
+    Return the shared GeminiReportGenerator, creating it on first call
+    """
+    global gemini_service, gemini_available
+    with _gemini_lock:
+        if gemini_available is None:
+            try:
+                gemini_service = GeminiReportGenerator()
+                gemini_available = True
+            except Exception as e:
+                print(f"Gemini service initialization failed: {e}")
+                gemini_available = False
+    return gemini_service
+
+# Uploaded photos are sniffed, stripped and downscaled off the event loop before upload
+image_preprocessor = ImagePreprocessor()
+
+def generate_report(message, image_data=None, mime_type=None, thumbnail_url=None):
+    """
+    Run report generation for a message and optional preprocessed image.
+
+    Blocking; returns the `/api/chat` response body together with the raw generator result.
+    """
+    # For now, use hardcoded sample if message contains "pothole"
+    sample = "pothole" in message.lower()
+    # Confident text-only messages are triaged locally; images always go to Gemini,
+    # since they carry information the text model cannot see
+    result = None if sample or image_data else triage_classifier.triage(message)
+    if result is None:
+        service = None if sample else get_gemini_service()
+        if service is None:
+            # Use sample report for demonstration
+            result = get_sample_pothole_report()
+        else:
+            result = _cached_civic_report(service, message, image_data, mime_type)
+
+    if result["success"]:
+        report = result["report"]
+        response = {
+            "type": "report",
+            "success": True,
+            "report": report,
+            "message": "Report generated successfully"
+        }
+    else:
+        # Use fallback report
+        report = result.get("fallback_report", {})
+        response = {
+            "type": "report", 
+            "success": True,
+            "report": report,
+            "message": "Report generated using fallback method",
+            "warning": result.get("error", "AI generation failed")
+        }
+
+    if thumbnail_url:
+        # The AdminPanel renders `image` on each stored report
+        report["image"] = thumbnail_url
+    return response, result
+
+def _cached_civic_report(service, message, image_data=None, mime_type=None):
+    """
+    Generate a report with Gemini, reusing one any worker made for the same input
+    """
+    if not REPORT_CACHE_TTL:
+        return _civic_report(service, message, image_data, mime_type)
+    key = hashlib.sha256(message.strip().encode("utf-8"))
+    if image_data:
+        key.update(b"\0" + (mime_type or "").encode("utf-8") + b"\0" + image_data)
+    key = key.hexdigest()
+
+    result = report_cache.get(key)
+    if result is None:
+        result = _civic_report(service, message, image_data, mime_type)
+        # Fallback reports are not cached so the next request tries Gemini again
+        if result["success"]:
+            report_cache.set(key, result)
+    return result
+
+def _civic_report(service, message, image_data=None, mime_type=None):
+    if image_data:
+        # Use Gemini AI to generate report
+        return service.generate_civic_report(message, image_data, mime_type)
+    return service.generate_civic_report(message)
+
+def run_report_job(payload, last_attempt):
+    """
+    Job handler for queued report generation
+    """
+    image_data = base64.b64decode(payload["image"]) if payload.get("image") else None
+    response, result = generate_report(
+        payload["message"], image_data, payload.get("mime_type"), payload.get("thumbnail_url")
+    )
+    # A result without raw_response means the Gemini call itself failed (quota, network),
+    # which is worth retrying; a response that merely failed to parse is not
+    if not result["success"] and "raw_response" not in result and not last_attempt:
+        raise RetryableJobError(result.get("error", "AI generation failed"))
+    return response
+
+job_queue = JobQueue()
+job_workers = JobWorkerPool(job_queue, {"report": run_report_job})
+
+def warm_up():
+    """
+    Build the Gemini client and spawn the image workers ahead of the first request
+    """
+    start = time.perf_counter()
+    with tracing.span("app.warm_up"):
+        get_gemini_service()
+        image_preprocessor.warm_up()
+        triage_classifier.update()
+    print(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+@app.on_event("startup")
+async def migrate_complaints_table():
+    # Adds columns and tables newer code relies on to an existing database; the sample
+    # complaints are still only inserted by /setup_complaints
+    try:
+        await asyncio.to_thread(create_complaints_table)
+    except sqlite3.Error as e:
+        # e.g. another worker migrating at the same moment
+        print(f"Complaints table migration failed: {e}")
+
+@app.on_event("startup")
+async def start_job_workers():
+    await job_workers.start()
+
+@app.on_event("startup")
+async def purge_report_cache():
+    await asyncio.to_thread(report_cache.purge_expired)
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Not awaited: startup completes and requests are served while this runs
+    if WARM_UP:
+        app.state.warm_up = asyncio.create_task(asyncio.to_thread(warm_up))
+
+async def archive_periodically():
+    while True:
+        try:
+            await asyncio.to_thread(archive_resolved_complaints)
+        except Exception as e:
+            # e.g. no complaints table yet
+            print(f"Archival failed: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+@app.on_event("startup")
+async def start_archival():
+    if ARCHIVE_INTERVAL > 0:
+        app.state.archival = asyncio.create_task(archive_periodically())
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    await job_workers.stop()
+    image_preprocessor.shutdown()
+
+async def _preprocess_upload(image):
+    if not image:
+        return None
+    image_content = await image.read()
+    return await image_preprocessor.process(image_content)
+
+@app.post("/api/chat", dependencies=[Depends(admission.admit(gemini_budget))])
 async def chat_endpoint(
     message: str = Form(...),
     image: Optional[UploadFile] = File(None)
@@ -34,38 +249,24 @@ async def chat_endpoint(
     Enhanced chat endpoint that generates structured reports using Gemini AI
     """
     try:
-        image_data = None
-        if image:
-            # Read and encode image data
-            image_content = await image.read()
-            image_data = base64.b64encode(image_content).decode('utf-8')
-        
-        # For now, use hardcoded sample if message contains "pothole"
-        if "pothole" in message.lower() or not gemini_available:
-            # Use sample report for demonstration
-            result = get_sample_pothole_report()
-        else:
-            # Use Gemini AI to generate report
-            result = gemini_service.generate_civic_report(message, image_data)
-        
-        if result["success"]:
-            report = result["report"]
+        try:
+            processed_image = await _preprocess_upload(image)
+        except ValueError as e:
             return {
-                "type": "report",
-                "success": True,
-                "report": report,
-                "message": "Report generated successfully"
+                "type": "error",
+                "success": False,
+                "error": str(e),
+                "message": "Failed to process image"
             }
+
+        if processed_image:
+            response, _ = await asyncio.to_thread(
+                generate_report, message, processed_image["data"],
+                processed_image["mime_type"], processed_image["thumbnail_url"]
+            )
         else:
-            # Use fallback report
-            report = result.get("fallback_report", {})
-            return {
-                "type": "report", 
-                "success": True,
-                "report": report,
-                "message": "Report generated using fallback method",
-                "warning": result.get("error", "AI generation failed")
-            }
+            response, _ = await asyncio.to_thread(generate_report, message)
+        return response
             
     except Exception as e:
         return {
@@ -75,26 +276,134 @@ async def chat_endpoint(
             "message": "Failed to process request"
         }
 
+# Rate-limited only: queued jobs already wait without holding a connection
+@app.post("/api/jobs/chat", status_code=202, dependencies=[Depends(admission.admit())])
+async def submit_chat_job(
+    message: str = Form(...),
+    image: Optional[UploadFile] = File(None)
+):
+    """
+    Queue report generation and return a job ID immediately.
+
+    Poll `/api/jobs/{job_id}` or subscribe to `/api/jobs/{job_id}/events` for the result,
+    which has the same shape as the `/api/chat` response.
+    """
+    try:
+        processed_image = await _preprocess_upload(image)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    payload = {"message": message}
+    if processed_image:
+        payload["image"] = base64.b64encode(processed_image["data"]).decode("utf-8")
+        payload["mime_type"] = processed_image["mime_type"]
+        payload["thumbnail_url"] = processed_image["thumbnail_url"]
+
+    job_id = await asyncio.to_thread(job_queue.enqueue, "report", payload)
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/jobs/{job_id}",
+        "events_url": f"/api/jobs/{job_id}/events",
+        "success": True
+    }
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Current status of a queued job, with its report once done
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-sent events stream that emits on every status change and closes when the job finishes
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        last_state = None
+        while True:
+            job = await asyncio.to_thread(job_queue.get, job_id)
+            state = (job["status"], job["attempts"])
+            if state != last_state:
+                last_state = state
+                yield f"event: status\ndata: {json.dumps(job)}\n\n"
+            if job["status"] in ("done", "failed"):
+                return
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/api/complaints")
-async def get_complaints():
+async def get_complaints(request: Request, include_archived: bool = True):
     """
     Get all complaints for the admin panel
+
+    Archived (long-resolved) complaints are included unless `include_archived` is false.
+    The response carries an ETag from the table version counter: a poll with a current
+    If-None-Match gets 304 without reading the table.
     """
     try:
-        complaints = get_all_complaints()
-        return {"complaints": complaints, "success": True}
+        version = await asyncio.to_thread(get_table_version, "complaints")
+        etag = responses.etag("complaints", version, int(include_archived))
+        if responses.not_modified(request, etag):
+            return responses.not_modified_response(etag)
+        body = await asyncio.to_thread(
+            listing_cache.get, include_archived, version,
+            lambda: {"complaints": get_all_complaints(include_archived), "success": True}
+        )
+        return responses.encoded_response(request, body, etag)
     except Exception as e:
         return {"error": str(e), "success": False}
 
+@app.get("/api/complaints/export")
+def export_complaints_endpoint(
+    format: Literal["csv", "parquet", "arrow"] = "csv",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    status: Optional[str] = None,
+    department: Optional[str] = None,
+    include_archived: bool = True
+):
+    """
+    Stream complaints as CSV, Parquet or Arrow for analytics, in constant memory
+
+    `since` and `until` are ISO timestamps (until exclusive); rows are in id order
+    within the hot table and within each archive.
+    """
+    try:
+        chunks = export_complaints(format, since=since, until=until, status=status,
+                                   department=department, include_archived=include_archived)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type, extension = EXPORT_FORMATS[format]
+    return StreamingResponse(chunks, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="complaints.{extension}"'
+    })
+
 @app.post("/api/complaints")
 async def create_complaint(
     title: str = Form(...),
     department: str = Form(...),
     description: str = Form(...),
+    severity: Optional[str] = Form(None),
+    category: Optional[str] = Form(None),
+    latitude: Optional[float] = Form(None, ge=-90, le=90),
+    longitude: Optional[float] = Form(None, ge=-180, le=180),
     image: Optional[UploadFile] = File(None)
 ):
     """
     Create a new complaint
+
+    `severity` and `category` (from the generated report) also label it for triage training.
+    With `latitude` and `longitude` it is counted in the heatmap tiles.
     """
     try:
         image_path = None
@@ -103,11 +412,111 @@ async def create_complaint(
             # For now, we'll just store the filename
             image_path = f"/api/images/{image.filename}"
         
-        result = add_complaint(title, department, description, image_path)
+        # Waits for the group commit on a thread, not on the event loop
+        result = await asyncio.to_thread(
+            add_complaint, title, department, description, image_path, severity, category, latitude, longitude
+        )
+        if triage_classifier.note_new_complaint():
+            # Incremental retrain in the background once enough new complaints are in
+            asyncio.create_task(asyncio.to_thread(triage_classifier.update))
         return {"complaint_id": result["id"], "message": result["message"], "success": True}
     except Exception as e:
         return {"error": str(e), "success": False}
 
+class StatusUpdate(BaseModel):
+    id: int
+    status: Literal["pending", "in-progress", "resolved"]
+    version: int = Field(..., description="Version the client last saw; the update is rejected if it changed")
+
+class BulkStatusRequest(BaseModel):
+    updates: List[StatusUpdate] = Field(..., max_length=1000)
+    atomic: bool = Field(False, description="Apply nothing if any update conflicts")
+
+@app.post("/api/complaints/status")
+async def bulk_update_status(req: BulkStatusRequest):
+    """
+    Move many complaints to a new status in one transaction
+
+    Each update carries the version the admin saw; stale or invalid ones come back
+    in `conflicts` with the current status and version.
+    """
+    result = await asyncio.to_thread(
+        update_complaint_statuses, [u.model_dump() for u in req.updates], req.atomic
+    )
+    return {**result, "success": not result["conflicts"]}
+
+@app.post("/api/complaints/archive")
+async def archive_complaints(older_than_days: float = Query(..., ge=0)):
+    """
+    Archive resolved complaints older than `older_than_days` now, instead of waiting for
+    the periodic run
+    """
+    archived = await asyncio.to_thread(archive_resolved_complaints, older_than_days)
+    return {"archived": archived, "success": True}
+
+@app.get("/api/complaints/changes")
+async def complaint_changes(since: int = 0, limit: int = 500):
+    """
+    Change feed of created, status-changed and archived complaints after `since`
+
+    Pass the returned `next` as `since` on the following poll.
+    """
+    changes = await asyncio.to_thread(get_complaint_changes, since, min(max(limit, 1), 5000))
+    return {
+        "changes": changes,
+        "next": changes[-1]["seq"] if changes else since,
+        "success": True
+    }
+
+def _build_tile(z, x, y, department):
+    departments = {}
+    for cx, cy, name, total, open_count in get_tile_cells(z, x, y, cell_zoom(z), department):
+        counts = departments.setdefault(name, {"total": 0, "open": 0, "cells": []})
+        counts["total"] += total
+        counts["open"] += open_count
+        counts["cells"].append([cx, cy, total, open_count])
+    return {"z": z, "x": x, "y": y, "cell_zoom": cell_zoom(z), "departments": departments, "success": True}
+
+@app.get("/api/tiles/complaints/{z}/{x}/{y}")
+async def complaint_tile(request: Request, z: int, x: int, y: int, department: Optional[str] = None):
+    """
+    Complaint density in map tile z/x/y (Web Mercator, as in OpenStreetMap tile URLs)
+
+    Per department: total and open counts, and `cells` of [x, y, total, open] for the
+    non-empty cells of a grid 2^(cell_zoom - z) wide, x and y counted from the tile's
+    top-left. Counts are pre-aggregated, so a tile costs a few index lookups; unchanged
+    tiles are served from cache or answered 304 via their ETag.
+    """
+    if not 0 <= z <= TILE_MAX_ZOOM or not (0 <= x < 1 << z and 0 <= y < 1 << z):
+        raise HTTPException(status_code=404, detail="No such tile")
+    version = await asyncio.to_thread(get_tile_version, z, x, y, department)
+    # Department names may hold characters an ETag cannot
+    variant = hashlib.sha256(department.encode()).hexdigest()[:12] if department is not None else "all"
+    etag = responses.etag("tile", version, z, x, y, variant)
+    if responses.not_modified(request, etag):
+        return responses.not_modified_response(etag)
+    body = await asyncio.to_thread(
+        tile_cache.get, (z, x, y, department), version, lambda: _build_tile(z, x, y, department)
+    )
+    return responses.encoded_response(request, body, etag)
+
+@app.get("/api/thumbnails/{name}")
+def get_thumbnail(name: str):
+    """
+    Serve a thumbnail generated by the image pipeline
+    """
+    path = os.path.join(THUMBNAIL_DIR, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    return FileResponse(path, media_type="image/jpeg")
+
+@app.get("/api/images/stats")
+def get_image_stats():
+    """
+    Bytes saved and latency added by image preprocessing
+    """
+    return image_preprocessor.get_stats()
+
 @app.post("/create_table")
 def create_table():
     return create_test_table()
@@ -138,4 +547,8 @@ def read_root():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    # Workers import the app themselves, so it is passed by name
+    uvicorn.run(
+        "app:app", host="0.0.0.0", port=5000,
+        workers=WEB_WORKERS, timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT
+    )
\ No newline at end of file
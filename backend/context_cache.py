@@ -0,0 +1,114 @@
+"""
+Gemini context caching for the static prefix of a prompt.
+
+Report prompts start with the same system instruction every time. With explicit context
+caching, that prefix is uploaded once as a CachedContent with a TTL; requests reference
+it by name, and its tokens are billed at the cached rate and not re-processed.
+
+A cache's name is shared across worker processes through SharedCache, so N workers do
+not create N copies. Its TTL is extended when it gets within GEMINI_CACHE_REFRESH_MARGIN
+of expiry, and it is recreated once expired.
+
+Gemini rejects caches smaller than a per-model minimum (GEMINI_CACHE_MIN_TOKENS, 4096
+for 2.0 Flash). Shorter prefixes are sent inline. The provider's implicit prefix caching
+still applies to them, because the prefix is byte-identical across requests.
+
+The client is passed on every call rather than held, so it can be swapped (the bench
+stubs do this).
+"""
+
+import os
+import time
+import hashlib
+import threading
+
+import metrics
+from shared_cache import SharedCache
+
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+GEMINI_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL", "3600"))
+GEMINI_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", "4096"))
+GEMINI_CACHE_REFRESH_MARGIN = int(os.getenv("GEMINI_CACHE_REFRESH_MARGIN", "300"))
+# After a failed create or update, requests go inline for this long instead of retrying each time
+GEMINI_CACHE_RETRY_AFTER = 600
+
+CONTEXT_CACHE_OPERATIONS = metrics.counter(
+    "llm_context_cache_operations_total",
+    "Provider context cache operations (create, extend, reuse, invalidate, skip)", ("provider", "operation", "outcome"))
+
+
+class GeminiContextCache:
+    def __init__(self, model, system_instruction, display_name, ttl=GEMINI_CACHE_TTL,
+                 min_tokens=GEMINI_CACHE_MIN_TOKENS, enabled=GEMINI_CONTEXT_CACHE):
+        self.model = model
+        self.system_instruction = system_instruction
+        self.display_name = display_name
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.enabled = enabled
+        # Keyed by content, so changing the instruction or model starts a new cache
+        self.key = hashlib.sha256(f"{model}\0{system_instruction}".encode("utf-8")).hexdigest()
+        self._shared = SharedCache("gemini_context")
+        self._entry = None
+        self._large_enough = None
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, operation, outcome="ok"):
+        CONTEXT_CACHE_OPERATIONS.inc(provider="gemini", operation=operation, outcome=outcome)
+
+    def name(self, client):
+        """
+        Name of a live cache holding the system instruction, or None to send it inline
+        """
+        if not self.enabled or client is None or time.time() < self._retry_at:
+            return None
+        with self._lock:
+            operation = "count_tokens"
+            try:
+                if self._large_enough is None:
+                    tokens = client.models.count_tokens(model=self.model, contents=self.system_instruction).total_tokens
+                    self._large_enough = tokens >= self.min_tokens
+                if not self._large_enough:
+                    self._record("skip", "too_small")
+                    return None
+
+                now = time.time()
+                entry = self._entry if self._entry and self._entry["expires_at"] > now else self._shared.get(self.key)
+                if entry and entry["expires_at"] - now > GEMINI_CACHE_REFRESH_MARGIN:
+                    self._entry = entry
+                    self._record("reuse")
+                    return entry["name"]
+
+                from google.genai import types
+                ttl = f"{self.ttl}s"
+                if entry and entry["expires_at"] > now + 5:
+                    operation = "extend"
+                    client.caches.update(name=entry["name"], config=types.UpdateCachedContentConfig(ttl=ttl))
+                else:
+                    operation = "create"
+                    cache = client.caches.create(model=self.model, config=types.CreateCachedContentConfig(
+                        system_instruction=self.system_instruction, display_name=self.display_name, ttl=ttl))
+                    entry = {"name": cache.name}
+                entry["expires_at"] = now + self.ttl
+                self._shared.set(self.key, entry, ttl=self.ttl)
+                self._entry = entry
+                self._record(operation)
+                return entry["name"]
+            except Exception as e:
+                print(f"Gemini context cache unavailable, sending the instruction inline: {e}")
+                self._record(operation, "error")
+                self._retry_at = time.time() + GEMINI_CACHE_RETRY_AFTER
+                return None
+
+    def invalidate(self, name):
+        """
+        Forget `name` after a request against it failed (e.g. deleted or expired early)
+        """
+        with self._lock:
+            if self._entry and self._entry["name"] == name:
+                self._entry = None
+            shared = self._shared.get(self.key)
+            if shared and shared["name"] == name:
+                self._shared.delete(self.key)
+        self._record("invalidate")
@@ -1,35 +1,244 @@
+import os
+import glob
 import sqlite3
 import json
-from datetime import datetime
+import contextlib
+from datetime import datetime, timedelta
+
+import metrics
+import tracing
+from group_commit import GroupCommitWriter
+from tiles import TILE_MAX_ZOOM, tile_xy
+
+# Resolved complaints older than ARCHIVE_AFTER_DAYS move to one SQLite file per month
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# SQLite attaches at most 10 databases; one slot stays free for the caller's own
+MAX_ATTACHED_ARCHIVES = 9
+
+# Concurrent add_complaint calls share commits instead of each paying for an fsync
+complaint_writer = GroupCommitWriter('test.db', "complaints")
+
+@contextlib.contextmanager
+def _timed(query):
+    with tracing.span(f"db {query}", **{"db.system": "sqlite"}), \
+            metrics.timed(metrics.DB_QUERY_LATENCY, metrics.DB_QUERIES, db="sqlite", query=query):
+        yield
 
 def create_test_table():
     conn = sqlite3.connect('test.db')
     cursor = conn.cursor()
+    with _timed("create_test_table"):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS test (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL
+            )
+        ''')
+        conn.commit()
+    conn.close()
+    return {"message": "Table 'test' created successfully"}
+
+def _add_missing_columns(cursor, table, columns):
+    """
+    Add columns introduced after a table was first created
+    """
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+def _create_complaint_events(cursor):
+    """
+    Change feed for the dashboard: one row per created complaint or status change,
+    written by triggers so every writer is covered
+    """
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS test (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL
+        CREATE TABLE IF NOT EXISTS complaint_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            complaint_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            old_status TEXT,
+            new_status TEXT,
+            version INTEGER NOT NULL,
+            changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
         )
     ''')
-    conn.commit()
-    conn.close()
-    return {"message": "Table 'test' created successfully"}
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS complaints_created AFTER INSERT ON complaints
+        BEGIN
+            INSERT INTO complaint_events (complaint_id, type, new_status, version)
+            VALUES (NEW.id, 'created', NEW.status, NEW.version);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS complaints_status_changed AFTER UPDATE OF status ON complaints
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO complaint_events (complaint_id, type, old_status, new_status, version)
+            VALUES (NEW.id, 'status_changed', OLD.status, NEW.status, NEW.version);
+        END
+    ''')
+    # Local time, like the timestamp column written by add_complaint
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS complaints_resolved_at AFTER UPDATE OF status ON complaints
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE complaints
+            SET resolved_at = CASE WHEN NEW.status = 'resolved'
+                                   THEN strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime') END
+            WHERE id = NEW.id;
+        END
+    ''')
 
-def create_complaints_table():
-    conn = sqlite3.connect('test.db')
-    cursor = conn.cursor()
+def _create_table_versions(cursor):
+    """
+    Per-table change counters, bumped by triggers on every insert, update and delete.
+
+    Reading one is a primary-key lookup, so pollers can tell whether anything changed
+    without scanning the table.
+    """
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS complaints (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            department TEXT NOT NULL,
-            description TEXT NOT NULL,
-            image_path TEXT,
-            timestamp TEXT NOT NULL,
-            status TEXT DEFAULT 'pending'
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
         )
     ''')
-    conn.commit()
+    cursor.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('complaints', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS complaints_version_{event.lower()} AFTER {event} ON complaints
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'complaints';
+            END
+        ''')
+
+def _create_complaint_tiles(cursor):
+    """
+    Complaint counts per map tile and department at every zoom level up to TILE_MAX_ZOOM,
+    kept current by triggers so a heatmap tile is a few index lookups.
+
+    `total` counts every complaint with a location, `open` those not resolved, and
+    `version` is bumped on every change to the row, so a tile's summed versions change
+    exactly when its counts do. Archival deletes are not subtracted: archived complaints
+    still count. Triggers cannot use CTEs, so the zoom levels to aggregate are a table.
+    """
+    cursor.execute("CREATE TABLE IF NOT EXISTS tile_zoom_levels (zoom INTEGER PRIMARY KEY)")
+    cursor.executemany("INSERT OR IGNORE INTO tile_zoom_levels (zoom) VALUES (?)",
+                       [(zoom,) for zoom in range(TILE_MAX_ZOOM + 1)])
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS complaint_tiles (
+            zoom INTEGER NOT NULL,
+            x INTEGER NOT NULL,
+            y INTEGER NOT NULL,
+            department TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            open INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (zoom, x, y, department)
+        ) WITHOUT ROWID
+    ''')
+
+    def add(row):
+        # The WHERE also tells the parser the ON CONFLICT belongs to the INSERT, not a join
+        return f'''
+            INSERT INTO complaint_tiles (zoom, x, y, department, total, open, version)
+            SELECT zoom, {row}.tile_x >> ({TILE_MAX_ZOOM} - zoom), {row}.tile_y >> ({TILE_MAX_ZOOM} - zoom),
+                   {row}.department, 1, {row}.status IS NOT 'resolved', 1
+            FROM tile_zoom_levels WHERE {row}.tile_x IS NOT NULL
+            ON CONFLICT (zoom, x, y, department) DO UPDATE
+            SET total = total + excluded.total, open = open + excluded.open, version = version + 1;
+        '''
+
+    def tiles_of(row):
+        return f'''(zoom, x, y, department) IN (
+            SELECT zoom, {row}.tile_x >> ({TILE_MAX_ZOOM} - zoom), {row}.tile_y >> ({TILE_MAX_ZOOM} - zoom),
+                   {row}.department
+            FROM tile_zoom_levels)'''
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS complaint_tiles_insert AFTER INSERT ON complaints
+        WHEN NEW.tile_x IS NOT NULL
+        BEGIN
+            {add("NEW")}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS complaint_tiles_status AFTER UPDATE OF status ON complaints
+        WHEN NEW.tile_x IS NOT NULL AND (OLD.status IS 'resolved') IS NOT (NEW.status IS 'resolved')
+        BEGIN
+            UPDATE complaint_tiles
+            SET open = open + CASE WHEN NEW.status IS 'resolved' THEN -1 ELSE 1 END, version = version + 1
+            WHERE {tiles_of("NEW")};
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS complaint_tiles_moved AFTER UPDATE OF tile_x, tile_y, department ON complaints
+        WHEN OLD.tile_x IS NOT NEW.tile_x OR OLD.tile_y IS NOT NEW.tile_y OR OLD.department IS NOT NEW.department
+        BEGIN
+            UPDATE complaint_tiles
+            SET total = total - 1, open = open - (OLD.status IS NOT 'resolved'), version = version + 1
+            WHERE OLD.tile_x IS NOT NULL AND {tiles_of("OLD")};
+            {add("NEW")}
+        END
+    ''')
+
+def get_table_version(name="complaints"):
+    """
+    Current change counter of `name`, or None if it is not tracked (yet)
+    """
+    conn = sqlite3.connect('test.db')
+    try:
+        with _timed("get_table_version"):
+            row = conn.execute("SELECT version FROM table_versions WHERE name = ?", (name,)).fetchone()
+    except sqlite3.OperationalError:
+        # create_complaints_table has not run against this database
+        return None
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+def _dict_rows(keys):
+    """
+    Row factory building dicts with the given keys, for SELECTs of that many columns
+    """
+    return lambda cursor, row: dict(zip(keys, row))
+
+def create_complaints_table():
+    conn = sqlite3.connect('test.db')
+    cursor = conn.cursor()
+    with _timed("create_complaints_table"):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS complaints (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                department TEXT NOT NULL,
+                description TEXT NOT NULL,
+                image_path TEXT,
+                timestamp TEXT NOT NULL,
+                status TEXT DEFAULT 'pending',
+                severity TEXT,
+                category TEXT,
+                version INTEGER NOT NULL DEFAULT 1,
+                resolved_at TEXT,
+                latitude REAL,
+                longitude REAL,
+                tile_x INTEGER,
+                tile_y INTEGER
+            )
+        ''')
+        # Triage labels (severity, category), the optimistic-concurrency version,
+        # resolved_at (archival age) and the location with its heatmap tile were added later
+        _add_missing_columns(cursor, "complaints", [
+            ("severity", "TEXT"), ("category", "TEXT"), ("version", "INTEGER NOT NULL DEFAULT 1"),
+            ("resolved_at", "TEXT"), ("latitude", "REAL"), ("longitude", "REAL"),
+            ("tile_x", "INTEGER"), ("tile_y", "INTEGER")
+        ])
+        _create_complaint_events(cursor)
+        _create_table_versions(cursor)
+        _create_complaint_tiles(cursor)
+        conn.commit()
     conn.close()
     return {"message": "Table 'complaints' created successfully"}
 
@@ -37,10 +246,11 @@ def populate_table():
     conn = sqlite3.connect('test.db')
     cursor = conn.cursor()
     # Insert some sample data
-    cursor.executemany('''
-        INSERT INTO test (name) VALUES (?)
-    ''', [('Alice',), ('Bob',), ('Charlie',)])
-    conn.commit()
+    with _timed("populate_table"):
+        cursor.executemany('''
+            INSERT INTO test (name) VALUES (?)
+        ''', [('Alice',), ('Bob',), ('Charlie',)])
+        conn.commit()
     conn.close()
     return {"message": "Table 'test' populated with sample data"}
 
@@ -51,67 +261,383 @@ def populate_complaints_table():
     sample_complaints = [
         ("Pothole on Main Road", "Roads & Infrastructure", 
          "There is a large pothole on the main road near Brigade Mall that is causing traffic issues and is dangerous for vehicles. The pothole has been there for over a month and keeps getting bigger due to monsoon rains.", 
-         None, datetime.now().isoformat(), "pending"),
+         None, datetime.now().isoformat(), "pending", "High", "Infrastructure", 12.9719, 77.6070),
         ("Garbage Collection Issue", "Waste Management",
          "Garbage has not been collected from our street (MG Road area) for the past 5 days. The waste is piling up and creating unhygienic conditions.",
-         None, datetime.now().isoformat(), "in-progress"),
+         None, datetime.now().isoformat(), "in-progress", "Medium", "Sanitation", 12.9756, 77.6050),
         ("Street Light Not Working", "Electricity",
          "Street light near the bus stop on Koramangala 4th Block has been non-functional for 2 weeks. This is causing safety concerns for pedestrians at night.",
-         None, datetime.now().isoformat(), "pending"),
+         None, datetime.now().isoformat(), "pending", "Medium", "Safety", 12.9345, 77.6266),
         ("Water Logging During Rain", "Drainage",
          "The entire stretch of Indiranagar 100 feet road gets completely waterlogged during heavy rains. This has been a recurring issue for the past 3 years. The drainage system needs immediate attention and upgrades.",
-         None, datetime.now().isoformat(), "resolved"),
+         None, datetime.now().isoformat(), "resolved", "High", "Infrastructure", 12.9784, 77.6408),
         ("Traffic Signal Malfunction", "Traffic Management",
          "Traffic signal at the Silk Board junction has been malfunctioning intermittently, causing major traffic jams during peak hours.",
-         None, datetime.now().isoformat(), "in-progress")
+         None, datetime.now().isoformat(), "in-progress", "High", "Traffic", 12.9177, 77.6238)
     ]
     
-    cursor.executemany('''
-        INSERT INTO complaints (title, department, description, image_path, timestamp, status) 
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', sample_complaints)
-    conn.commit()
+    with _timed("populate_complaints_table"):
+        cursor.executemany('''
+            INSERT INTO complaints (title, department, description, image_path, timestamp, status, severity, category,
+                                    latitude, longitude, tile_x, tile_y)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [sample + tile_xy(*sample[-2:]) for sample in sample_complaints])
+        conn.commit()
     conn.close()
     return {"message": "Table 'complaints' populated with sample data"}
 
-def get_all_complaints():
+def get_all_complaints(include_archived=True):
     conn = sqlite3.connect('test.db')
+    columns = ["id", "title", "department", "description", "image_path", "timestamp",
+               "status", "severity", "category", "version"]
+    keys = ["image" if c == "image_path" else c for c in columns]
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, title, department, description, image_path, timestamp, status 
-        FROM complaints 
-        ORDER BY timestamp DESC
-    ''')
-    complaints = cursor.fetchall()
+    # Dicts only for the complaints SELECT; _select_archived reads PRAGMA rows by position
+    cursor.row_factory = _dict_rows(keys)
+    with _timed("get_all_complaints"):
+        cursor.execute('''
+            SELECT id, title, department, description, image_path, timestamp, status, severity, category, version 
+            FROM complaints 
+            ORDER BY timestamp DESC
+        ''')
+        complaints = cursor.fetchall()
+    if include_archived:
+        archived = [dict(zip(keys, row)) for row in _select_archived(conn.cursor(), columns)]
+        if archived:
+            complaints = sorted(complaints + archived, key=lambda row: row["timestamp"] or "", reverse=True)
     conn.close()
     
-    # Convert to list of dictionaries
-    complaints_list = []
-    for complaint in complaints:
-        complaints_list.append({
-            "id": complaint[0],
-            "title": complaint[1],
-            "department": complaint[2],
-            "description": complaint[3],
-            "image": complaint[4],
-            "timestamp": complaint[5],
-            "status": complaint[6]
-        })
-    
-    return complaints_list
+    return complaints
 
-def add_complaint(title, department, description, image_path=None):
-    conn = sqlite3.connect('test.db')
-    cursor = conn.cursor()
+def add_complaint(title, department, description, image_path=None, severity=None, category=None,
+                  latitude=None, longitude=None):
+    """
+    Insert a complaint; blocks until its group commit is durable
+    """
     timestamp = datetime.now().isoformat()
+    # Complaints without a location are left out of the heatmap
+    tile_x, tile_y = tile_xy(latitude, longitude) if latitude is not None and longitude is not None else (None, None)
     
-    cursor.execute('''
-        INSERT INTO complaints (title, department, description, image_path, timestamp, status) 
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (title, department, description, image_path, timestamp, 'pending'))
-    
-    complaint_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with _timed("add_complaint"):
+        complaint_id = complaint_writer.execute('''
+            INSERT INTO complaints (title, department, description, image_path, timestamp, status, severity, category,
+                                    latitude, longitude, tile_x, tile_y)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (title, department, description, image_path, timestamp, 'pending', severity, category,
+              latitude, longitude, tile_x, tile_y))
     
     return {"id": complaint_id, "message": "Complaint added successfully"}
+
+def get_labeled_complaints(after_id=0, include_archived=True):
+    """
+    Complaints with id > after_id, oldest first, for training the triage classifier
+    """
+    conn = sqlite3.connect('test.db')
+    cursor = conn.cursor()
+    columns = ["id", "title", "description", "department", "severity", "category"]
+    with _timed("get_labeled_complaints"):
+        cursor.execute('''
+            SELECT id, title, description, department, severity, category
+            FROM complaints
+            WHERE id > ?
+            ORDER BY id
+        ''', (after_id,))
+        rows = cursor.fetchall()
+    if include_archived:
+        archived = _select_archived(cursor, columns, "WHERE id > ?", (after_id,))
+        if archived:
+            rows = sorted(rows + archived)
+    conn.close()
+
+    return [
+        {"id": row[0], "title": row[1], "description": row[2],
+         "department": row[3], "severity": row[4], "category": row[5]}
+        for row in rows
+    ]
+
+# Allowed status transitions; resolved complaints can be reopened
+STATUS_TRANSITIONS = {
+    "pending": {"in-progress", "resolved"},
+    "in-progress": {"pending", "resolved"},
+    "resolved": {"in-progress"},
+}
+
+def update_complaint_statuses(updates, atomic=False):
+    """
+    Apply many status transitions in one transaction.
+
+    `updates` is a list of {"id", "status", "version"}; each applies only if the complaint
+    is still at `version` (optimistic concurrency) and the transition is allowed. Updates
+    that do not apply are returned as conflicts; with `atomic`, any conflict rolls back
+    the whole batch.
+    """
+    conn = sqlite3.connect('test.db', timeout=30, isolation_level=None)
+    try:
+        with _timed("update_complaint_statuses"):
+            # Taking the write lock up front keeps the version checks valid until commit
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = json.dumps([update["id"] for update in updates])
+                current = {
+                    row[0]: (row[1], row[2]) for row in conn.execute(
+                        "SELECT id, status, version FROM complaints WHERE id IN (SELECT value FROM json_each(?))",
+                        (ids,)
+                    )
+                }
+
+                applied, conflicts, seen = [], [], set()
+                for update in updates:
+                    complaint_id = update["id"]
+                    if complaint_id not in current:
+                        # Archived complaints are read-only
+                        conflicts.append({"id": complaint_id, "reason": "not_found"})
+                        continue
+                    status, version = current[complaint_id]
+                    conflict = {"id": complaint_id, "current_status": status, "current_version": version}
+                    if complaint_id in seen:
+                        conflicts.append(dict(conflict, reason="duplicate"))
+                    elif version != update["version"]:
+                        conflicts.append(dict(conflict, reason="version_mismatch"))
+                    elif update["status"] not in STATUS_TRANSITIONS.get(status, ()):
+                        conflicts.append(dict(conflict, reason="invalid_transition"))
+                    else:
+                        seen.add(complaint_id)
+                        applied.append({"id": complaint_id, "status": update["status"], "version": version + 1})
+
+                if conflicts and atomic:
+                    conn.execute("ROLLBACK")
+                    return {"updated": [], "conflicts": conflicts}
+
+                conn.executemany(
+                    "UPDATE complaints SET status = ?, version = version + 1 WHERE id = ? AND version = ?",
+                    [(a["status"], a["id"], a["version"] - 1) for a in applied]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+
+    return {"updated": applied, "conflicts": conflicts}
+
+def get_complaint_changes(since=0, limit=500):
+    """
+    Change-feed events with seq > since, oldest first
+    """
+    conn = sqlite3.connect('test.db')
+    cursor = conn.cursor()
+    with _timed("get_complaint_changes"):
+        cursor.execute('''
+            SELECT seq, complaint_id, type, old_status, new_status, version, changed_at
+            FROM complaint_events
+            WHERE seq > ?
+            ORDER BY seq
+            LIMIT ?
+        ''', (since, limit))
+        rows = cursor.fetchall()
+    conn.close()
+
+    return [
+        {"seq": row[0], "complaint_id": row[1], "type": row[2], "old_status": row[3],
+         "new_status": row[4], "version": row[5], "changed_at": row[6]}
+        for row in rows
+    ]
+
+# --- Heatmap tiles ---
+
+def get_tile_version(zoom, x, y, department=None):
+    """
+    Change counter of one tile (optionally one department's counts in it), or None if
+    tiles are not set up in this database
+    """
+    where, params = "zoom = ? AND x = ? AND y = ?", [zoom, x, y]
+    if department is not None:
+        where += " AND department = ?"
+        params.append(department)
+    conn = sqlite3.connect('test.db')
+    try:
+        with _timed("get_tile_version"):
+            return conn.execute(f"SELECT COALESCE(SUM(version), 0) FROM complaint_tiles WHERE {where}", params).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+def get_tile_cells(zoom, x, y, cell_zoom, department=None):
+    """
+    Non-empty (x, y, department, total, open) cells at `cell_zoom` inside tile zoom/x/y,
+    with x and y relative to the tile's top-left cell
+    """
+    side = 1 << (cell_zoom - zoom)
+    first_x, first_y = x * side, y * side
+    # One index seek per cell column: a range on x alone would scan the whole strip of the map
+    columns = ", ".join("?" * side)
+    where = f"zoom = ? AND x IN ({columns}) AND y BETWEEN ? AND ? AND total > 0"
+    params = [cell_zoom, *range(first_x, first_x + side), first_y, first_y + side - 1]
+    if department is not None:
+        where += " AND department = ?"
+        params.append(department)
+    conn = sqlite3.connect('test.db')
+    try:
+        with _timed("get_tile_cells"):
+            rows = conn.execute(f"SELECT x, y, department, total, open FROM complaint_tiles WHERE {where}",
+                                params).fetchall()
+    finally:
+        conn.close()
+    return [(cx - first_x, cy - first_y, department, total, open_count) for cx, cy, department, total, open_count in rows]
+
+# --- Archival of resolved complaints ---
+
+def archive_files():
+    return sorted(glob.glob(os.path.join(ARCHIVE_DIR, "complaints_*.db")))
+
+def _select_archived(cursor, columns, where="", params=()):
+    """
+    Run `SELECT columns FROM complaints where` against every archive file.
+
+    Archives are attached MAX_ATTACHED_ARCHIVES at a time and queried with one UNION ALL
+    per batch. Columns an older archive lacks are read as NULL.
+    """
+    rows = []
+    files = archive_files()
+    for start in range(0, len(files), MAX_ATTACHED_ARCHIVES):
+        batch = files[start:start + MAX_ATTACHED_ARCHIVES]
+        schemas = [f"archive_{i}" for i in range(len(batch))]
+        for schema, path in zip(schemas, batch):
+            cursor.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        try:
+            selects = []
+            for schema in schemas:
+                existing = {row[1] for row in cursor.execute(f"PRAGMA {schema}.table_info(complaints)")}
+                if not existing:
+                    continue
+                select_list = ", ".join(c if c in existing else f"NULL AS {c}" for c in columns)
+                selects.append(f"SELECT {select_list} FROM {schema}.complaints {where}")
+            if selects:
+                with _timed("select_archived"):
+                    cursor.execute(" UNION ALL ".join(selects), tuple(params) * len(selects))
+                    rows += cursor.fetchall()
+        finally:
+            for schema in schemas:
+                cursor.execute(f"DETACH DATABASE {schema}")
+    return rows
+
+def _ensure_archive_table(conn, columns):
+    """
+    Create the attached archive's complaints table from the hot table's columns, and add
+    any the hot table gained since the archive was created
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS archive.complaints AS SELECT * FROM main.complaints WHERE 0")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_complaints_id ON complaints (id)")
+    existing = {row[1] for row in conn.execute("PRAGMA archive.table_info(complaints)")}
+    for name, declared_type in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE archive.complaints ADD COLUMN {name} {declared_type}")
+
+def archive_resolved_complaints(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move resolved complaints older than `older_than_days` into per-month archive files.
+
+    Rows are moved in batches of `batch_size`, each in its own short transaction that
+    copies them to the archive, records an 'archived' change event and deletes them from
+    the hot table, so writers are never blocked for long. Returns the number moved.
+    """
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+    age = "COALESCE(resolved_at, timestamp)"
+    moved = 0
+    conn = sqlite3.connect('test.db', timeout=30, isolation_level=None)
+    try:
+        columns = [(row[1], row[2]) for row in conn.execute("PRAGMA main.table_info(complaints)")]
+        column_list = ", ".join(name for name, _ in columns)
+        months = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT substr({age}, 1, 7) FROM complaints WHERE status = 'resolved' AND {age} < ?",
+            (cutoff,)
+        )]
+        if months:
+            os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+        for month in months:
+            path = os.path.join(ARCHIVE_DIR, f"complaints_{month.replace('-', '_')}.db")
+            conn.execute("ATTACH DATABASE ? AS archive", (path,))
+            try:
+                _ensure_archive_table(conn, columns)
+                while True:
+                    with _timed("archive_resolved_complaints"):
+                        conn.execute("BEGIN IMMEDIATE")
+                        try:
+                            ids = [row[0] for row in conn.execute(
+                                f"""SELECT id FROM main.complaints
+                                    WHERE status = 'resolved' AND {age} < ? AND substr({age}, 1, 7) = ?
+                                    ORDER BY id LIMIT ?""",
+                                (cutoff, month, batch_size)
+                            )]
+                            if ids:
+                                selected = "id IN (SELECT value FROM json_each(?))"
+                                id_list = (json.dumps(ids),)
+                                conn.execute(
+                                    f"INSERT OR REPLACE INTO archive.complaints ({column_list}) "
+                                    f"SELECT {column_list} FROM main.complaints WHERE {selected}", id_list)
+                                conn.execute(
+                                    "INSERT INTO main.complaint_events (complaint_id, type, old_status, new_status, version) "
+                                    f"SELECT id, 'archived', status, status, version FROM main.complaints WHERE {selected}",
+                                    id_list)
+                                conn.execute(f"DELETE FROM main.complaints WHERE {selected}", id_list)
+                            conn.execute("COMMIT")
+                        except Exception:
+                            conn.execute("ROLLBACK")
+                            raise
+                    moved += len(ids)
+                    if len(ids) < batch_size:
+                        break
+            finally:
+                conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+
+    if moved:
+        print(f"Archived {moved} resolved complaints into {ARCHIVE_DIR}/")
+    return moved
+
+# --- Streaming export ---
+
+EXPORT_COLUMNS = ["id", "title", "department", "description", "image_path", "timestamp",
+                  "status", "severity", "category", "version", "resolved_at", "latitude", "longitude"]
+
+def iter_complaints(since=None, until=None, status=None, department=None,
+                    include_archived=True, batch_size=1000):
+    """
+    Yield complaints as batches of EXPORT_COLUMNS tuples, hot table first, then each archive.
+
+    Rows are read with fetchmany from an open cursor, so memory stays constant however
+    many match. `since`/`until` bound the timestamp (ISO strings, until exclusive).
+    Each partition is in id order; there is no global ordering across them.
+    """
+    clauses, params, filtered = [], [], set()
+    for column, clause, value in (("timestamp", "timestamp >= ?", since), ("timestamp", "timestamp < ?", until),
+                                  ("status", "status = ?", status), ("department", "department = ?", department)):
+        if value is not None:
+            clauses.append(clause)
+            params.append(value)
+            filtered.add(column)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    paths = ['test.db'] + (archive_files() if include_archived else [])
+    for path in paths:
+        # StreamingResponse advances the generator from pool threads, one step at a time
+        conn = sqlite3.connect(path, check_same_thread=False)
+        try:
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(complaints)")}
+            # An archive without a filtered column has no matching rows
+            if not existing or not filtered <= existing:
+                continue
+            select_list = ", ".join(c if c in existing else f"NULL AS {c}" for c in EXPORT_COLUMNS)
+            cursor = conn.execute(f"SELECT {select_list} FROM complaints {where} ORDER BY id", params)
+            while True:
+                with _timed("iter_complaints"):
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
@@ -0,0 +1,123 @@
+"""
+Streaming export of complaints as CSV, Parquet or Arrow IPC.
+
+Batches from `db.iter_complaints` are encoded and yielded one at a time, so an export
+holds one batch (EXPORT_BATCH_SIZE rows) in memory however large it is. Parquet gets
+one row group per batch; Arrow is the IPC stream format with one record batch each.
+
+pyarrow is optional: without it only CSV is available. It is imported on the first
+columnar export rather than at module load.
+"""
+
+import io
+import os
+import csv
+import importlib.util
+
+import metrics
+from db import EXPORT_COLUMNS, iter_complaints
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+EXPORT_ROWS = metrics.counter("export_rows_total", "Complaint rows streamed by exports", ("format",))
+
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+class _Chunks:
+    """
+    Write-only file object whose contents are taken after each batch
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_schema(pa):
+    types = {"id": pa.int64(), "version": pa.int64(), "latitude": pa.float64(), "longitude": pa.float64()}
+    return pa.schema([(c, types.get(c, pa.string())) for c in EXPORT_COLUMNS])
+
+
+def _csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        EXPORT_ROWS.inc(len(rows), format="csv")
+        yield buffer.getvalue().encode()
+
+
+def _columnar_chunks(batches, export_format):
+    import pyarrow as pa
+
+    schema = _arrow_schema(pa)
+    sink = _Chunks()
+    if export_format == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        write = writer.write_table
+        to_chunk = lambda columns: pa.Table.from_pydict(columns, schema=schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+        to_chunk = lambda columns: pa.RecordBatch.from_pydict(columns, schema=schema)
+    try:
+        for rows in batches:
+            write(to_chunk(dict(zip(EXPORT_COLUMNS, map(list, zip(*rows))))))
+            EXPORT_ROWS.inc(len(rows), format=export_format)
+            yield sink.take()
+    finally:
+        # The footer (Parquet) or end-of-stream marker (Arrow); also written on an empty export
+        writer.close()
+    yield sink.take()
+
+
+def export_complaints(export_format="csv", batch_size=EXPORT_BATCH_SIZE, **filters):
+    """
+    Generator of encoded chunks of complaints matching `filters` (see `iter_complaints`)
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format '{export_format}', expected one of {', '.join(FORMATS)}")
+    if export_format != "csv" and not PYARROW_AVAILABLE:
+        raise ValueError(f"{export_format} export needs pyarrow, which is not installed")
+    batches = iter_complaints(batch_size=batch_size, **filters)
+    if export_format == "csv":
+        return _csv_chunks(batches)
+    return _columnar_chunks(batches, export_format)
@@ -1,47 +1,275 @@
 import os
-import json
-import base64
-from google import genai
-from google.genai import types
+import time
+import hashlib
+from typing import Literal
 from dotenv import load_dotenv
+from pydantic import BaseModel, Field, ValidationError
+
+import metrics
+import tracing
+import llm_transport
+import model_router
+import singleflight
+from context_cache import GeminiContextCache
 
 load_dotenv()
 
-class GeminiReportGenerator:
+# Parse outcomes of generated reports; failure rate is failed / all outcomes
+REPORT_PARSE = metrics.counter(
+    "civic_report_parse_total", "Gemini civic report parse outcomes (ok, repaired, failed)", ("outcome",))
+
+# Bounded: one extra Gemini call to fix an invalid report, never more
+REPAIR_ATTEMPTS = int(os.getenv("GEMINI_REPAIR_ATTEMPTS", "1"))
+# Requests still unanswered after the hedge delay also go to this model; empty disables hedging
+GEMINI_HEDGE_MODEL = os.getenv("GEMINI_HEDGE_MODEL", "gemini-2.0-flash-lite")
+
+# Token usage reported by the provider; cached prompt tokens are a subset of prompt tokens
+# and are billed at the reduced cached rate
+LLM_TOKENS = metrics.counter(
+    "llm_tokens_total", "Tokens used by LLM calls (prompt, cached, output)", ("provider", "model", "kind"))
+# Prompt processing is what a cached prefix saves, so it shows up in time to first token;
+# compare prefix="cached" against "inline"
+LLM_FIRST_TOKEN_LATENCY = metrics.histogram(
+    "llm_time_to_first_token_seconds", "Time to the first streamed chunk", ("provider", "model", "prefix"))
+
+# The static part of every report request. It is sent as the system instruction, ahead
+# of the user's message, so the prefix is byte-identical across requests and cacheable
+SYSTEM_INSTRUCTION = """You are an AI assistant for Project Sahaya, a civic issue reporting system for Bengaluru, India.
+
+Based on the user's message and optional image, generate a structured civic complaint report.
+
+Fill in every field of the report schema. If an image is provided, incorporate visual analysis into your assessment."""
+
+
+class CivicReport(BaseModel):
+    """Schema of a generated report; also sent to Gemini as the response schema"""
+    title: str = Field(description="Brief descriptive title of the issue")
+    department: str = Field(description="Relevant government department (e.g., Roads & Infrastructure, Waste Management, Electricity, Water Supply, Drainage, Traffic Management, etc.)")
+    severity: Literal["Low", "Medium", "High"]
+    description: str = Field(description="Detailed description of the issue including location details if mentioned")
+    suggested_action: str = Field(description="Recommended action to resolve the issue")
+    estimated_timeline: str = Field(description="Estimated time to resolve (e.g., 1-2 days, 1 week, 1 month)")
+    location: str = Field(description="Extract or infer location from the message if available")
+    category: str = Field(description="Type of issue (Infrastructure, Sanitation, Safety, etc.)")
+
+
+class JSONObjectStream:
+    """
+    Incremental scanner for the first top-level JSON object in streamed text.
+
+    Tracks string/escape state and brace depth across chunks so the stream can be
+    abandoned as soon as the object closes; anything before the opening brace
+    (such as a stray code fence) is dropped.
+    """
+
     def __init__(self):
+        self.parts = []
+        self.depth = 0
+        self.started = False
+        self.complete = False
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk):
+        """Consume a chunk; returns True once the object is complete"""
+        if self.complete:
+            return True
+        begin = 0
+        for i, ch in enumerate(chunk):
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self.depth = 1
+                    begin = i
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.parts.append(chunk[begin:i + 1])
+                    self.complete = True
+                    return True
+        if self.started:
+            self.parts.append(chunk[begin:])
+        return False
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+
+def _extract_json(response_text):
+    """First JSON object in `response_text`, tolerating fences around it"""
+    stream = JSONObjectStream()
+    stream.feed(response_text)
+    return stream.text if stream.started else response_text
+
+
+def parse_report(response_text):
+    """Validate a response against `CivicReport`; raises ValueError when it does not match"""
+    try:
+        return CivicReport.model_validate_json(_extract_json(response_text.strip()))
+    except ValidationError as e:
+        # Compact, model-readable summary used in the repair prompt
+        problems = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'body'}: {err['msg']}" for err in e.errors())
+        raise ValueError(problems) from None
+
+
+def _is_valid_report(response_text):
+    try:
+        parse_report(response_text)
+        return True
+    except ValueError:
+        return False
+
+
+class GeminiReportGenerator:
+    def __init__(self, transport=None, hedge_model=GEMINI_HEDGE_MODEL):
+        self.transport = transport or llm_transport.transport
+        self.model = "gemini-2.0-flash"
+        self.hedge_model = hedge_model or None
+        # Shared by report and repair calls, which have similar latencies
+        self.router = model_router.HedgedRouter("gemini_report")
+        self.context_cache = GeminiContextCache(self.model, SYSTEM_INSTRUCTION, "civic-report-instructions")
+
         api_key = os.getenv("GEMINI_API_KEY")
+        if self.transport.offline:
+            # Replayed responses never reach the API, so no key is needed
+            self.client = None
+            return
         if not api_key:
             raise ValueError("GEMINI_API_KEY not found in environment variables")
-        
+
+        # google-genai takes about a second to import, so it is only loaded once a client is built
+        from google import genai
         self.client = genai.Client(api_key=api_key)
-        self.model = "gemini-2.0-flash"
+
+    def _config(self, system_instruction=None, cached_content=None):
+        from google.genai import types
+        # JSON mode constrained to the report schema, so no fence or offset hunting is needed.
+        # A cached system instruction is referenced by name and must not be resent.
+        return types.GenerateContentConfig(
+            temperature=0.7,
+            max_output_tokens=1000,
+            response_mime_type="application/json",
+            response_schema=CivicReport,
+            system_instruction=None if cached_content else system_instruction,
+            cached_content=cached_content,
+        )
+
+    def _record_usage(self, model, usage):
+        if usage is None:
+            return
+        for kind, count in (("prompt", usage.prompt_token_count), ("cached", usage.cached_content_token_count),
+                            ("output", usage.candidates_token_count)):
+            if count:
+                LLM_TOKENS.inc(count, provider="gemini", model=model, kind=kind)
+
+    def _stream_json(self, model, content_parts, config, cancelled):
+        """
+        Stream the response and stop reading once the JSON object has closed, or once
+        `cancelled` is set because a hedged request answered first and no other request
+        shares this one
+        """
+        from google.genai import types
+        stream = JSONObjectStream()
+        chunks = []
+        usage = None
+        started = time.perf_counter()
+        response = self.client.models.generate_content_stream(
+            model=model,
+            contents=[types.Content(role="user", parts=content_parts)],
+            config=config
+        )
+        try:
+            for chunk in response:
+                # Identical requests merged onto this one by the transport still need it
+                if cancelled.is_set() and singleflight.abandon():
+                    raise model_router.Cancelled(model)
+                if not chunks:
+                    LLM_FIRST_TOKEN_LATENCY.observe(time.perf_counter() - started, provider="gemini", model=model,
+                                                    prefix="cached" if config.cached_content else "inline")
+                # Cumulative; the last chunk read has the most complete counts
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                text = chunk.text or ""
+                chunks.append(text)
+                if stream.feed(text):
+                    break
+        finally:
+            close = getattr(response, "close", None)
+            if close:
+                close()
+        self._record_usage(model, usage)
+        return stream.text if stream.complete else "".join(chunks)
+
+    def _generate_live(self, model, content_parts, system_instruction, cancelled):
+        cache_name = None
+        if system_instruction is not None and system_instruction == self.context_cache.system_instruction \
+                and model == self.context_cache.model:
+            cache_name = self.context_cache.name(self.client)
+        if cache_name is not None:
+            try:
+                return self._stream_json(model, content_parts, self._config(cached_content=cache_name), cancelled)
+            except Exception as e:
+                # Only a cache deleted or expired early is retried; other errors are the caller's
+                if getattr(e, "code", None) not in (403, 404):
+                    raise
+                print(f"Cached context {cache_name} unavailable, retrying inline: {e}")
+                self.context_cache.invalidate(cache_name)
+        return self._stream_json(model, content_parts, self._config(system_instruction), cancelled)
+
+    def _generate(self, step, prompt, content_parts, image_data=None, mime_type=None, system_instruction=None):
+        """
+        Run one request on the primary model, hedged with `hedge_model`; a response that is
+        not a valid report counts as unusable
+        """
+        def backend(model):
+            return model, lambda cancelled: self._generate_with(
+                model, step, prompt, content_parts, image_data, mime_type, system_instruction, cancelled)
+
+        alternate = backend(self.hedge_model) if self.hedge_model else None
+        response_text, _ = self.router.call(backend(self.model), alternate, accept=_is_valid_report)
+        return response_text
+
+    def _generate_with(self, model, step, prompt, content_parts, image_data, mime_type, system_instruction, cancelled):
+        # Keyed on the inline form, so a recording matches with or without a context cache
+        config = self._config(system_instruction)
+        # Everything that affects the answer; the image is identified by its hash
+        request = {
+            "model": model,
+            "prompt": prompt,
+            "image_sha256": hashlib.sha256(image_data).hexdigest() if image_data else None,
+            "mime_type": mime_type if image_data else None,
+            "config": config.model_dump(mode="json", exclude_none=True, exclude={"response_schema"}),
+            "response_schema": CivicReport.model_json_schema(),
+        }
+        with tracing.span("gemini.generate_content", model=model, step=step), \
+                metrics.timed(metrics.LLM_REQUEST_LATENCY, metrics.LLM_REQUESTS, provider="gemini", model=model):
+            return self.transport.call(
+                "gemini", request, lambda: self._generate_live(model, content_parts, system_instruction, cancelled))
     
-    def generate_civic_report(self, message: str, image_data=None):
+    def generate_civic_report(self, message: str, image_data=None, mime_type="image/jpeg"):
         """
         Generate a structured civic complaint report using Gemini AI
+
+        `image_data` is the raw image bytes and `mime_type` their actual type.
+        An invalid response gets at most REPAIR_ATTEMPTS follow-up calls to fix it.
         """
         
-        prompt = f"""
-        You are an AI assistant for Project Sahaya, a civic issue reporting system for Bengaluru, India.
-
-        Based on the user's message and optional image, generate a structured civic complaint report in JSON format.
-
-        User's message: "{message}"
-
-        Please analyze the message and generate a report with the following structure:
-        {{
-            "title": "Brief descriptive title of the issue",
-            "department": "Relevant government department (e.g., Roads & Infrastructure, Waste Management, Electricity, Water Supply, Drainage, Traffic Management, etc.)",
-            "severity": "Low/Medium/High",
-            "description": "Detailed description of the issue including location details if mentioned",
-            "suggested_action": "Recommended action to resolve the issue",
-            "estimated_timeline": "Estimated time to resolve (e.g., 1-2 days, 1 week, 1 month)",
-            "location": "Extract or infer location from the message if available",
-            "category": "Type of issue (Infrastructure, Sanitation, Safety, etc.)"
-        }}
-
-        Make sure the response is a valid JSON object. If an image is provided, incorporate visual analysis into your assessment.
-        """
+        # Only the variable part; the instructions are the cached SYSTEM_INSTRUCTION prefix
+        prompt = f'User\'s message: "{message}"'
+
+        from google.genai import types
 
         try:
             # Prepare content parts
@@ -52,54 +280,54 @@ class GeminiReportGenerator:
                 content_parts.append(
                     types.Part(
                         inline_data=types.Blob(
-                            mime_type="image/jpeg",
+                            mime_type=mime_type,
                             data=image_data
                         )
                     )
                 )
 
-            # Generate content
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=[types.Content(role="user", parts=content_parts)],
-                config=types.GenerateContentConfig(
-                    temperature=0.7,
-                    max_output_tokens=1000,
-                )
-            )
-            
-            # Extract and parse the response
-            response_text = response.text.strip()
-            
-            # Try to extract JSON from the response
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                json_str = response_text[json_start:json_end].strip()
-            else:
-                # Try to find JSON object
-                start_idx = response_text.find("{")
-                end_idx = response_text.rfind("}") + 1
-                if start_idx != -1 and end_idx != 0:
-                    json_str = response_text[start_idx:end_idx]
-                else:
-                    json_str = response_text
-            
-            try:
-                report_data = json.loads(json_str)
-                return {
-                    "success": True,
-                    "report": report_data,
-                    "raw_response": response_text
-                }
-            except json.JSONDecodeError:
-                # If JSON parsing fails, return a fallback structure
+            response_text = self._generate("report", prompt, content_parts, image_data, mime_type,
+                                           system_instruction=SYSTEM_INSTRUCTION)
+
+            outcome = "ok"
+            for attempt in range(REPAIR_ATTEMPTS + 1):
+                try:
+                    report = parse_report(response_text)
+                    break
+                except ValueError as e:
+                    error = str(e)
+                    if attempt == REPAIR_ATTEMPTS:
+                        report = None
+                        break
+                # Text-only repair: the invalid output and the validation errors are enough context
+                outcome = "repaired"
+                repair_prompt = f"""
+        The following civic complaint report does not match the required schema.
+
+        Errors: {error}
+
+        Report:
+        {response_text}
+
+        Return the corrected report as a single JSON object. Keep the content; only fix the structure and values.
+        """
+                response_text = self._generate("repair", repair_prompt, [types.Part(text=repair_prompt)])
+
+            if report is None:
+                REPORT_PARSE.inc(outcome="failed")
                 return {
                     "success": False,
-                    "error": "Failed to parse JSON response",
+                    "error": f"Failed to parse JSON response: {error}",
                     "raw_response": response_text,
                     "fallback_report": self._create_fallback_report(message)
                 }
+
+            REPORT_PARSE.inc(outcome=outcome)
+            return {
+                "success": True,
+                "report": report.model_dump(),
+                "raw_response": response_text
+            }
                 
         except Exception as e:
             return {
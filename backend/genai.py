@@ -11,6 +11,8 @@ from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 from dotenv import load_dotenv
 
+import metrics
+
 load_dotenv()
 warnings.filterwarnings("ignore", category=ResourceWarning)
 
@@ -81,14 +83,15 @@ class MCPGeminiAgent:
             for tool in mcp_tools.tools
         ])
         self.tools = tools
-        response = await self.genai_client.aio.models.generate_content(
-            model=self.model,
-            contents=contents,
-            config=types.GenerateContentConfig(
-                temperature=0,
-                tools=[tools],
-            ),
-        )
+        with metrics.timed(metrics.LLM_REQUEST_LATENCY, metrics.LLM_REQUESTS, provider="gemini", model=self.model):
+            response = await self.genai_client.aio.models.generate_content(
+                model=self.model,
+                contents=contents,
+                config=types.GenerateContentConfig(
+                    temperature=0,
+                    tools=[tools],
+                ),
+            )
         contents.append(response.candidates[0].content)
         turn_count = 0
         max_tool_turns = 5
@@ -101,7 +104,8 @@ class MCPGeminiAgent:
                 print(f"Invoking MCP tool '{tool_name}' with arguments: {args}")
                 tool_response: dict
                 try:
-                    tool_result = await self.session.call_tool(tool_name, args)
+                    with metrics.timed(metrics.TOOL_CALL_LATENCY, metrics.TOOL_CALLS, tool=tool_name, side="client"):
+                        tool_result = await self.session.call_tool(tool_name, args)
                     print(f"Tool '{tool_name}' executed.")
                     if tool_result.isError:
                         tool_response = {"error": tool_result.content[0].text}
@@ -117,14 +121,15 @@ class MCPGeminiAgent:
             contents.append(types.Content(role="user", parts=tool_response_parts))
             print(f"Added {len(tool_response_parts)} tool response(s) to the conversation.")
             print("Requesting updated response from Gemini...")
-            response = await self.genai_client.aio.models.generate_content(
-                model=self.model,
-                contents=contents,
-                config=types.GenerateContentConfig(
-                    temperature=1.0,
-                    tools=[tools],
-                ),
-            )
+            with metrics.timed(metrics.LLM_REQUEST_LATENCY, metrics.LLM_REQUESTS, provider="gemini", model=self.model):
+                response = await self.genai_client.aio.models.generate_content(
+                    model=self.model,
+                    contents=contents,
+                    config=types.GenerateContentConfig(
+                        temperature=1.0,
+                        tools=[tools],
+                    ),
+                )
             contents.append(response.candidates[0].content)
         if turn_count >= max_tool_turns and response.function_calls:
             print(f"Stopped after {max_tool_turns} tool calls to avoid infinite loops.")
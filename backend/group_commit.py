@@ -0,0 +1,158 @@
+"""
+Group commit for SQLite inserts.
+
+Every caller that opens its own connection and commits pays one fsync per row, so
+insert throughput is capped by disk sync latency. A GroupCommitWriter owns a single
+connection on a writer thread: statements submitted while the previous commit was
+syncing (plus, optionally, any arriving within GROUP_COMMIT_WAIT_MS of the first one)
+are executed in one transaction and committed together, then every caller gets its
+row id. A call only returns once its row is committed, so acknowledgements stay durable.
+
+Each statement runs in its own savepoint, so one failing insert is reported to its
+caller without rolling back the rest of the batch. If the connection cannot be opened or
+a batch fails as a whole, that batch's callers get the error and the writer reconnects
+for the next one; callers also stop waiting after GROUP_COMMIT_TIMEOUT seconds.
+
+Usage:
+    writer = GroupCommitWriter("test.db", "complaints")
+    row_id = writer.execute("INSERT INTO ... VALUES (?, ?)", (a, b))        # threads
+    row_id = await writer.execute_async("INSERT INTO ... VALUES (?, ?)", (a, b))
+"""
+
+import os
+import time
+import queue
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import metrics
+
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "1") == "1"
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "256"))
+# Longest a statement waits for others to join its batch when the writer is idle; under
+# load batches fill up during the previous commit anyway, so the default is not to wait
+GROUP_COMMIT_WAIT_MS = float(os.getenv("GROUP_COMMIT_WAIT_MS", "0"))
+# Longest a caller waits for its commit; covers the 30s busy timeout of the connection
+GROUP_COMMIT_TIMEOUT = float(os.getenv("GROUP_COMMIT_TIMEOUT", "60"))
+
+GROUP_COMMIT_BATCH = metrics.histogram(
+    "group_commit_batch_size", "Statements committed together", ("writer",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+GROUP_COMMIT_LATENCY = metrics.histogram(
+    "group_commit_duration_seconds", "Time from submitting a statement to its commit", ("writer",))
+
+
+class GroupCommitWriter:
+    def __init__(self, db_path, name, max_batch=GROUP_COMMIT_MAX_BATCH, wait_ms=GROUP_COMMIT_WAIT_MS):
+        self.db_path = db_path
+        self.name = name
+        self.max_batch = max_batch
+        self.wait = wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, sql, params=()):
+        """
+        Queue a statement; the returned Future resolves to its lastrowid once committed
+        """
+        future = Future()
+        if not GROUP_COMMIT_ENABLED:
+            try:
+                future.set_result(self._execute_alone(sql, params))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._ensure_started()
+        self._queue.put((sql, params, future, time.perf_counter()))
+        return future
+
+    def execute(self, sql, params=(), timeout=GROUP_COMMIT_TIMEOUT):
+        try:
+            return self.submit(sql, params).result(timeout)
+        except FutureTimeoutError:
+            raise self._timeout_error(timeout) from None
+
+    async def execute_async(self, sql, params=(), timeout=GROUP_COMMIT_TIMEOUT):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self.submit(sql, params)), timeout)
+        except asyncio.TimeoutError:
+            raise self._timeout_error(timeout) from None
+
+    def _timeout_error(self, timeout):
+        # A database error, so callers report it like any other failed write
+        return sqlite3.OperationalError(f"{self.name} writer did not commit within {timeout:g}s")
+
+    def _execute_alone(self, sql, params):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            row_id = conn.execute(sql, params).lastrowid
+            conn.commit()
+            return row_id
+        finally:
+            conn.close()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    # A daemon: pending callers are waiting on it, so it never outlives them
+                    self._thread = threading.Thread(target=self._run, name=f"group-commit-{self.name}", daemon=True)
+                    self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.wait
+        while len(batch) < self.max_batch:
+            try:
+                # Whatever queued up during the last commit is taken without waiting
+                remaining = deadline - time.perf_counter()
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+
+    def _run(self):
+        conn = None
+        while True:
+            batch = self._next_batch()
+            results = []
+            try:
+                if conn is None:
+                    conn = self._connect()
+                conn.execute("BEGIN IMMEDIATE")
+                for sql, params, _, _ in batch:
+                    conn.execute("SAVEPOINT statement")
+                    try:
+                        results.append((conn.execute(sql, params).lastrowid, None))
+                        conn.execute("RELEASE statement")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO statement")
+                        conn.execute("RELEASE statement")
+                        results.append((None, e))
+                conn.execute("COMMIT")
+            except Exception as e:
+                # Connecting or the commit itself failed (e.g. unopenable path, disk full, locked
+                # too long): nothing was written. The connection is dropped, so the next batch
+                # starts from a fresh one
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+                results = [(None, e)] * len(batch)
+
+            GROUP_COMMIT_BATCH.observe(len(batch), writer=self.name)
+            now = time.perf_counter()
+            for (_, _, future, submitted), (row_id, error) in zip(batch, results):
+                GROUP_COMMIT_LATENCY.observe(now - submitted, writer=self.name)
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(row_id)
@@ -0,0 +1,201 @@
+import io
+import os
+import time
+import uuid
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+import metrics
+import tracing
+
+# Gemini tiles images at 768px and gains little above ~1.5k on the long side
+MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1536"))
+THUMBNAIL_SIDE = int(os.getenv("IMAGE_THUMBNAIL_SIDE", "320"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "thumbnails")
+
+IMAGE_BYTES = metrics.counter(
+    "image_preprocess_bytes_total", "Image bytes before (in) and after (out) preprocessing", ("direction",))
+IMAGE_PREPROCESS_LATENCY = metrics.histogram(
+    "image_preprocess_duration_seconds", "Latency added by image preprocessing", ("outcome",))
+
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+]
+
+
+def sniff_mime_type(data: bytes):
+    """
+    Detect the image MIME type from its magic bytes, ignoring whatever the client claimed
+    """
+    for signature, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp":
+        brand = data[8:12]
+        if brand in (b"heic", b"heix", b"mif1", b"msf1"):
+            return "image/heic"
+        if brand == b"avif":
+            return "image/avif"
+    return None
+
+
+# Image.info keys of embedded metadata; EXIF may carry GPS coordinates
+_METADATA_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "icc_profile", "comment")
+
+
+def _has_metadata(image):
+    return any(image.info.get(key) for key in _METADATA_KEYS) or len(image.getexif()) > 0
+
+
+def preprocess_image(data: bytes):
+    """
+    Strip metadata, downscale and re-encode an uploaded image.
+
+    Runs inside a worker process, so it only takes and returns plain picklable values.
+    """
+    mime_type = sniff_mime_type(data)
+    if mime_type is None:
+        raise ValueError("Unsupported or corrupt image upload")
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception:
+        # Formats Pillow cannot decode here (e.g. HEIC without a plugin) cannot be stripped
+        # of their metadata, so they are not accepted
+        raise ValueError(f"Cannot process {mime_type} images; upload a JPEG or PNG") from None
+
+    has_metadata = _has_metadata(image)
+    # Apply the EXIF orientation before the metadata is dropped
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+
+    image.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+
+    # Re-encoding without passing exif/icc info strips all metadata (GPS included)
+    out = io.BytesIO()
+    if has_alpha:
+        image.convert("RGBA").save(out, format="PNG", optimize=True)
+        out_mime_type = "image/png"
+    else:
+        image.convert("RGB").save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        out_mime_type = "image/jpeg"
+    processed = out.getvalue()
+
+    # Keep the original when re-encoding did not actually shrink it, unless that would
+    # send its metadata along
+    if len(processed) >= len(data) and out_mime_type == mime_type and not has_metadata:
+        processed = data
+
+    thumb = image.convert("RGB")
+    thumb.thumbnail((THUMBNAIL_SIDE, THUMBNAIL_SIDE), Image.LANCZOS)
+    thumb_out = io.BytesIO()
+    thumb.save(thumb_out, format="JPEG", quality=75, optimize=True)
+
+    return {"data": processed, "mime_type": out_mime_type, "thumbnail": thumb_out.getvalue()}
+
+
+class ImagePreprocessor:
+    """
+    Runs `preprocess_image` in a process pool and keeps running totals of its effect
+    """
+
+    def __init__(self, max_workers=None, thumbnail_dir=THUMBNAIL_DIR):
+        self.max_workers = max_workers or int(os.getenv("IMAGE_WORKERS", "2"))
+        self.thumbnail_dir = thumbnail_dir
+        self._executor = None
+        self.stats = {
+            "images_processed": 0,
+            "images_failed": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "bytes_saved": 0,
+            "total_latency_ms": 0.0,
+            "max_latency_ms": 0.0,
+        }
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    async def process(self, data: bytes):
+        """
+        Preprocess an upload and save its thumbnail.
+
+        Returns a dict with the processed `data`, its `mime_type` and the `thumbnail_url`
+        (None when no thumbnail could be made).
+        """
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            with tracing.span("image.preprocess", bytes_in=len(data)):
+                result = await loop.run_in_executor(self._get_executor(), preprocess_image, data)
+        except Exception:
+            self.stats["images_failed"] += 1
+            IMAGE_PREPROCESS_LATENCY.observe(time.perf_counter() - start, outcome="error")
+            raise
+
+        thumbnail_url = None
+        if result["thumbnail"]:
+            thumbnail_url = self._save_thumbnail(result["thumbnail"])
+
+        latency = time.perf_counter() - start
+        IMAGE_PREPROCESS_LATENCY.observe(latency, outcome="ok")
+        IMAGE_BYTES.inc(len(data), direction="in")
+        IMAGE_BYTES.inc(len(result["data"]), direction="out")
+
+        latency_ms = latency * 1000
+        self.stats["images_processed"] += 1
+        self.stats["bytes_in"] += len(data)
+        self.stats["bytes_out"] += len(result["data"])
+        self.stats["bytes_saved"] += len(data) - len(result["data"])
+        self.stats["total_latency_ms"] += latency_ms
+        self.stats["max_latency_ms"] = max(self.stats["max_latency_ms"], latency_ms)
+
+        return {
+            "data": result["data"],
+            "mime_type": result["mime_type"],
+            "thumbnail_url": thumbnail_url,
+            "original_size": len(data),
+            "processed_size": len(result["data"]),
+            "latency_ms": round(latency_ms, 2),
+        }
+
+    def _save_thumbnail(self, thumbnail: bytes):
+        os.makedirs(self.thumbnail_dir, exist_ok=True)
+        name = f"{uuid.uuid4().hex}.jpg"
+        with open(os.path.join(self.thumbnail_dir, name), "wb") as f:
+            f.write(thumbnail)
+        return f"/api/thumbnails/{name}"
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        processed = stats["images_processed"]
+        stats["avg_latency_ms"] = round(stats["total_latency_ms"] / processed, 2) if processed else 0.0
+        stats["compression_ratio"] = round(stats["bytes_out"] / stats["bytes_in"], 3) if stats["bytes_in"] else None
+        return stats
+
+    def warm_up(self):
+        """
+        Start every pool worker now rather than on the first uploads
+        """
+        executor = self._get_executor()
+        for future in [executor.submit(os.getpid) for _ in range(self.max_workers)]:
+            future.result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
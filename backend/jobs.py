@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import asyncio
+
+import tracing
+
+JOBS_DB = os.getenv("JOBS_DB", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "4"))
+JOB_BACKOFF_SECONDS = float(os.getenv("JOB_BACKOFF_SECONDS", "2"))
+# A job whose worker died is picked up again once its lease runs out
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+
+class RetryableJobError(Exception):
+    """Raised by a job handler when the job should be retried with backoff"""
+
+
+class JobQueue:
+    """
+    Durable job queue stored in a local SQLite file.
+
+    Jobs move queued -> running -> done/failed. Running jobs hold a lease, so jobs
+    left behind by a crash or restart become claimable again once it expires, unless
+    that was their last attempt (a job that keeps killing its worker fails instead).
+    The attempt number identifies the lease: a worker whose job was reclaimed can no
+    longer complete, fail or release it.
+    """
+
+    def __init__(self, db_path=JOBS_DB, max_attempts=JOB_MAX_ATTEMPTS,
+                 backoff_seconds=JOB_BACKOFF_SECONDS, lease_seconds=JOB_LEASE_SECONDS):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.lease_seconds = lease_seconds
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def initialize(self):
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    run_at REAL NOT NULL,
+                    lease_until REAL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs (status, run_at)")
+        finally:
+            conn.close()
+
+    def enqueue(self, kind, payload):
+        # Carry the submitting request's trace so the job's spans join it
+        traceparent = tracing.current_traceparent()
+        if traceparent:
+            payload = dict(payload, _traceparent=traceparent)
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, run_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), now, now, now)
+            )
+        finally:
+            conn.close()
+        return job_id
+
+    def claim(self):
+        """
+        Atomically take the next due job, or return None when there is nothing to do
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, payload = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE status = 'running' AND lease_until <= ? AND attempts >= ?",
+                ("Lease expired on the last attempt; its worker probably died", now, now, self.max_attempts)
+            )
+            row = conn.execute('''
+                SELECT * FROM jobs
+                WHERE (status = 'queued' AND run_at <= ?)
+                   OR (status = 'running' AND lease_until <= ?)
+                ORDER BY run_at
+                LIMIT 1
+            ''', (now, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE id = ?",
+                (now + self.lease_seconds, now, row["id"])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        job = dict(row)
+        job["attempts"] += 1
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def complete(self, job_id, attempts, result):
+        """
+        Store the result of attempt `attempts`; returns False if that lease was lost
+        """
+        # The payload (which may hold an image) is no longer needed once the job is done
+        return self._update(job_id, attempts, status="done", result=json.dumps(result), payload=None, lease_until=None)
+
+    def fail(self, job_id, attempts, error, final=False):
+        """
+        Record a failed attempt, rescheduling with exponential backoff until attempts run out
+        (or straight away when `final`); returns whether the job will be retried
+        """
+        if final or attempts >= self.max_attempts:
+            self._update(job_id, attempts, status="failed", error=error, payload=None, lease_until=None)
+            return False
+        delay = self.backoff_seconds * (2 ** (attempts - 1))
+        delay += random.uniform(0, delay / 2)
+        return self._update(job_id, attempts, status="queued", error=error, run_at=time.time() + delay, lease_until=None)
+
+    def release(self, job_id, attempts):
+        """
+        Hand a running job back to the queue without counting the attempt (used on shutdown)
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, lease_until = NULL, run_at = ?, updated_at = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+                (now, now, job_id, attempts)
+            )
+        finally:
+            conn.close()
+
+    def _update(self, job_id, attempts, **fields):
+        """
+        Update a job still running attempt `attempts`; returns False if it was reclaimed since
+        """
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND status = 'running' AND attempts = ?",
+                (*fields.values(), job_id, attempts)
+            )
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def get(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT id, kind, status, attempts, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+
+class JobWorkerPool:
+    """
+    Pulls jobs from a `JobQueue` and runs their (blocking) handlers in threads.
+
+    `handlers` maps a job kind to `handler(payload, last_attempt)`. A handler raising
+    `RetryableJobError` (or any other exception) gets the job retried with backoff.
+    """
+
+    def __init__(self, queue, handlers, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._tasks = []
+
+    async def start(self):
+        await asyncio.to_thread(self.queue.initialize)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"Started {self.workers} job workers on {self.queue.db_path}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, index):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.queue.claim)
+            except sqlite3.Error as e:
+                print(f"Job worker {index} could not claim a job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            await self._run(job)
+
+    async def _run(self, job):
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            await asyncio.to_thread(self.queue.fail, job["id"], job["attempts"], f"Unknown job kind '{job['kind']}'", True)
+            return
+        last_attempt = job["attempts"] >= self.queue.max_attempts
+        payload = job["payload"]
+        try:
+            with tracing.span(f"job {job['kind']}", payload.pop("_traceparent", None),
+                              job_id=job["id"], attempt=job["attempts"]):
+                result = await asyncio.to_thread(handler, payload, last_attempt)
+        except asyncio.CancelledError:
+            # Shutting down: put the job back so the next start picks it up straight away
+            self.queue.release(job["id"], job["attempts"])
+            raise
+        except Exception as e:
+            retrying = await asyncio.to_thread(self.queue.fail, job["id"], job["attempts"], str(e))
+            print(f"Job {job['id']} attempt {job['attempts']} failed: {e}" + (" (will retry)" if retrying else ""))
+            return
+        if not await asyncio.to_thread(self.queue.complete, job["id"], job["attempts"], result):
+            print(f"Job {job['id']} attempt {job['attempts']} finished after its lease was reclaimed; result dropped")
@@ -1,7 +1,14 @@
 from fastmcp import FastMCP
 
+import metrics
+import tracing
+import llm_transport
+import singleflight
+import tool_pool
+
 
 mcp = FastMCP("Hospital")
+metrics.install_mcp(mcp)
 
 import os
 from dotenv import load_dotenv
@@ -15,32 +22,61 @@ from typing import Any
 
 
 #---------------------------
-from mariadb import connect, Error
-
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import threading
 
 user = os.getenv("DB_USERNAME")
 password = os.getenv("DB_PASSWORD")
 database = os.getenv("DB_NAME")
 host = os.getenv("DB_HOST")
-port = int(os.getenv("DB_PORT"))
+port = int(os.getenv("DB_PORT", "3306"))
+
+# Identical read queries running at the same time share one round trip
+read_queries = singleflight.Group("mariadb")
+
+# Tools run on the tool_pool workers; at most this many database tools query at once, and
+# MedGEMMA calls (one local Ollama model) are capped separately so they cannot take every
+# worker. Connections are per thread (below), so up to MCP_TOOL_WORKERS of them stay open
+DB_TOOL_CONCURRENCY = int(os.getenv("DB_TOOL_CONCURRENCY", "8"))
+DB_TOOL_TIMEOUT = float(os.getenv("DB_TOOL_TIMEOUT", "30"))
+MEDGEMMA_CONCURRENCY = int(os.getenv("MEDGEMMA_CONCURRENCY", "2"))
+MEDGEMMA_TIMEOUT = float(os.getenv("MEDGEMMA_TIMEOUT", "300"))
 
+# A MariaDB connection must not be used by two threads at once, so each worker thread
+# keeps its own, connected on first use so the server starts even when MariaDB is down
+_local = threading.local()
 
-try:
-    connection = connect(user=user, password=password, host=host, database=database, port=port)
-    print("Connection to MariaDB Platform successful")
-except Error as e:
-    print(f"Error connecting to MariaDB Platform: {e}")
+
+def get_connection():
+    """
+    Return this thread's MariaDB connection, connecting if it has none yet.
+
+    Raises mariadb.Error when the database is unreachable; the next call retries.
+    """
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        from mariadb import connect
+        connection = _local.connection = connect(user=user, password=password, host=host, database=database, port=port)
+        print("Connection to MariaDB Platform successful")
+    return connection
+
+
+def warm_up():
+    """Import the driver and check MariaDB is reachable while the server starts accepting requests"""
+    try:
+        get_connection().close()
+        _local.connection = None
+    except Exception as e:
+        print(f"Error connecting to MariaDB Platform: {e}")
 
 #--------------------------
 
     
 AI_URL = "http://192.168.53.197:5001/predict/"
 
-@mcp.tool("Get_Diabetes_Score")
+@mcp.tool("Get_Diabetes_Score", annotations={"readOnlyHint": True})
+@metrics.track_tool("Get_Diabetes_Score")
+@tracing.traced_tool("Get_Diabetes_Score")
+@tool_pool.blocking_tool("Get_Diabetes_Score")
 def get_diabetes_score(
     age: int,
     gender: str,
@@ -100,7 +136,10 @@ def get_diabetes_score(
 
 
 
-@mcp.tool("Get_Cardiovascular_Score")
+@mcp.tool("Get_Cardiovascular_Score", annotations={"readOnlyHint": True})
+@metrics.track_tool("Get_Cardiovascular_Score")
+@tracing.traced_tool("Get_Cardiovascular_Score")
+@tool_pool.blocking_tool("Get_Cardiovascular_Score")
 def get_cardiovascular_score(
     age: int,
     gender: int,
@@ -146,38 +185,59 @@ def get_cardiovascular_score(
         }
     
 #TODO
-def execute_query(query: str) -> str:
+def execute_query(query: str, label: str = "execute_query") -> str:
     """
     Executes a SQL query on the hospital database.
 
     Args:
         query (str): The SQL query to execute.
+        label (str): Name the query is reported under in metrics.
 
     Returns:
         str: The result of the query execution.
     """
+    if query.strip().upper().startswith(("SELECT", "SHOW", "DESCRIBE")):
+        result, _ = read_queries.do(query, lambda: _execute_query(query, label))
+        return result
+    return _execute_query(query, label)
+
+
+def _execute_query(query: str, label: str) -> str:
     cursor = None
     try:
-        cursor = connection.cursor()
-        cursor.execute(query)
-
-        # For SELECT or SHOW queries, fetch and return results
-        if query.strip().upper().startswith(("SELECT", "SHOW", "DESCRIBE")):
-            result = cursor.fetchall()
-            return str(result)
-        # For INSERT, UPDATE, DELETE, commit and return affected rows
-        else:
-            connection.commit()
-            return f"Query executed successfully. Rows affected: {cursor.rowcount}"
-
-    except Error as e:
+        # The SQL itself has patient ids and record text inlined, so only the label and the
+        # operation are recorded, never the statement
+        operation = query.split(None, 1)[0].upper() if query.strip() else ""
+        with tracing.span(f"db {label}", **{"db.system": "mariadb", "db.operation": operation}), \
+                metrics.timed(metrics.DB_QUERY_LATENCY, metrics.DB_QUERIES, db="mariadb", query=label):
+            connection = get_connection()
+            cursor = connection.cursor()
+            cursor.execute(query)
+
+            # For SELECT or SHOW queries, fetch and return results
+            if query.strip().upper().startswith(("SELECT", "SHOW", "DESCRIBE")):
+                result = cursor.fetchall()
+                return str(result)
+            # For INSERT, UPDATE, DELETE, commit and return affected rows
+            else:
+                connection.commit()
+                return f"Query executed successfully. Rows affected: {cursor.rowcount}"
+
+    except Exception as e:
+        # mariadb.Error (imported lazily with the driver) or a failed connection
+        if type(e).__name__ in ("InterfaceError", "OperationalError"):
+            # The connection may be dead; this thread reconnects on its next query
+            _local.connection = None
         return f"Error executing query: {e}"
     finally:
         if cursor:
             cursor.close()
 
 
-@mcp.tool("Get_Patient_Data")
+@mcp.tool("Get_Patient_Data", annotations={"readOnlyHint": True})
+@metrics.track_tool("Get_Patient_Data")
+@tracing.traced_tool("Get_Patient_Data")
+@tool_pool.blocking_tool("Get_Patient_Data", max_concurrency=DB_TOOL_CONCURRENCY, timeout=DB_TOOL_TIMEOUT)
 def get_patient_data(patient_id: int) -> str:
     """
     Get the patient data for a given patient ID.
@@ -188,9 +248,12 @@ def get_patient_data(patient_id: int) -> str:
     Returns:
         str: A dictionary containing the patient's data.
     """
-    return execute_query(f"SELECT * FROM patients WHERE id = {patient_id}")
+    return execute_query(f"SELECT * FROM patients WHERE id = {patient_id}", label="get_patient_data")
 
-@mcp.tool("Get_Lab_Reports")
+@mcp.tool("Get_Lab_Reports", annotations={"readOnlyHint": True})
+@metrics.track_tool("Get_Lab_Reports")
+@tracing.traced_tool("Get_Lab_Reports")
+@tool_pool.blocking_tool("Get_Lab_Reports", max_concurrency=DB_TOOL_CONCURRENCY, timeout=DB_TOOL_TIMEOUT)
 def get_lab_reports(patient_id: int) -> str:
     """
     Get all lab reports for a given patient ID.
@@ -201,9 +264,12 @@ def get_lab_reports(patient_id: int) -> str:
     Returns:
         str: A list of dictionaries containing the patient's lab reports.
     """
-    return execute_query(f"SELECT * FROM lab_report WHERE patient_id = {patient_id}")
+    return execute_query(f"SELECT * FROM lab_report WHERE patient_id = {patient_id}", label="get_lab_reports")
 
-@mcp.tool("Get_EMH")
+@mcp.tool("Get_EMH", annotations={"readOnlyHint": True})
+@metrics.track_tool("Get_EMH")
+@tracing.traced_tool("Get_EMH")
+@tool_pool.blocking_tool("Get_EMH", max_concurrency=DB_TOOL_CONCURRENCY, timeout=DB_TOOL_TIMEOUT)
 def get_emh(patient_id: int) -> str:
     """
     Get the EMH record for a given patient ID.
@@ -214,9 +280,12 @@ def get_emh(patient_id: int) -> str:
     Returns:
         str: A dictionary containing the patient's EMH record.
     """
-    return execute_query(f"SELECT * FROM EMH WHERE patient_id = {patient_id}")
+    return execute_query(f"SELECT * FROM EMH WHERE patient_id = {patient_id}", label="get_emh")
 
 @mcp.tool("Update_EMH")
+@metrics.track_tool("Update_EMH")
+@tracing.traced_tool("Update_EMH")
+@tool_pool.blocking_tool("Update_EMH", max_concurrency=DB_TOOL_CONCURRENCY, timeout=DB_TOOL_TIMEOUT)
 def update_emh(patient_id: int, record: str) -> str:
     """
     Update the EMH record for a given patient.
@@ -228,10 +297,13 @@ def update_emh(patient_id: int, record: str) -> str:
     Returns:
         str: Confirmation of the update.
     """
-    return execute_query(f"UPDATE EMH SET record = '{record}' WHERE patient_id = {patient_id}")
+    return execute_query(f"UPDATE EMH SET record = '{record}' WHERE patient_id = {patient_id}", label="update_emh")
     
 
-@mcp.tool("Chat_With_Med_GEMMA")
+@mcp.tool("Chat_With_Med_GEMMA", annotations={"readOnlyHint": True})
+@metrics.track_tool("Chat_With_Med_GEMMA")
+@tracing.traced_tool("Chat_With_Med_GEMMA")
+@tool_pool.blocking_tool("Chat_With_Med_GEMMA", max_concurrency=MEDGEMMA_CONCURRENCY, timeout=MEDGEMMA_TIMEOUT)
 def chat_with_medgemma(
     summary: str,
     symptoms: str,
@@ -258,14 +330,16 @@ def chat_with_medgemma(
     )
 
     model = ChatOllama(model="alibayram/medgemma:4b", temperature=0)
-    response = model.invoke(message)
-    return response.content
+    request = {"model": model.model, "temperature": 0, "message": message}
+    with tracing.span("ollama.invoke", model=model.model), \
+            metrics.timed(metrics.LLM_REQUEST_LATENCY, metrics.LLM_REQUESTS, provider="ollama", model=model.model):
+        return llm_transport.transport.call("ollama", request, lambda: model.invoke(message).content)
+
+
+# Imported by the worker processes when MCP_WORKERS > 1
+app = tool_pool.http_app(mcp)
 
 
 if __name__ == "__main__":
-    mcp.run(
-        transport="http",
-        host="0.0.0.0",
-        port=8005,
-        log_level="debug"
-    )
\ No newline at end of file
+    threading.Thread(target=warm_up, daemon=True).start()
+    tool_pool.run(mcp, "llm:app", port=8005)
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+Record/replay layer in front of the LLM backends.
+
+LLM_TRANSPORT_MODE selects how calls made through `transport.call` behave:
+
+- passthrough (default): call the live model
+- record: call the live model and append the request, response and latency to the cassette store
+- replay: answer from the cassette store without touching the network, sleeping for the
+  recorded latency times LLM_REPLAY_LATENCY_SCALE (0 disables the delay)
+
+The store is one gzip-compressed JSON-lines file per provider in LLM_CASSETTE_DIR.
+Entries are keyed by a hash of the canonical request, so a replay only matches a call
+with the same model, parameters and prompt.
+
+Live calls are coalesced on the same key: identical requests that arrive while one is
+in flight wait for it and get a copy of its response (see singleflight.py).
+"""
+
+import os
+import copy
+import gzip
+import json
+import time
+import hashlib
+import threading
+
+import metrics
+import singleflight
+
+MODES = ("passthrough", "record", "replay")
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode when no recording matches the request"""
+
+
+def request_key(provider, request):
+    canonical = json.dumps({"provider": provider, "request": request}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _identity(value):
+    return value
+
+
+class LLMTransport:
+    def __init__(self, mode="passthrough", cassette_dir="cassettes", latency_scale=1.0):
+        if mode not in MODES:
+            raise ValueError(f"LLM_TRANSPORT_MODE must be one of {', '.join(MODES)}, got '{mode}'")
+        self.mode = mode
+        self.cassette_dir = cassette_dir
+        self.latency_scale = latency_scale
+        self._cassettes = {}
+        self._lock = threading.Lock()
+        self._inflight = singleflight.Group("llm")
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            mode=os.getenv("LLM_TRANSPORT_MODE", "passthrough"),
+            cassette_dir=os.getenv("LLM_CASSETTE_DIR", "cassettes"),
+            latency_scale=float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1.0")),
+        )
+
+    @property
+    def offline(self):
+        """True when live clients are never called and need no credentials"""
+        return self.mode == "replay"
+
+    def _path(self, provider):
+        return os.path.join(self.cassette_dir, f"{provider}.jsonl.gz")
+
+    def _cassette(self, provider):
+        with self._lock:
+            cassette = self._cassettes.get(provider)
+            if cassette is None:
+                cassette = self._cassettes[provider] = {}
+                path = self._path(provider)
+                if os.path.exists(path):
+                    # The file is a series of gzip members; later recordings win
+                    with gzip.open(path, "rt", encoding="utf-8") as f:
+                        for line in f:
+                            entry = json.loads(line)
+                            cassette[entry["key"]] = entry
+            return cassette
+
+    def _save(self, provider, entry):
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8")
+        cassette = self._cassette(provider)
+        with self._lock:
+            os.makedirs(self.cassette_dir, exist_ok=True)
+            # One gzip member per entry, appended in a single write
+            with open(self._path(provider), "ab") as f:
+                f.write(gzip.compress(line))
+            cassette[entry["key"]] = entry
+
+    def _lookup(self, provider, request):
+        key = request_key(provider, request)
+        entry = self._cassette(provider).get(key)
+        metrics.record_cache(f"cassette:{provider}", entry is not None)
+        if entry is None:
+            raise CassetteMiss(f"No {provider} recording for request {key[:12]} in {self.cassette_dir}")
+        return entry
+
+    def _record(self, provider, key, request, response, latency):
+        self._save(provider, {
+            "key": key,
+            "provider": provider,
+            "request": request,
+            "response": response,
+            "latency": round(latency, 4),
+            "recorded_at": time.time(),
+        })
+
+    def call(self, provider, request, live_call, encode=_identity, decode=_identity):
+        """
+        Run `live_call()` (blocking) according to the mode.
+
+        `request` is a JSON-serializable description of everything that affects the answer.
+        `encode`/`decode` convert the live response to and from JSON for the store.
+        """
+        if self.mode == "replay":
+            entry = self._lookup(provider, request)
+            if self.latency_scale > 0:
+                time.sleep(entry["latency"] * self.latency_scale)
+            return decode(entry["response"])
+
+        key = request_key(provider, request)
+        response, shared = self._inflight.do(key, lambda: self._live(provider, key, request, live_call, encode))
+        # Callers sharing a response each get their own copy
+        return decode(copy.deepcopy(encode(response))) if shared else response
+
+    def _live(self, provider, key, request, live_call, encode):
+        start = time.perf_counter()
+        response = live_call()
+        if self.mode == "record":
+            self._record(provider, key, request, encode(response), time.perf_counter() - start)
+        return response
+
+
+# Shared by every LLM client in the process
+transport = LLMTransport.from_env()
@@ -0,0 +1,275 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format.
+
+Metrics are recorded unless METRICS_ENABLED=0, in which case every recording call
+returns immediately. Each server process exposes its own registry at `/metrics`.
+"""
+
+import os
+import time
+import bisect
+import inspect
+import functools
+import threading
+import contextlib
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+_NOOP = contextlib.nullcontext()
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            lines.extend(self._render_sample(key, value))
+        return "\n".join(lines)
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def _register(cls, name, documentation, labelnames, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, documentation, labelnames, **kwargs)
+        return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return _register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+class _Timer:
+    __slots__ = ("histogram", "counter", "labels", "start")
+
+    def __init__(self, histogram, counter, labels):
+        self.histogram = histogram
+        self.counter = counter
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        if self.counter is not None:
+            self.counter.inc(outcome="error" if exc_type else "ok", **self.labels)
+        return False
+
+
+def timed(histogram, counter=None, **labels):
+    """
+    Context manager observing the duration of its block in `histogram`.
+
+    When `counter` is given it is also incremented with an extra `outcome` label
+    of "ok" or "error".
+    """
+    if not ENABLED:
+        return _NOOP
+    return _Timer(histogram, counter, labels)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# --- Metrics shared by the servers ---
+
+HTTP_REQUEST_LATENCY = histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+LLM_REQUEST_LATENCY = histogram(
+    "llm_request_duration_seconds", "Latency of calls to an LLM provider", ("provider", "model"))
+LLM_REQUESTS = counter(
+    "llm_requests_total", "Calls to an LLM provider", ("provider", "model", "outcome"))
+TOOL_CALL_LATENCY = histogram(
+    "mcp_tool_duration_seconds", "MCP tool invocation latency", ("tool", "side"))
+TOOL_CALLS = counter(
+    "mcp_tool_calls_total", "MCP tool invocations", ("tool", "side", "outcome"))
+DB_QUERY_LATENCY = histogram(
+    "db_query_duration_seconds", "Database query latency", ("db", "query"))
+DB_QUERIES = counter(
+    "db_queries_total", "Database queries", ("db", "query", "outcome"))
+CACHE_REQUESTS = counter(
+    "cache_requests_total", "Cache lookups; hit ratio is hit / (hit + miss)", ("cache", "result"))
+
+
+def track_tool(name, side="server"):
+    """
+    Decorator recording latency and outcome of an MCP tool function (sync or async).
+
+    Apply it below `@mcp.tool(...)` so the tool registers the wrapped function.
+    """
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with timed(TOOL_CALL_LATENCY, TOOL_CALLS, tool=name, side=side):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(TOOL_CALL_LATENCY, TOOL_CALLS, tool=name, side=side):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def install(app):
+    """
+    Add per-route HTTP metrics and a `/metrics` endpoint to a FastAPI app
+    """
+    from starlette.responses import Response
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint():
+        return Response(render(), media_type="text/plain; version=0.0.4")
+
+    if not ENABLED:
+        return
+
+    @app.middleware("http")
+    async def http_metrics(request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # Label by route template (/api/jobs/{job_id}) to keep cardinality bounded
+            route = request.scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_LATENCY.observe(
+                time.perf_counter() - start, method=request.method, route=path, status=str(status))
+
+
+def install_mcp(mcp):
+    """
+    Expose `/metrics` on a FastMCP server's HTTP transport
+    """
+    from starlette.responses import PlainTextResponse
+
+    @mcp.custom_route("/metrics", methods=["GET"])
+    async def metrics_endpoint(request):
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -8,8 +8,11 @@ from __future__ import annotations
 
 import argparse
 import os
+import threading
 from typing import Any
 
+from pydantic import BaseModel, Field
+
 import requests
 from dotenv import load_dotenv
 
@@ -17,11 +20,45 @@ load_dotenv()
 
 from fastmcp import FastMCP
 
+import metrics
+import tracing
+import tool_pool
+from traffic_store import TrafficStore
+from routing import ROUTING_OSM_PATH, RoutingEngine
+
 
 mcp = FastMCP("Traffic", instructions="Traffic MCP server exposing diagnostics and DB access tools")
+metrics.install_mcp(mcp)
 
+# Junction sensor readings, memory-mapped per month under TRAFFIC_STORE_DIR
+traffic_store = TrafficStore()
 
-@mcp.tool()
+# Road graph from ROUTING_OSM_PATH, loaded (or preprocessed) on the first routing call
+routing_engine = None
+_routing_lock = threading.Lock()
+
+
+def get_routing_engine():
+    global routing_engine
+    if routing_engine is None:
+        with _routing_lock:
+            if routing_engine is None:
+                if not os.path.exists(ROUTING_OSM_PATH):
+                    raise ValueError(f"No OSM extract at {ROUTING_OSM_PATH}; set ROUTING_OSM_PATH")
+                routing_engine = RoutingEngine.from_osm(ROUTING_OSM_PATH)
+    return routing_engine
+
+
+class Reading(BaseModel):
+    junction_id: str
+    timestamp: str = Field(description="ISO timestamp, stored at minute resolution")
+    speed_kmh: float = Field(ge=0)
+    vehicle_count: float = Field(0, ge=0, description="Vehicles in that minute")
+
+
+@mcp.tool(annotations={"readOnlyHint": True})
+@metrics.track_tool("hello")
+@tracing.traced_tool("hello")
 def hello(name: str | None = None) -> str:
     """Return a greeting.
 
@@ -36,7 +73,9 @@ def hello(name: str | None = None) -> str:
     return "Hello, World!"
 
 
-@mcp.tool()
+@mcp.tool(annotations={"readOnlyHint": True})
+@metrics.track_tool("add")
+@tracing.traced_tool("add")
 def add(a: float, b: float) -> dict[str, Any]:
     """Return the sum of two numbers with metadata.
 
@@ -45,11 +84,164 @@ def add(a: float, b: float) -> dict[str, Any]:
     return {"a": a, "b": b, "sum": a + b}
 
 
+@mcp.tool()
+@metrics.track_tool("ingest_traffic_readings")
+@tracing.traced_tool("ingest_traffic_readings")
+@tool_pool.blocking_tool("ingest_traffic_readings")
+def ingest_traffic_readings(readings: list[Reading],
+                            free_flow_speeds: dict[str, float] | None = None) -> dict[str, Any]:
+    """Store per-minute junction sensor readings.
+
+    Args:
+        readings: speed and vehicle count per junction and minute; a later reading for
+            the same junction and minute replaces the earlier one
+        free_flow_speeds: optional uncongested speed (km/h) per junction; otherwise it is
+            estimated from the readings when queried
+
+    Returns:
+        The number of readings stored.
+    """
+    try:
+        stored = traffic_store.ingest(
+            [r.junction_id for r in readings], [r.timestamp for r in readings],
+            [r.speed_kmh for r in readings], [r.vehicle_count for r in readings], free_flow_speeds)
+        return {"success": True, "stored": stored}
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+
+
+@mcp.tool(annotations={"readOnlyHint": True})
+@metrics.track_tool("congestion_index")
+@tracing.traced_tool("congestion_index")
+@tool_pool.blocking_tool("congestion_index")
+def congestion_index(junction_ids: list[str] | None = None, start: str | None = None, end: str | None = None,
+                     window_minutes: int = 15, top: int = 20) -> dict[str, Any]:
+    """Rolling congestion index of junctions over a time range.
+
+    The index is free-flow speed / observed speed - 1 (0 = free flow, 1 = trips take
+    twice as long), averaged over a rolling window.
+
+    Args:
+        junction_ids: junctions to include; all when omitted
+        start: ISO start of the range (default: 7 days before end)
+        end: ISO end of the range (default: now)
+        window_minutes: rolling window length
+        top: number of most congested junctions to return
+
+    Returns:
+        Network mean index and, per junction, the mean, worst and latest window.
+    """
+    try:
+        return {"success": True, **traffic_store.congestion(junction_ids, start, end, window_minutes, top)}
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+
+
+@mcp.tool(annotations={"readOnlyHint": True})
+@metrics.track_tool("peak_hours")
+@tracing.traced_tool("peak_hours")
+@tool_pool.blocking_tool("peak_hours")
+def peak_hours(junction_ids: list[str] | None = None, start: str | None = None, end: str | None = None,
+               top: int = 3, weekdays_only: bool = False) -> dict[str, Any]:
+    """Hours of the day with the worst congestion.
+
+    Args:
+        junction_ids: junctions to include; all when omitted
+        start: ISO start of the range (default: 28 days before end)
+        end: ISO end of the range (default: now)
+        top: number of peak hours to return
+        weekdays_only: ignore Saturdays and Sundays
+
+    Returns:
+        The network's mean congestion index for each hour of the day (0-23), its peak
+        hours, and the peak hours of the most congested junctions.
+    """
+    try:
+        return {"success": True, **traffic_store.peak_hours(junction_ids, start, end, top, weekdays_only)}
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+
+
+@mcp.tool(annotations={"readOnlyHint": True})
+@metrics.track_tool("traffic_anomalies")
+@tracing.traced_tool("traffic_anomalies")
+@tool_pool.blocking_tool("traffic_anomalies")
+def traffic_anomalies(junction_ids: list[str] | None = None, start: str | None = None, end: str | None = None,
+                      z_threshold: float = 3.5, limit: int = 50) -> dict[str, Any]:
+    """Hours where a junction's speed was unusual for that time of day.
+
+    Each hourly mean speed is compared with the same hour on the other days of the
+    range (median and median absolute deviation), e.g. to spot incidents or closures.
+
+    Args:
+        junction_ids: junctions to include; all when omitted
+        start: ISO start of the range (default: 28 days before end; at least 3 days)
+        end: ISO end of the range (default: now)
+        z_threshold: robust z-score from which an hour is flagged
+        limit: maximum number of anomalies to return, strongest first
+
+    Returns:
+        The flagged hours with observed and expected speed.
+    """
+    try:
+        return {"success": True, **traffic_store.anomalies(junction_ids, start, end, z_threshold, limit=limit)}
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+
+
+@mcp.tool(annotations={"readOnlyHint": True})
+@metrics.track_tool("route")
+@tracing.traced_tool("route")
+@tool_pool.blocking_tool("route")
+def route(from_lat: float, from_lon: float, to_lat: float, to_lon: float) -> dict[str, Any]:
+    """Fastest driving route between two points under current congestion.
+
+    Travel times are free-flow times scaled by the latest congestion index of junctions
+    whose ids are OSM node ids, refreshed every few minutes.
+
+    Args:
+        from_lat: latitude of the start
+        from_lon: longitude of the start
+        to_lat: latitude of the destination
+        to_lon: longitude of the destination
+
+    Returns:
+        Travel time in seconds, distance in meters and the path as [lat, lon] points.
+    """
+    try:
+        engine = get_routing_engine()
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    engine.refresh_if_stale(traffic_store)
+    result = engine.route(from_lat, from_lon, to_lat, to_lon)
+    if result is None:
+        return {"success": False, "error": "No route between these points"}
+    return {"success": True, **result}
+
+
+@mcp.tool()
+@metrics.track_tool("refresh_route_weights")
+@tracing.traced_tool("refresh_route_weights")
+@tool_pool.blocking_tool("refresh_route_weights")
+def refresh_route_weights(minutes: int = 60) -> dict[str, Any]:
+    """Re-weight the road graph from recent congestion now, instead of waiting.
+
+    Args:
+        minutes: how far back to look for junction readings
+
+    Returns:
+        The number of road junctions whose travel times were adjusted.
+    """
+    try:
+        engine = get_routing_engine()
+        return {"success": True, "junctions_matched": engine.refresh_congestion(traffic_store, minutes)}
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+
+
+# Imported by the worker processes when MCP_WORKERS > 1
+app = tool_pool.http_app(mcp)
+
 
 if __name__ == "__main__":
-    mcp.run(
-        transport="http",
-        host="0.0.0.0",
-        port=8005,
-        log_level="debug"
-    )
\ No newline at end of file
+    tool_pool.run(mcp, "mncp:app", port=int(os.getenv("MCP_PORT", "8005")))
\ No newline at end of file
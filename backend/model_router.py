@@ -0,0 +1,171 @@
+"""
+Hedged and fallback requests across LLM backends.
+
+Each chat path has a primary model and, optionally, an alternate one. `HedgedRouter.call`
+sends the request to the primary and waits up to the hedge delay: the
+LLM_HEDGE_QUANTILE (p95 by default) of the primary's recent latencies. If there is no
+answer by then, or the primary failed or gave an answer the caller cannot use, the same
+request goes to the alternate. The first good answer wins and the other request is
+cancelled.
+
+Only a small fraction of requests are slow enough to be hedged, so the extra load stays
+near 1 - LLM_HEDGE_QUANTILE while the tail is cut to about the delay plus the alternate's
+own latency.
+
+Backends are `(name, fn)` pairs; `fn(cancelled)` runs the blocking call and should stop
+early, raising `Cancelled`, once the `cancelled` event is set. A streamed response can do
+that between chunks. A plain request cannot be interrupted: it runs to the end in the
+background and its answer is dropped.
+
+Hedge rate is llm_router_hedges_total / llm_router_requests_total; the alternate's win
+rate is llm_router_wins_total{backend=<alternate>} / llm_router_hedges_total.
+"""
+
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import metrics
+
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+# Until LLM_HEDGE_MIN_SAMPLES latencies are known, the primary gets LLM_HEDGE_DELAY seconds
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "5"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+# Bounds on the learned delay, so a burst of fast or slow answers cannot hedge everything or nothing
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "20"))
+LLM_ROUTER_WORKERS = int(os.getenv("LLM_ROUTER_WORKERS", "32"))
+
+ROUTER_REQUESTS = metrics.counter(
+    "llm_router_requests_total", "Requests through a model router", ("router",))
+ROUTER_HEDGES = metrics.counter(
+    "llm_router_hedges_total",
+    "Requests also sent to the alternate backend (slow: over the hedge delay, error, unusable)", ("router", "reason"))
+ROUTER_WINS = metrics.counter(
+    "llm_router_wins_total", "Whose answer was used; backend=none when every backend failed", ("router", "backend"))
+ROUTER_HEDGE_DELAY = metrics.gauge(
+    "llm_router_hedge_delay_seconds", "Current wait for the primary before hedging", ("router",))
+
+
+class Cancelled(Exception):
+    """Raised by a backend call that stopped because another backend answered first"""
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=LLM_ROUTER_WORKERS, thread_name_prefix="llm-router")
+    return _executor
+
+
+def _accept_any(result):
+    return True
+
+
+class HedgedRouter:
+    def __init__(self, name, quantile=LLM_HEDGE_QUANTILE, window=LLM_HEDGE_WINDOW):
+        self.name = name
+        self.quantile = quantile
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def hedge_delay(self):
+        """
+        Seconds to wait for the primary before hedging
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < LLM_HEDGE_MIN_SAMPLES:
+            delay = LLM_HEDGE_DELAY
+        else:
+            delay = latencies[int(self.quantile * (len(latencies) - 1))]
+        delay = min(max(delay, LLM_HEDGE_MIN_DELAY), LLM_HEDGE_MAX_DELAY)
+        ROUTER_HEDGE_DELAY.set(delay, router=self.name)
+        return delay
+
+    def _observe(self, future, started):
+        # A cancelled primary is recorded at the time it stopped: a lower bound, but one past
+        # the delay, which keeps slow periods in the window
+        if future.cancelled() or not isinstance(future.exception(), (type(None), Cancelled)):
+            return
+        with self._lock:
+            self._latencies.append(time.perf_counter() - started)
+
+    def call(self, primary, alternate=None, accept=_accept_any):
+        """
+        Run `primary`, hedged with `alternate`, and return (result, name of the backend used).
+
+        `accept(result)` tells a good answer from an unusable one. If no backend gives a good
+        answer, the first unusable one is returned; if all of them fail, the primary's error
+        is raised.
+        """
+        ROUTER_REQUESTS.inc(router=self.name)
+        attempts = []
+
+        def launch(backend):
+            name, fn = backend
+            cancelled = threading.Event()
+            future = executor().submit(contextvars.copy_context().run, fn, cancelled)
+            attempts.append((name, future, cancelled))
+            return future
+
+        started = time.perf_counter()
+        if alternate is None:
+            # Nothing to hedge with, so the call stays on the caller's thread
+            try:
+                result = primary[1](threading.Event())
+            except Exception:
+                ROUTER_WINS.inc(router=self.name, backend="none")
+                raise
+            with self._lock:
+                self._latencies.append(time.perf_counter() - started)
+            ROUTER_WINS.inc(router=self.name, backend=primary[0])
+            return result, primary[0]
+        future = launch(primary)
+        future.add_done_callback(lambda f: self._observe(f, started))
+
+        wait([future], timeout=self.hedge_delay())
+        if not future.done():
+            reason = "slow"
+        elif future.exception() is not None:
+            reason = "error"
+        elif not accept(future.result()):
+            reason = "unusable"
+        else:
+            ROUTER_WINS.inc(router=self.name, backend=primary[0])
+            return future.result(), primary[0]
+        ROUTER_HEDGES.inc(router=self.name, reason=reason)
+        launch(alternate)
+
+        unusable = None
+        pending = {f for _, f, _ in attempts}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # In launch order, so the primary wins a tie
+            for name, f, _ in attempts:
+                if f not in done or f.exception() is not None:
+                    continue
+                result = f.result()
+                if accept(result):
+                    for _, other, cancelled in attempts:
+                        if other is not f:
+                            cancelled.set()
+                    ROUTER_WINS.inc(router=self.name, backend=name)
+                    return result, name
+                if unusable is None:
+                    unusable = (result, name)
+        if unusable is not None:
+            ROUTER_WINS.inc(router=self.name, backend=unusable[1])
+            return unusable
+        ROUTER_WINS.inc(router=self.name, backend="none")
+        raise attempts[0][1].exception()
@@ -0,0 +1,170 @@
+"""
+Pre-encoded JSON responses with compression and ETag revalidation.
+
+A listing that only changes when its table's version counter does is encoded once
+per version (orjson when installed) and compressed once per content coding (brotli
+when installed, else gzip). A client that sends the current ETag in If-None-Match is
+answered 304 without the body being built at all.
+
+Usage (FastAPI):
+    listing_cache = responses.VersionedCache()
+
+    version = get_table_version("complaints")
+    etag = responses.etag("complaints", version)
+    if responses.not_modified(request, etag):
+        return responses.not_modified_response(etag)
+    body = listing_cache.get(key, version, build_listing)
+    return responses.encoded_response(request, body, etag)
+"""
+
+import os
+import json
+import gzip
+import threading
+import importlib.util
+from collections import OrderedDict
+
+from fastapi import Request, Response
+
+import metrics
+
+# Bodies smaller than this are sent uncompressed; the headers would eat the saving
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+ORJSON_AVAILABLE = importlib.util.find_spec("orjson") is not None
+BROTLI_AVAILABLE = importlib.util.find_spec("brotli") is not None
+
+CONDITIONAL_REQUESTS = metrics.counter(
+    "conditional_requests_total", "Responses to ETag-capable endpoints (not_modified, full)", ("result",))
+
+if ORJSON_AVAILABLE:
+    import orjson
+
+    def dumps(value):
+        return orjson.dumps(value)
+else:
+    def dumps(value):
+        return json.dumps(value, separators=(",", ":")).encode()
+
+
+def _compress(body, encoding):
+    if encoding == "br":
+        import brotli
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class EncodedBody:
+    """
+    A JSON body encoded once, with each compressed variant built on first request
+    """
+
+    def __init__(self, value):
+        self.identity = dumps(value)
+        self._encoded = {}
+
+    def encoded(self, encoding):
+        if encoding is None:
+            return self.identity
+        body = self._encoded.get(encoding)
+        if body is None:
+            # Two requests may both compress; either result is stored
+            body = self._encoded[encoding] = _compress(self.identity, encoding)
+        return body
+
+
+class VersionedCache:
+    """
+    EncodedBody per key, reused until the version it was built for changes
+    """
+
+    def __init__(self, maxsize=32, name="encoded_responses"):
+        self.maxsize = maxsize
+        self.name = name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        """
+        Return the body for `key` at `version`, calling `build()` for its value on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                metrics.record_cache(self.name, True)
+                return entry[1]
+        metrics.record_cache(self.name, False)
+        body = EncodedBody(build())
+        if version is not None:
+            with self._lock:
+                self._entries[key] = (version, body)
+                self._entries.move_to_end(key)
+                if len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return body
+
+
+def etag(name, version, *variant):
+    """
+    Weak ETag for `name` at `version`, or None when the version is unknown
+    """
+    if version is None:
+        return None
+    return 'W/"' + "-".join(str(part) for part in (name, version, *variant)) + '"'
+
+
+def not_modified(request: Request, current_etag):
+    if current_etag is None:
+        return False
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # Weak comparison: W/ prefixes are ignored
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or current_etag.removeprefix("W/") in tags
+
+
+def not_modified_response(current_etag):
+    CONDITIONAL_REQUESTS.inc(result="not_modified")
+    return Response(status_code=304, headers={"ETag": current_etag, "Vary": "Accept-Encoding"})
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Pick br or gzip from an Accept-Encoding header, honouring q=0; None for identity
+    """
+    offered = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        offered[coding.strip().lower()] = quality
+    for coding in ("br", "gzip"):
+        if coding == "br" and not BROTLI_AVAILABLE:
+            continue
+        if offered.get(coding, offered.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+def encoded_response(request: Request, body: EncodedBody, current_etag=None, media_type="application/json"):
+    CONDITIONAL_REQUESTS.inc(result="full")
+    encoding = None
+    if len(body.identity) >= COMPRESS_MIN_BYTES:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    headers = {"Vary": "Accept-Encoding"}
+    if current_etag is not None:
+        # Clients keep the body but revalidate before every reuse
+        headers["ETag"] = current_etag
+        headers["Cache-Control"] = "no-cache"
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(body.encoded(encoding), media_type=media_type, headers=headers)
@@ -0,0 +1,596 @@
+"""
+Congestion-aware road routing with a customizable contraction hierarchy (CCH).
+
+The road graph is read from a local OSM XML extract (ROUTING_OSM_PATH, optionally
+.gz/.bz2): drivable ways become directed edges weighted by free-flow travel time,
+with nodes that only continue a road collapsed away, stored as flat NumPy arrays.
+
+Preprocessing is split the CCH way:
+
+1. metric-independent (slow, cached in ROUTING_CACHE_PATH): a nested-dissection order
+   from recursive geometric bisection, the contracted (chordal) graph it induces,
+   its elimination tree, and every lower triangle of it, grouped by tree level
+2. customization (fast, vectorized): shortcut weights for the current metric,
+   computed level by level from the triangles
+
+Live congestion only changes the metric, so `update_vertex_factors` re-runs step 2
+and swaps the new weights in atomically; queries in flight keep the old ones.
+
+A query walks the elimination-tree ancestors of the source upwards and of the
+target downwards; the shortest path meets at a common ancestor. Shortcuts are then
+unpacked through their triangles into the road vertices they stand for.
+"""
+
+import os
+import bz2
+import gzip
+import math
+import bisect
+import time
+import heapq
+import threading
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime
+
+import numpy as np
+
+import tracing
+
+ROUTING_OSM_PATH = os.getenv("ROUTING_OSM_PATH", "map.osm")
+ROUTING_CACHE_PATH = os.getenv("ROUTING_CACHE_PATH", "")
+# Congestion weights are recomputed from the traffic store when older than this
+ROUTING_REFRESH_SECONDS = int(os.getenv("ROUTING_REFRESH_SECONDS", "300"))
+ROUTING_CONGESTION_MINUTES = int(os.getenv("ROUTING_CONGESTION_MINUTES", "60"))
+# Subgraphs at most this large are ordered by minimum degree instead of bisected
+ROUTING_LEAF_SIZE = int(os.getenv("ROUTING_LEAF_SIZE", "64"))
+
+# Free-flow speed (km/h) by highway type when a way has no usable maxspeed
+HIGHWAY_SPEEDS = {
+    "motorway": 100, "motorway_link": 60, "trunk": 80, "trunk_link": 50,
+    "primary": 60, "primary_link": 40, "secondary": 50, "secondary_link": 35,
+    "tertiary": 40, "tertiary_link": 30, "unclassified": 30, "residential": 25,
+    "living_street": 10, "service": 15, "road": 30,
+}
+EARTH_RADIUS_M = 6371000.0
+# Bumped whenever the cached arrays change meaning, so old caches are rebuilt
+CACHE_FORMAT = 1
+INF = np.inf
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _speed(tags):
+    maxspeed = tags.get("maxspeed", "").strip().lower()
+    try:
+        if maxspeed.endswith("mph"):
+            return float(maxspeed[:-3]) * 1.609
+        if maxspeed:
+            return float(maxspeed.split()[0])
+    except ValueError:
+        pass
+    return HIGHWAY_SPEEDS[tags["highway"]]
+
+
+def _oneway(tags):
+    """
+    1 for forward only, -1 for backward only, 0 for both directions
+    """
+    value = tags.get("oneway", "").lower()
+    if value in ("yes", "true", "1"):
+        return 1
+    if value == "-1":
+        return -1
+    if value == "no":
+        return 0
+    return 1 if tags["highway"] == "motorway" or tags.get("junction") == "roundabout" else 0
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def load_osm(path):
+    """
+    Parse an OSM XML extract into a road graph.
+
+    Returns a dict of arrays: osm_ids, lat, lon per vertex, and tail, head,
+    weight (free-flow seconds), length (meters) per directed edge.
+    """
+    node_ids, node_lat, node_lon = [], [], []
+    ways = []
+    with _open(path) as f:
+        for _, element in ElementTree.iterparse(f, events=("end",)):
+            if element.tag == "node":
+                node_ids.append(int(element.get("id")))
+                node_lat.append(float(element.get("lat")))
+                node_lon.append(float(element.get("lon")))
+                element.clear()
+            elif element.tag == "way":
+                tags = {t.get("k"): t.get("v") for t in element.iter("tag")}
+                if tags.get("highway") in HIGHWAY_SPEEDS and tags.get("access") not in ("no", "private"):
+                    refs = [int(nd.get("ref")) for nd in element.iter("nd")]
+                    if len(refs) > 1:
+                        ways.append((refs, _speed(tags), _oneway(tags)))
+                element.clear()
+
+    node_ids = np.array(node_ids, dtype=np.int64)
+    order = np.argsort(node_ids)
+    node_ids = node_ids[order]
+    node_lat = np.array(node_lat)[order]
+    node_lon = np.array(node_lon)[order]
+
+    # Graph vertices: way endpoints and nodes shared by several ways (or used twice by one)
+    uses = {}
+    for refs, _, _ in ways:
+        for ref in refs:
+            uses[ref] = uses.get(ref, 0) + 1
+        for ref in (refs[0], refs[-1]):
+            uses[ref] = uses.get(ref, 0) + 1
+    vertex_osm = np.array(sorted(ref for ref, count in uses.items() if count > 1), dtype=np.int64)
+    vertex_of = {int(ref): i for i, ref in enumerate(vertex_osm)}
+    positions = np.searchsorted(node_ids, vertex_osm)
+    if len(vertex_osm) and (positions.max() >= len(node_ids) or (node_ids[positions] != vertex_osm).any()):
+        raise ValueError("OSM extract references nodes it does not contain; re-export it with complete ways")
+
+    tails, heads, weights, lengths = [], [], [], []
+    for refs, speed, oneway in ways:
+        index = np.searchsorted(node_ids, refs)
+        if index.max() >= len(node_ids) or (node_ids[index] != refs).any():
+            continue
+        segment = _haversine(node_lat[index[:-1]], node_lon[index[:-1]], node_lat[index[1:]], node_lon[index[1:]])
+        cumulative = np.concatenate(([0.0], np.cumsum(segment)))
+        cuts = [i for i, ref in enumerate(refs) if ref in vertex_of]
+        for a, b in zip(cuts, cuts[1:]):
+            u, v = vertex_of[refs[a]], vertex_of[refs[b]]
+            if u == v:
+                continue
+            length = cumulative[b] - cumulative[a]
+            seconds = length / (speed / 3.6)
+            if oneway >= 0:
+                tails.append(u), heads.append(v), weights.append(seconds), lengths.append(length)
+            if oneway <= 0:
+                tails.append(v), heads.append(u), weights.append(seconds), lengths.append(length)
+
+    return {
+        "osm_ids": vertex_osm,
+        "lat": node_lat[positions],
+        "lon": node_lon[positions],
+        "tail": np.array(tails, dtype=np.int32),
+        "head": np.array(heads, dtype=np.int32),
+        "weight": np.array(weights, dtype=np.float64),
+        "length": np.array(lengths, dtype=np.float64),
+    }
+
+
+# --- Metric-independent preprocessing ---
+
+def _min_degree_order(vertices, neighbors):
+    """
+    Greedy minimum-degree elimination order of a small subgraph
+    """
+    inside = set(vertices)
+    adjacency = {v: set(u for u in neighbors[v] if u in inside) for v in vertices}
+    heap = [(len(adjacency[v]), v) for v in vertices]
+    heapq.heapify(heap)
+    order = []
+    while heap:
+        degree, v = heapq.heappop(heap)
+        if v not in adjacency or degree != len(adjacency[v]):
+            continue
+        order.append(v)
+        around = adjacency.pop(v)
+        for u in around:
+            adjacency[u] |= around
+            adjacency[u].discard(u)
+            adjacency[u].discard(v)
+            heapq.heappush(heap, (len(adjacency[u]), u))
+    return order
+
+
+def nested_dissection_order(lat, lon, tail, head, leaf_size=ROUTING_LEAF_SIZE):
+    """
+    Vertices in contraction order: each part's separator after both halves.
+
+    Parts are split at the median along four directions (north-south, east-west and
+    both diagonals); the direction whose cut needs the smallest separator wins.
+    """
+    n = len(lat)
+    x = np.asarray(lon) * np.cos(np.radians(np.mean(lat) if n else 0))
+    y = np.asarray(lat)
+    directions = [(1, 0), (0, 1), (1, 1), (1, -1)]
+    undirected_tail = np.concatenate((tail, head))
+    undirected_head = np.concatenate((head, tail))
+    neighbors = [[] for _ in range(n)]
+    for u, v in zip(undirected_tail.tolist(), undirected_head.tolist()):
+        if u != v:
+            neighbors[u].append(v)
+
+    order = []
+    # Explicit stack: (vertices, edge tails, edge heads, separator to emit after them)
+    stack = [("part", np.arange(n), undirected_tail, undirected_head)]
+    while stack:
+        item = stack.pop()
+        if item[0] == "emit":
+            order.extend(item[1])
+            continue
+        _, vertices, edge_tail, edge_head = item
+        if len(vertices) <= leaf_size:
+            order.extend(_min_degree_order(vertices.tolist(), neighbors))
+            continue
+        best = None
+        for dx, dy in directions:
+            projection = dx * x[vertices] + dy * y[vertices]
+            side = np.zeros(n, dtype=np.int8)
+            side[vertices] = projection > np.median(projection)
+            crossing = side[edge_tail] != side[edge_head]
+            # Separate with the endpoints on the smaller-boundary side
+            boundary = [np.unique(edge_tail[crossing & (side[edge_tail] == s)]) for s in (0, 1)]
+            separator = min(boundary, key=len)
+            if best is None or len(separator) < len(best[1]):
+                best = (side, separator)
+        side, separator = best
+        removed = np.zeros(n, dtype=bool)
+        removed[separator] = True
+        stack.append(("emit", separator.tolist()))
+        for s in (1, 0):
+            part = vertices[(side[vertices] == s) & ~removed[vertices]]
+            keep = (side[edge_tail] == s) & (side[edge_head] == s) & ~removed[edge_tail] & ~removed[edge_head]
+            if len(part):
+                stack.append(("part", part, edge_tail[keep], edge_head[keep]))
+    return np.array(order, dtype=np.int64)
+
+
+def contract(rank, tail, head, n):
+    """
+    Chordal supergraph of the road graph under `rank`, in rank space.
+
+    Returns (up_first, up_head, parent): CSR of each vertex's higher-ranked neighbors
+    (sorted), and its parent in the elimination tree (-1 for roots).
+    """
+    adjacency = [set() for _ in range(n)]
+    for u, v in zip(rank[tail].tolist(), rank[head].tolist()):
+        if u != v:
+            adjacency[u].add(v)
+            adjacency[v].add(u)
+    upward = []
+    parent = np.full(n, -1, dtype=np.int64)
+    for v in range(n):
+        up = sorted(u for u in adjacency[v] if u > v)
+        upward.append(up)
+        if up:
+            # Eliminating v makes its upper neighbors a clique; the lowest one inherits them
+            parent[v] = up[0]
+            adjacency[up[0]].update(up[1:])
+        adjacency[v] = None
+    up_first = np.zeros(n + 1, dtype=np.int64)
+    up_first[1:] = np.cumsum([len(up) for up in upward])
+    up_head = np.fromiter((u for up in upward for u in up), dtype=np.int64, count=int(up_first[-1]))
+    return up_first, up_head, parent
+
+
+def lower_triangles(up_first, up_head, parent):
+    """
+    Every triangle (v, u, w) with v below u below w, as arc ids (v,u), (v,w), (u,w).
+
+    Sorted by the elimination-tree level of v (leaves first): a triangle only reads arcs
+    whose lower end is at its level and only writes arcs above it, so each level can be
+    customized in one vectorized step. Returns the three arc arrays and level boundaries.
+    """
+    n = len(up_first) - 1
+    level = np.zeros(n, dtype=np.int64)
+    for v in range(n):
+        if parent[v] >= 0 and level[parent[v]] < level[v] + 1:
+            level[parent[v]] = level[v] + 1
+    arc_tail = np.repeat(np.arange(n), np.diff(up_first))
+    keys = arc_tail * n + up_head
+
+    degree = np.diff(up_first)
+    vu, vw, uw, tri_level = [], [], [], []
+    for d in np.unique(degree[degree > 1]):
+        vertices = np.nonzero(degree == d)[0]
+        i, j = np.triu_indices(d, 1)
+        base = up_first[vertices][:, None]
+        a_vu = (base + i).ravel()
+        a_vw = (base + j).ravel()
+        vu.append(a_vu)
+        vw.append(a_vw)
+        uw.append(np.searchsorted(keys, up_head[a_vu] * n + up_head[a_vw]))
+        tri_level.append(np.repeat(level[vertices], len(i)))
+    if not vu:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, np.zeros(1, dtype=np.int64)
+    vu, vw, uw, tri_level = (np.concatenate(a) for a in (vu, vw, uw, tri_level))
+    order = np.argsort(tri_level, kind="stable")
+    # int32 halves the cache and customization memory traffic; arcs stay far below 2^31
+    vu, vw, uw = (a[order].astype(np.int32) for a in (vu, vw, uw))
+    tri_level = tri_level[order]
+    boundaries = np.searchsorted(tri_level, np.arange(tri_level[-1] + 2))
+    return vu, vw, uw, boundaries
+
+
+class RoutingEngine:
+    def __init__(self, graph, cch=None):
+        self.graph = graph
+        self.n = len(graph["lat"])
+        self.vertex_of = {int(osm): i for i, osm in enumerate(graph["osm_ids"])}
+        if cch is None:
+            with tracing.span("routing.preprocess", vertices=self.n):
+                order = nested_dissection_order(graph["lat"], graph["lon"], graph["tail"], graph["head"])
+                rank = np.empty(self.n, dtype=np.int64)
+                rank[order] = np.arange(self.n)
+                up_first, up_head, parent = contract(rank, graph["tail"], graph["head"], self.n)
+                cch = {"rank": rank, "up_first": up_first, "up_head": up_head, "parent": parent}
+                cch.update(zip(("tri_vu", "tri_vw", "tri_uw", "tri_levels"),
+                               lower_triangles(up_first, up_head, parent)))
+        self.cch = cch
+        self.rank = cch["rank"]
+        self.vertex_at = np.argsort(self.rank)
+        self.parent = cch["parent"].tolist()
+        self.up_first = cch["up_first"].tolist()
+        self.up_head = cch["up_head"].tolist()
+        # Per-vertex slices, so the query loops run over short Python lists
+        self._heads = self._by_vertex(self.up_head)
+
+        # Each road edge maps onto one CCH arc, in its upward or downward direction
+        up_first, up_head = cch["up_first"], cch["up_head"]
+        tails, heads = self.rank[graph["tail"]], self.rank[graph["head"]]
+        low, high = np.minimum(tails, heads), np.maximum(tails, heads)
+        arc_tail = np.repeat(np.arange(self.n), np.diff(up_first))
+        self.edge_arc = np.searchsorted(arc_tail * self.n + up_head, low * self.n + high)
+        self.edge_upward = tails < heads
+        self.arcs = len(up_head)
+        keys = graph["tail"].astype(np.int64) * self.n + graph["head"]
+        by_key = np.lexsort((graph["length"], keys))
+        self._edge_keys = keys[by_key]
+        self._edge_lengths = graph["length"][by_key]
+
+        self.vertex_factors = np.ones(self.n)
+        self.refreshed_at = None
+        self._metric = None
+        self._customize_lock = threading.Lock()
+        self._refresh_thread = None
+        self.customize()
+
+    @classmethod
+    def from_osm(cls, path=ROUTING_OSM_PATH, cache_path=ROUTING_CACHE_PATH):
+        """
+        Load the extract, reusing the preprocessing cached for this exact file
+        """
+        cache_path = cache_path or f"{path}.cch.npz"
+        stat = os.stat(path)
+        signature = np.array([CACHE_FORMAT, stat.st_size, int(stat.st_mtime)], dtype=np.int64)
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                if np.array_equal(cached["signature"], signature):
+                    graph = {k[len("graph_"):]: cached[k] for k in cached.files if k.startswith("graph_")}
+                    cch = {k[len("cch_"):]: cached[k] for k in cached.files if k.startswith("cch_")}
+                    return cls(graph, cch)
+        with tracing.span("routing.load_osm"):
+            graph = load_osm(path)
+        engine = cls(graph)
+        arrays = {f"graph_{k}": v for k, v in graph.items()}
+        arrays.update({f"cch_{k}": v for k, v in engine.cch.items()})
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, signature=signature, **arrays)
+        os.replace(tmp_path, cache_path)
+        return engine
+
+    # --- Customization ---
+
+    def customize(self, vertex_factors=None):
+        """
+        Compute shortcut weights for the current edge weights and swap them in
+        """
+        with self._customize_lock, tracing.span("routing.customize", arcs=self.arcs):
+            if vertex_factors is not None:
+                self.vertex_factors = vertex_factors
+            weights = self.graph["weight"] * self.vertex_factors[self.graph["head"]]
+            up = np.full(self.arcs, INF)
+            down = np.full(self.arcs, INF)
+            np.minimum.at(up, self.edge_arc[self.edge_upward], weights[self.edge_upward])
+            np.minimum.at(down, self.edge_arc[~self.edge_upward], weights[~self.edge_upward])
+            # For unpacking: the lower triangle (as its arcs v-u, v-w) each shortcut weight
+            # came from, -1 where the weight is an original edge's
+            via = {name: np.full(self.arcs, -1, dtype=np.int64) for name in ("up_vu", "up_vw", "down_vu", "down_vw")}
+            vu, vw, uw, levels = (self.cch[k] for k in ("tri_vu", "tri_vw", "tri_uw", "tri_levels"))
+            for start, stop in zip(levels[:-1], levels[1:]):
+                if start == stop:
+                    continue
+                a_vu, a_vw, a_uw = vu[start:stop], vw[start:stop], uw[start:stop]
+                # u -> v -> w and w -> v -> u through the lower vertex v
+                for weights, candidate, prefix in ((up, down[a_vu] + up[a_vw], "up_"),
+                                                   (down, down[a_vw] + up[a_vu], "down_")):
+                    np.minimum.at(weights, a_uw, candidate)
+                    # Weights only decrease, so the level that set the final one writes last
+                    hit = (candidate == weights[a_uw]) & (candidate < INF)
+                    via[prefix + "vu"][a_uw[hit]] = a_vu[hit]
+                    via[prefix + "vw"][a_uw[hit]] = a_vw[hit]
+            up, down = up.tolist(), down.tolist()
+            self._metric = (self._by_vertex(up), self._by_vertex(down), {k: v.tolist() for k, v in via.items()})
+
+    def _by_vertex(self, values):
+        first = self.up_first
+        return [values[first[v]:first[v + 1]] for v in range(self.n)]
+
+    def update_vertex_factors(self, factors):
+        """
+        Scale the travel time of every edge into the given vertices ({osm_id: factor})
+        and re-customize; returns how many vertices were matched
+        """
+        vertex_factors = np.ones(self.n)
+        matched = 0
+        for osm_id, factor in factors.items():
+            vertex = self.vertex_of.get(int(osm_id))
+            if vertex is not None:
+                vertex_factors[vertex] = max(float(factor), 1e-3)
+                matched += 1
+        self.customize(vertex_factors)
+        return matched
+
+    def refresh_congestion(self, store, minutes=ROUTING_CONGESTION_MINUTES):
+        """
+        Re-weight the graph from the latest congestion in a TrafficStore
+        """
+        matched = self.update_vertex_factors(congestion_factors(store, minutes))
+        self.refreshed_at = time.time()
+        return matched
+
+    def refresh_if_stale(self, store):
+        """
+        Start a background refresh when the weights are older than ROUTING_REFRESH_SECONDS;
+        queries keep using the current weights until it finishes
+        """
+        if self.refreshed_at is not None and time.time() - self.refreshed_at < ROUTING_REFRESH_SECONDS:
+            return
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._refresh_thread = threading.Thread(target=self.refresh_congestion, args=(store,),
+                                                name="routing-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    # --- Queries ---
+
+    def nearest_vertex(self, lat, lon):
+        scale = math.cos(math.radians(lat))
+        distance = (self.graph["lat"] - lat) ** 2 + ((self.graph["lon"] - lon) * scale) ** 2
+        return int(np.argmin(distance))
+
+    def _ancestors(self, v):
+        path = []
+        while v != -1:
+            path.append(v)
+            v = self.parent[v]
+        return path
+
+    def shortest_path(self, source, target):
+        """
+        (seconds, [vertices]) between two vertices, or (inf, []) if unreachable
+        """
+        up_by_vertex, down_by_vertex, via = self._metric
+        s, t = int(self.rank[source]), int(self.rank[target])
+        heads = self._heads
+
+        # Every upper neighbor of a vertex is one of its elimination-tree ancestors, so one
+        # pass up the ancestors of s (and of t) settles them in order. Both passes walk in
+        # rank order together: once a common ancestor gives a route, vertices already
+        # further than it away are not expanded.
+        forward, backward = {s: 0.0}, {t: 0.0}
+        forward_from, backward_from = {}, {}
+        best, meeting = INF, None
+        s_path, t_path = self._ancestors(s), self._ancestors(t)
+        i = j = 0
+        while i < len(s_path) or j < len(t_path):
+            if j == len(t_path) or (i < len(s_path) and s_path[i] <= t_path[j]):
+                v = s_path[i]
+                i += 1
+                if j < len(t_path) and t_path[j] == v:
+                    j += 1
+                    searches = ((forward, forward_from, up_by_vertex), (backward, backward_from, down_by_vertex))
+                else:
+                    searches = ((forward, forward_from, up_by_vertex),)
+            else:
+                v = t_path[j]
+                j += 1
+                searches = ((backward, backward_from, down_by_vertex),)
+            total = forward.get(v, INF) + backward.get(v, INF)
+            if total < best:
+                best, meeting = total, v
+            for distances, came_from, weights in searches:
+                dv = distances.get(v)
+                if dv is None or dv >= best:
+                    continue
+                for w, weight in zip(heads[v], weights[v]):
+                    d = dv + weight
+                    if d < distances.get(w, INF):
+                        distances[w] = d
+                        came_from[w] = v
+        if best == INF:
+            return INF, []
+
+        # Arcs from s up to the meeting vertex, then down to t, each unpacked into road edges
+        upward_arcs = []
+        v = meeting
+        while v != s:
+            upward_arcs.append(self._arc(forward_from[v], v))
+            v = forward_from[v]
+        ranks = [s]
+        for a in reversed(upward_arcs):
+            self._unpack(a, True, ranks, via)
+        v = meeting
+        while v != t:
+            self._unpack(self._arc(backward_from[v], v), False, ranks, via)
+            v = backward_from[v]
+        return best, [int(self.vertex_at[r]) for r in ranks]
+
+    def _arc(self, low, high):
+        return self.up_first[low] + bisect.bisect_left(self._heads[low], high)
+
+    def _arc_tail(self, arc):
+        # Lower endpoint of an arc: the vertex whose CSR range contains it
+        return bisect.bisect_right(self.up_first, arc) - 1
+
+    def _unpack(self, arc, upward, ranks, via):
+        """
+        Append the rank-space vertices after the start of `arc` (traversed upward
+        from its lower end, or downward to it) to `ranks`
+        """
+        stack = [(arc, upward)]
+        while stack:
+            a, direction = stack.pop()
+            via_vu, via_vw = (via["up_vu"], via["up_vw"]) if direction else (via["down_vu"], via["down_vw"])
+            a_vu, a_vw = via_vu[a], via_vw[a]
+            if a_vu == -1:
+                ranks.append(self.up_head[a] if direction else self._arc_tail(a))
+            elif direction:
+                # u -> v -> w: pushed in reverse so u -> v is emitted first
+                stack += [(a_vw, True), (a_vu, False)]
+            else:
+                stack += [(a_vu, True), (a_vw, False)]
+
+    def route(self, from_lat, from_lon, to_lat, to_lon):
+        """
+        Fastest route between the road vertices nearest two points, or None if unreachable
+        """
+        source = self.nearest_vertex(from_lat, from_lon)
+        target = self.nearest_vertex(to_lat, to_lon)
+        seconds, vertices = self.shortest_path(source, target)
+        if seconds == INF:
+            return None
+        path = np.array(vertices, dtype=np.int64)
+        # Parallel edges (e.g. two ways between the same junctions) keep their shortest length
+        edges = np.searchsorted(self._edge_keys, path[:-1] * self.n + path[1:])
+        distance = float(self._edge_lengths[edges].sum()) if len(edges) else 0.0
+        return {
+            "travel_time_s": round(float(seconds), 1),
+            "distance_m": round(distance, 1),
+            "path": np.round(np.column_stack((self.graph["lat"][path], self.graph["lon"][path])), 6).tolist(),
+            "osm_node_ids": self.graph["osm_ids"][path].tolist(),
+        }
+
+
+def congestion_factors(store, minutes=60):
+    """
+    {osm node id: 1 + latest congestion index} for junctions of a TrafficStore whose
+    ids are OSM node ids (either "123" or "osm:123") with readings in the last `minutes`
+    """
+    # Local time, like the naive timestamps readings arrive with (and TrafficStore's own default)
+    end = np.datetime64(datetime.now(), "m")
+    registry = store.registry()
+    if not registry:
+        return {}
+    congestion = store.congestion(start=str(end - np.timedelta64(minutes, "m")), end=str(end),
+                                  window_minutes=15, top=len(registry))
+    factors = {}
+    for junction in congestion["most_congested"]:
+        osm_id = junction["junction_id"].removeprefix("osm:")
+        if osm_id.isdigit():
+            factors[int(osm_id)] = 1 + junction["latest_index"]
+    return factors
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import metrics
+
+SHARED_CACHE_DB = os.getenv("SHARED_CACHE_DB", "shared_cache.db")
+
+
+class SharedCache:
+    """
+    Key/value cache in a local SQLite file, shared by every worker process on the host.
+
+    Values are stored as JSON with an optional time-to-live. Caches with different
+    namespaces (report cache, tool schemas, sessions) can share one file.
+    """
+
+    def __init__(self, namespace, db_path=SHARED_CACHE_DB, ttl=None):
+        self.namespace = namespace
+        self.db_path = db_path
+        self.ttl = ttl
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._create_table(conn)
+                    self._initialized = True
+        return conn
+
+    def _create_table(self, conn):
+        # WAL lets readers in other workers proceed while one of them writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+        ''')
+
+    def get(self, key, default=None):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (self.namespace, key, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+        metrics.record_cache(f"shared:{self.namespace}", row is not None)
+        return json.loads(row[0]) if row is not None else default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), now + ttl if ttl else None, now)
+            )
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+        finally:
+            conn.close()
+
+    def purge_expired(self):
+        """
+        Remove expired entries of this namespace; returns how many were removed
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                (self.namespace, time.time())
+            )
+            return cursor.rowcount
+        finally:
+            conn.close()
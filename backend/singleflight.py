@@ -0,0 +1,134 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+While a call for a key is running, further calls with the same key wait for it and
+share its result (or exception) instead of starting their own. Nothing is cached:
+once the call finishes, the next one for that key runs again.
+
+`Group` is for blocking callers on threads, `AsyncGroup` for coroutines. Both
+return `(result, shared)`; `shared` is True for callers that got another call's
+result, which must then be treated as read-only or copied.
+
+A `Group` call that wants to stop early (e.g. a hedged request whose caller already
+has an answer) asks `abandon()` first: it only agrees while nobody else is waiting on
+the call, and then takes the call out of the group so no one can join it any more.
+"""
+
+import os
+import asyncio
+import threading
+import contextvars
+
+import metrics
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
+
+SINGLEFLIGHT_CALLS = metrics.counter(
+    "singleflight_calls_total", "Calls through a single-flight group; coalesced ones shared another call's result",
+    ("group", "result"))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+# (group, key, call) of the `Group` call running in this context, for `abandon`
+_current = contextvars.ContextVar("singleflight_call", default=None)
+
+
+def abandon():
+    """
+    From inside a `Group` call: True if it may stop early because no other caller is
+    waiting on it (or it is not coalesced at all), in which case no one can join it now
+    """
+    current = _current.get()
+    if current is None:
+        return True
+    group, key, call = current
+    with group._lock:
+        if call.waiters:
+            return False
+        if group._calls.get(key) is call:
+            del group._calls[key]
+        return True
+
+
+class Group:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Run `fn()` unless a call with `key` is already running, in which case wait for it
+        """
+        if not SINGLEFLIGHT_ENABLED:
+            return fn(), False
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            SINGLEFLIGHT_CALLS.inc(group=self.name, result="coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        SINGLEFLIGHT_CALLS.inc(group=self.name, result="executed")
+        token = _current.set((self, key, call))
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            _current.reset(token)
+            with self._lock:
+                # Already gone if the call was abandoned
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+
+class AsyncGroup:
+    def __init__(self, name):
+        self.name = name
+        self._tasks = {}
+
+    async def do(self, key, coro_fn):
+        """
+        Await `coro_fn()` unless a call with `key` is already running, in which case await that.
+
+        The call runs as its own task, so a caller that is cancelled (e.g. a client
+        disconnect) does not cancel it for the others waiting on it.
+        """
+        if not SINGLEFLIGHT_ENABLED:
+            return await coro_fn(), False
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            SINGLEFLIGHT_CALLS.inc(group=self.name, result="coalesced")
+        else:
+            SINGLEFLIGHT_CALLS.inc(group=self.name, result="executed")
+            task = asyncio.ensure_future(coro_fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,34 @@
+"""
+Web Mercator (slippy map) tile coordinates for complaint density heatmaps.
+
+Complaints store their tile at TILE_MAX_ZOOM; the tile at any lower zoom z is that
+shifted right by TILE_MAX_ZOOM - z bits, which is how the aggregation triggers in
+db.py derive every level without floating-point math in SQL. A served tile is split
+into cells TILE_CELL_BITS zoom levels deeper (8x8 by default), so a map can draw a
+heatmap from counts without any per-complaint data.
+"""
+
+import os
+import math
+
+# z18 tiles are ~150 m across at the equator: finer than complaint locations are accurate
+TILE_MAX_ZOOM = 18
+TILE_CELL_BITS = int(os.getenv("TILE_CELL_BITS", "3"))
+# Mercator is undefined at the poles; the square world map stops here
+MAX_LATITUDE = 85.05112878
+
+
+def tile_xy(latitude, longitude, zoom=TILE_MAX_ZOOM):
+    """
+    (x, y) of the tile containing a point at `zoom`, with y growing southwards
+    """
+    latitude = min(max(latitude, -MAX_LATITUDE), MAX_LATITUDE)
+    n = 1 << zoom
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2.0 * n)
+    # The east edge and the clamped south edge belong to the last tile
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def cell_zoom(zoom):
+    return min(zoom + TILE_CELL_BITS, TILE_MAX_ZOOM)
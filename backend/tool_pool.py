@@ -0,0 +1,138 @@
+"""
+Concurrency for the FastMCP tool servers: a bounded worker pool for blocking tools and
+a multi-worker serving mode.
+
+FastMCP calls a plain `def` tool directly on the event loop, so one slow database query,
+HTTP call or Ollama generation stalls every other client of the server. Tools decorated
+with `blocking_tool` run on a shared thread pool of MCP_TOOL_WORKERS threads instead:
+
+- the caller's contextvars (trace context, request) are copied into the worker thread
+- each tool has a concurrency limit; calls beyond it wait for a slot, not a thread
+- each call has a timeout covering the wait and the run, after which the client gets a
+  tool error. A thread cannot be interrupted, so a timed-out call keeps its slot until
+  it really finishes, and the limit holds even then
+
+Usage:
+    @mcp.tool("Get_EMH")
+    @metrics.track_tool("Get_EMH")
+    @tracing.traced_tool("Get_EMH")
+    @tool_pool.blocking_tool("Get_EMH", max_concurrency=8, timeout=30)
+    def get_emh(patient_id: int) -> str:
+        ...
+
+Apply it last (closest to the function), so the metrics and tracing wrappers around it
+measure the queueing too.
+
+`run` serves a server over streamable HTTP. With MCP_WORKERS > 1 it starts that many
+uvicorn worker processes on the same port. MCP sessions live in a process's memory, so
+that mode is stateless: every request stands alone and any worker can answer it.
+MCP_STATELESS_HTTP=1 also makes a single worker stateless.
+"""
+
+import os
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from fastmcp.exceptions import ToolError
+
+import metrics
+
+MCP_TOOL_WORKERS = int(os.getenv("MCP_TOOL_WORKERS", "16"))
+MCP_TOOL_TIMEOUT = float(os.getenv("MCP_TOOL_TIMEOUT", "60"))
+MCP_WORKERS = int(os.getenv("MCP_WORKERS", "1"))
+MCP_STATELESS_HTTP = MCP_WORKERS > 1 or os.getenv("MCP_STATELESS_HTTP", "0") == "1"
+
+TOOL_QUEUE_WAIT = metrics.histogram(
+    "mcp_tool_queue_wait_seconds", "Time blocking tool calls waited for a concurrency slot", ("tool",))
+TOOL_IN_FLIGHT = metrics.gauge(
+    "mcp_tool_in_flight", "Blocking tool calls holding a slot, including timed-out ones still running", ("tool",))
+TOOL_TIMEOUTS = metrics.counter(
+    "mcp_tool_timeouts_total", "Blocking tool calls that exceeded their timeout", ("tool",))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MCP_TOOL_WORKERS, thread_name_prefix="mcp-tool")
+    return _executor
+
+
+def blocking_tool(name, max_concurrency=None, timeout=None):
+    """
+    Decorator running a blocking tool function on the worker pool (see module docstring).
+
+    `max_concurrency` defaults to the pool size and `timeout` to MCP_TOOL_TIMEOUT seconds.
+    """
+    limit = max_concurrency or MCP_TOOL_WORKERS
+    timeout = timeout or MCP_TOOL_TIMEOUT
+
+    def decorator(fn):
+        # Created on first call, inside the server's event loop
+        slots = None
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            nonlocal slots
+            if slots is None:
+                slots = asyncio.Semaphore(limit)
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(slots.acquire(), timeout)
+            except asyncio.TimeoutError:
+                TOOL_TIMEOUTS.inc(tool=name)
+                raise ToolError(f"{name} is busy; no slot became free within {timeout:g}s") from None
+            TOOL_QUEUE_WAIT.observe(time.perf_counter() - started, tool=name)
+            TOOL_IN_FLIGHT.inc(tool=name)
+
+            def release(_):
+                TOOL_IN_FLIGHT.dec(tool=name)
+                try:
+                    loop.call_soon_threadsafe(slots.release)
+                except RuntimeError:
+                    # A timed-out call finishing after the server's loop closed
+                    pass
+
+            try:
+                future = executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+            except BaseException:
+                TOOL_IN_FLIGHT.dec(tool=name)
+                slots.release()
+                raise
+            # Released when the thread is done, not when the caller stops waiting
+            future.add_done_callback(release)
+            remaining = max(timeout - (time.perf_counter() - started), 0)
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), remaining)
+            except asyncio.TimeoutError:
+                TOOL_TIMEOUTS.inc(tool=name)
+                raise ToolError(f"{name} timed out after {timeout:g}s") from None
+        return wrapper
+    return decorator
+
+
+def http_app(mcp):
+    """
+    ASGI app of a server, for `uvicorn module:app` and the worker processes `run` starts
+    """
+    return mcp.http_app(stateless_http=MCP_STATELESS_HTTP)
+
+
+def run(mcp, app_path, port, host="0.0.0.0", log_level="debug"):
+    """
+    Serve `mcp` over streamable HTTP; `app_path` ("module:app") is what workers import
+    """
+    if MCP_WORKERS > 1:
+        import uvicorn
+        uvicorn.run(app_path, host=host, port=port, workers=MCP_WORKERS, log_level=log_level)
+        return
+    mcp.run(transport="http", host=host, port=port, log_level=log_level, stateless_http=MCP_STATELESS_HTTP)
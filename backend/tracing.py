@@ -0,0 +1,405 @@
+"""
+Span-based request tracing.
+
+The current span lives in a contextvar, so it follows `await` and `asyncio.to_thread`.
+It crosses process boundaries in the W3C `traceparent` header: the FastAPI middleware
+reads it, the MCP client sends it, and `traced_tool` picks it up inside FastMCP servers.
+
+Finished spans go to an in-memory buffer (served at /debug/traces/{trace_id}), to
+TRACE_FILE as OTLP-style JSON lines when it is set, and to an OTLP/HTTP collector when
+OTEL_EXPORTER_OTLP_ENDPOINT is set. Set TRACING_ENABLED=0 to turn all of it off.
+
+Merge the span files of every process into one breakdown with:
+    python tracing.py traces.jsonl <trace_id> [--folded]
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import inspect
+import functools
+import threading
+import contextvars
+import urllib.request
+from collections import OrderedDict
+
+ENABLED = os.getenv("TRACING_ENABLED", "1") != "0"
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", os.path.basename(sys.argv[0]) or "python")
+TRACE_FILE = os.getenv("TRACE_FILE")
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+MAX_BUFFERED_TRACES = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(bits):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def parse_traceparent(header):
+    """
+    Return (trace_id, parent_span_id) from a `traceparent` header, or None if it is invalid
+    """
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2]
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes",
+                 "start_ns", "end_ns", "error", "_token")
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = None
+        self.end_ns = None
+        self.error = None
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc_type is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        _export(self)
+        return False
+
+    def to_dict(self):
+        """OTLP JSON span representation (ids as hex, as in the OTLP/HTTP JSON encoding)"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                {"key": key, "value": {"stringValue": str(value)}}
+                for key, value in self.attributes.items()
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+            "resource": {"service.name": SERVICE_NAME},
+        }
+
+
+class _NoopSpan:
+    trace_id = None
+    span_id = None
+    traceparent = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, traceparent=None, **attributes):
+    """
+    Start a child of the current span (or a new trace) for use as a context manager.
+
+    Passing `traceparent` continues a trace received from another process instead.
+    """
+    if not ENABLED:
+        return _NOOP_SPAN
+    remote = parse_traceparent(traceparent)
+    if remote:
+        trace_id, parent_id = remote
+    else:
+        parent = _current_span.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = _new_id(128), None
+    return Span(name, trace_id, parent_id, attributes)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def current_traceparent():
+    current = _current_span.get()
+    return current.traceparent if current is not None else None
+
+
+def inject_headers(headers=None):
+    """
+    Return `headers` with the current `traceparent` added, for outgoing HTTP calls
+    """
+    headers = dict(headers or {})
+    traceparent = current_traceparent()
+    if traceparent:
+        headers["traceparent"] = traceparent
+    return headers
+
+
+# --- Export ---
+
+_recent = OrderedDict()
+_recent_lock = threading.Lock()
+_file_lock = threading.Lock()
+_trace_file = None
+_otlp_queue = None
+
+
+def _export(finished):
+    with _recent_lock:
+        spans = _recent.get(finished.trace_id)
+        if spans is None:
+            spans = _recent[finished.trace_id] = []
+            while len(_recent) > MAX_BUFFERED_TRACES:
+                _recent.popitem(last=False)
+        spans.append(finished)
+
+    record = finished.to_dict()
+    if TRACE_FILE:
+        _write_to_file(json.dumps(record) + "\n")
+    if OTLP_ENDPOINT:
+        try:
+            _get_otlp_queue().put_nowait(record)
+        except queue.Full:
+            pass  # Drop spans rather than block the request when the collector is slow
+
+
+def _write_to_file(line):
+    global _trace_file
+    with _file_lock:
+        if _trace_file is None:
+            # Line buffered, so every span is on disk as soon as it ends
+            _trace_file = open(TRACE_FILE, "a", buffering=1)
+        _trace_file.write(line)
+
+
+def _get_otlp_queue():
+    global _otlp_queue
+    if _otlp_queue is None:
+        _otlp_queue = queue.Queue(maxsize=10000)
+        threading.Thread(target=_otlp_worker, args=(_otlp_queue,), daemon=True).start()
+    return _otlp_queue
+
+
+def _otlp_value(record):
+    span_record = dict(record)
+    span_record.pop("resource")
+    return span_record
+
+
+def _otlp_worker(records):
+    url = OTLP_ENDPOINT.rstrip("/") + "/v1/traces"
+    while True:
+        batch = [records.get()]
+        deadline = time.monotonic() + 2
+        while len(batch) < 512:
+            try:
+                batch.append(records.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "ptp.tracing"}, "spans": [_otlp_value(r) for r in batch]}],
+            }]
+        }
+        request = urllib.request.Request(
+            url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except Exception as e:
+            print(f"OTLP export of {len(batch)} spans failed: {e}")
+
+
+# --- Breakdown ---
+
+def get_trace(trace_id):
+    """Spans of a trace buffered in this process, as OTLP-style dicts"""
+    with _recent_lock:
+        return [s.to_dict() for s in _recent.get(trace_id, [])]
+
+
+def load_trace(paths, trace_id):
+    """Spans of a trace collected from one or more TRACE_FILE outputs"""
+    spans = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if trace_id in line:
+                    record = json.loads(line)
+                    if record["traceId"] == trace_id:
+                        spans.append(record)
+    return spans
+
+
+def _build_tree(spans):
+    by_id = {s["spanId"]: s for s in spans}
+    children = {}
+    roots = []
+    for s in sorted(spans, key=lambda s: int(s["startTimeUnixNano"])):
+        parent = s.get("parentSpanId")
+        if parent and parent in by_id:
+            children.setdefault(parent, []).append(s)
+        else:
+            roots.append(s)
+    return roots, children
+
+
+def _duration_ms(s):
+    return (int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"])) / 1e6
+
+
+def breakdown(spans):
+    """
+    Render a trace as an indented tree with total and self time per span
+    """
+    roots, children = _build_tree(spans)
+    if not roots:
+        return ""
+    trace_start = min(int(s["startTimeUnixNano"]) for s in roots)
+    lines = []
+
+    def walk(s, depth):
+        total = _duration_ms(s)
+        self_time = total - sum(_duration_ms(c) for c in children.get(s["spanId"], []))
+        offset = (int(s["startTimeUnixNano"]) - trace_start) / 1e6
+        service = s.get("resource", {}).get("service.name", "")
+        error = "  !" if s["status"].get("code") == 2 else ""
+        lines.append(
+            f"{'  ' * depth}{s['name']:<{max(1, 48 - 2 * depth)}} {total:>10.1f} ms  "
+            f"(self {max(self_time, 0):>8.1f} ms, +{offset:.1f} ms) [{service}]{error}")
+        for c in children.get(s["spanId"], []):
+            walk(c, depth + 1)
+
+    for root in roots:
+        walk(root, 0)
+    return "\n".join(lines)
+
+
+def folded(spans):
+    """
+    Render a trace as folded stacks ("a;b;c <self microseconds>") for flamegraph.pl or speedscope
+    """
+    roots, children = _build_tree(spans)
+    lines = []
+
+    def walk(s, stack):
+        stack = stack + [s["name"].replace(";", ":").replace(" ", "_")]
+        kids = children.get(s["spanId"], [])
+        self_us = (_duration_ms(s) - sum(_duration_ms(c) for c in kids)) * 1000
+        if self_us > 0:
+            lines.append(f"{';'.join(stack)} {int(self_us)}")
+        for c in kids:
+            walk(c, stack)
+
+    for root in roots:
+        walk(root, [])
+    return "\n".join(lines)
+
+
+# --- Integrations ---
+
+def install(app):
+    """
+    Trace every request of a FastAPI app and add the /debug/traces/{trace_id} breakdown
+    """
+    from fastapi import HTTPException
+
+    @app.get("/debug/traces/{trace_id}", include_in_schema=False)
+    def trace_breakdown(trace_id: str):
+        spans = get_trace(trace_id)
+        if not spans:
+            raise HTTPException(status_code=404, detail="Trace not found in this process")
+        return {"trace_id": trace_id, "breakdown": breakdown(spans), "folded": folded(spans), "spans": spans}
+
+    if not ENABLED:
+        return
+
+    @app.middleware("http")
+    async def trace_requests(request, call_next):
+        with span(f"HTTP {request.method}", request.headers.get("traceparent"),
+                  **{"http.method": request.method, "http.target": request.url.path}) as root:
+            response = await call_next(request)
+            route = request.scope.get("route")
+            root.name = f"HTTP {request.method} {getattr(route, 'path', request.url.path)}"
+            root.set_attribute("http.status_code", response.status_code)
+            response.headers["traceparent"] = root.traceparent
+            response.headers["X-Trace-Id"] = root.trace_id
+            return response
+
+
+def _incoming_traceparent():
+    # Only available while serving an MCP request over HTTP
+    try:
+        from fastmcp.server.dependencies import get_http_headers
+        return get_http_headers().get("traceparent")
+    except Exception:
+        return None
+
+
+def traced_tool(name):
+    """
+    Decorator running an MCP tool inside a span that continues the caller's trace.
+
+    Apply it below `@mcp.tool(...)` so the tool registers the wrapped function.
+    """
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(f"tool {name}", _incoming_traceparent(), **{"mcp.tool": name}):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(f"tool {name}", _incoming_traceparent(), **{"mcp.tool": name}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args) < 2:
+        print("usage: python tracing.py TRACE_FILE [TRACE_FILE ...] TRACE_ID [--folded]")
+        sys.exit(2)
+    trace_spans = load_trace(args[:-1], args[-1])
+    if not trace_spans:
+        print(f"No spans found for trace {args[-1]}")
+        sys.exit(1)
+    print(folded(trace_spans) if "--folded" in sys.argv else breakdown(trace_spans))
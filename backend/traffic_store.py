@@ -0,0 +1,415 @@
+"""
+Columnar time-series store for junction sensor readings.
+
+Each month is a directory under TRAFFIC_STORE_DIR holding one float32 matrix per
+metric (`speed` in km/h, `volume` in vehicles per minute), junction-major, with one
+column per minute of the month. The matrices are memory-mapped; they are created as
+sparse files sized for TRAFFIC_MAX_JUNCTIONS rows, so junctions and minutes without
+readings take no disk. A speed of 0 therefore means "no reading"; a reported
+standstill is stored as STANDSTILL_SPEED. `junctions.json` maps junction ids to rows
+and holds optional free-flow speeds.
+
+Queries read TRAFFIC_BLOCK_JUNCTIONS rows at a time, so working memory stays bounded
+for any number of junctions, and every computation on a block is vectorized.
+
+Definitions used by the analytics:
+- congestion index: free-flow speed / observed speed - 1, floored at 0 (0.5 means
+  trips take 50% longer than in free flow). The free-flow speed is the registered one,
+  else the junction's 95th-percentile hourly mean speed over the queried range.
+- peak hours: hours of the day with the highest mean congestion index
+- anomalies: hourly mean speeds whose robust z-score (median/MAD) against the same
+  hour of the day on the other days of the range reaches the threshold
+"""
+
+import os
+import json
+import warnings
+import threading
+import contextlib
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where the store is then only safe within one process
+    fcntl = None
+
+import numpy as np
+
+import tracing
+
+TRAFFIC_STORE_DIR = os.getenv("TRAFFIC_STORE_DIR", "traffic_store")
+TRAFFIC_MAX_JUNCTIONS = int(os.getenv("TRAFFIC_MAX_JUNCTIONS", "4096"))
+TRAFFIC_BLOCK_JUNCTIONS = int(os.getenv("TRAFFIC_BLOCK_JUNCTIONS", "32"))
+STANDSTILL_SPEED = 0.01
+
+MINUTE = np.timedelta64(1, "m")
+
+
+def _minutes(delta):
+    return int(delta // MINUTE)
+
+
+def parse_time(value, default=None):
+    """
+    ISO timestamp (or None for `default`) as datetime64[m]
+    """
+    if value is None:
+        return default
+    return np.datetime64(value, "m")
+
+
+def _top_hours(profile, top):
+    """
+    Hours of the day with the highest values in a 24-value profile, skipping hours without data
+    """
+    hours = np.argsort(np.where(np.isnan(profile), -np.inf, profile))[::-1][:top]
+    return hours[~np.isnan(profile[hours])]
+
+
+class TrafficStore:
+    def __init__(self, root=TRAFFIC_STORE_DIR, max_junctions=TRAFFIC_MAX_JUNCTIONS,
+                 block_junctions=TRAFFIC_BLOCK_JUNCTIONS):
+        self.root = root
+        self.max_junctions = max_junctions
+        self.block_junctions = block_junctions
+        self._lock = threading.Lock()
+        self._registry = None
+        self._registry_mtime = None
+        self._matrices = {}
+
+    # --- Junction registry ---
+
+    @property
+    def _registry_path(self):
+        return os.path.join(self.root, "junctions.json")
+
+    def registry(self):
+        """
+        {junction_id: {"row": int, "free_flow_speed": float | None}}, reloaded when another process changed it
+        """
+        try:
+            mtime = os.path.getmtime(self._registry_path)
+        except FileNotFoundError:
+            return {}
+        if mtime != self._registry_mtime:
+            with open(self._registry_path) as f:
+                self._registry = json.load(f)
+            self._registry_mtime = mtime
+        return self._registry
+
+    @contextlib.contextmanager
+    def _registry_lock(self):
+        """
+        Exclusive across threads and processes (e.g. MCP_WORKERS), for read-modify-write
+        of the registry. The registry itself is replaced on save, so a sibling file is locked.
+        """
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, "junctions.lock"), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _save_registry(self, registry):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self._registry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(registry, f)
+        os.replace(tmp_path, self._registry_path)
+        self._registry, self._registry_mtime = registry, os.path.getmtime(self._registry_path)
+
+    def register(self, junction_ids, free_flow_speeds=None):
+        """
+        Assign rows to unknown junctions and record free-flow speeds; returns the registry
+        """
+        free_flow_speeds = free_flow_speeds or {}
+        with self._registry_lock():
+            # Another process may have saved within the same mtime tick, so always re-read
+            self._registry_mtime = None
+            registry = dict(self.registry())
+            changed = False
+            for junction_id in list(dict.fromkeys(map(str, junction_ids))) + list(free_flow_speeds):
+                if junction_id not in registry:
+                    if len(registry) >= self.max_junctions:
+                        raise ValueError(f"Store is full: TRAFFIC_MAX_JUNCTIONS={self.max_junctions}")
+                    registry[junction_id] = {"row": len(registry), "free_flow_speed": None}
+                    changed = True
+                speed = free_flow_speeds.get(junction_id)
+                if speed is not None and registry[junction_id]["free_flow_speed"] != speed:
+                    registry[junction_id] = {**registry[junction_id], "free_flow_speed": float(speed)}
+                    changed = True
+            if changed:
+                self._save_registry(registry)
+            return registry
+
+    # --- Month matrices ---
+
+    def _matrix(self, month, metric, create=False):
+        """
+        Memory-mapped (max_junctions, minutes in month) matrix, or None if never written
+        """
+        key = (str(month), metric)
+        matrix = self._matrices.get(key)
+        if matrix is not None:
+            return matrix
+        path = os.path.join(self.root, str(month), f"{metric}.f32")
+        shape = (self.max_junctions, _minutes((month + 1).astype("datetime64[m]") - month.astype("datetime64[m]")))
+        if not os.path.exists(path):
+            if not create:
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Sparse: zero pages are not allocated until written
+            with open(path, "wb") as f:
+                f.truncate(shape[0] * shape[1] * 4)
+        matrix = self._matrices[key] = np.memmap(path, dtype=np.float32, mode="r+", shape=shape)
+        return matrix
+
+    def ingest(self, junction_ids, timestamps, speeds, volumes=None, free_flow_speeds=None):
+        """
+        Store readings given as parallel sequences; later readings for the same minute win.
+
+        Returns the number of readings stored.
+        """
+        with tracing.span("traffic.ingest", readings=len(junction_ids)):
+            registry = self.register(junction_ids, free_flow_speeds)
+            rows = np.fromiter((registry[j]["row"] for j in junction_ids), dtype=np.int64, count=len(junction_ids))
+            times = np.asarray(timestamps, dtype="datetime64[m]")
+            speeds = np.maximum(np.asarray(speeds, dtype=np.float32), STANDSTILL_SPEED)
+            volumes = np.asarray(volumes if volumes is not None else np.zeros(len(rows)), dtype=np.float32)
+            months = times.astype("datetime64[M]")
+            for month in np.unique(months):
+                selected = months == month
+                columns = (times[selected] - month.astype("datetime64[m]")) // MINUTE
+                for metric, values in (("speed", speeds), ("volume", volumes)):
+                    matrix = self._matrix(month, metric, create=True)
+                    matrix[rows[selected], columns] = values[selected]
+                    matrix.flush()
+            return len(rows)
+
+    # --- Reading ---
+
+    def _read(self, metric, rows, start, end):
+        """
+        (len(rows), minutes) float32 values of `metric` over [start, end); 0 where missing
+        """
+        out = np.zeros((len(range(rows.start, rows.stop)) if isinstance(rows, slice) else len(rows),
+                        _minutes(end - start)), dtype=np.float32)
+        month = start.astype("datetime64[M]")
+        while month.astype("datetime64[m]") < end:
+            month_start = month.astype("datetime64[m]")
+            low, high = max(start, month_start), min(end, (month + 1).astype("datetime64[m]"))
+            matrix = self._matrix(month, metric)
+            if matrix is not None:
+                out[:, _minutes(low - start):_minutes(high - start)] = \
+                    matrix[rows, _minutes(low - month_start):_minutes(high - month_start)]
+            month += 1
+        return out
+
+    def _blocks(self, junction_ids, start, end, metrics=("speed",)):
+        """
+        Yield (junction ids, free-flow speeds, {metric: values}) per block of junctions
+        """
+        registry = self.registry()
+        if junction_ids:
+            unknown = [j for j in junction_ids if j not in registry]
+            if unknown:
+                raise ValueError(f"Unknown junctions: {', '.join(unknown[:10])}")
+            ids = list(dict.fromkeys(junction_ids))
+        else:
+            ids = sorted(registry, key=lambda j: registry[j]["row"])
+        for first in range(0, len(ids), self.block_junctions):
+            block = ids[first:first + self.block_junctions]
+            rows = np.array([registry[j]["row"] for j in block])
+            if not junction_ids:
+                # All junctions, in row order: a contiguous slice reads faster than fancy indexing
+                rows = slice(int(rows[0]), int(rows[-1]) + 1)
+            free_flow = np.array([registry[j]["free_flow_speed"] or np.nan for j in block], dtype=np.float64)
+            yield block, free_flow, {metric: self._read(metric, rows, start, end) for metric in metrics}
+
+    @staticmethod
+    def _range(start, end, days, align):
+        end = parse_time(end, np.datetime64(datetime.now(), "m"))
+        start = parse_time(start, end - np.timedelta64(days, "D"))
+        # Whole hours (or days), so per-minute columns reshape into them
+        start = start.astype(f"datetime64[{align}]").astype("datetime64[m]")
+        end = (end - MINUTE).astype(f"datetime64[{align}]").astype("datetime64[m]") + np.timedelta64(1, align)
+        if end <= start:
+            raise ValueError("end must be after start")
+        return start, end
+
+    @staticmethod
+    def _hourly(values, valid):
+        """
+        Hourly means of per-minute values, NaN for hours without readings, and reading counts
+        """
+        n, minutes = values.shape
+        counts = valid.reshape(n, minutes // 60, 60).sum(axis=2)
+        # Missing minutes are stored as 0, so they add nothing to the sums
+        sums = values.reshape(n, minutes // 60, 60).sum(axis=2, dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts, counts
+
+    @staticmethod
+    def _congestion(speed, valid, free_flow, hourly_speed):
+        """
+        Per-minute congestion index (0 where missing) and the free-flow speeds used
+        """
+        # Nearest-rank 95th percentile per row; np.sort puts NaN last, and is much faster
+        # than np.nanpercentile
+        ordered = np.sort(hourly_speed, axis=1)
+        hours = (~np.isnan(hourly_speed)).sum(axis=1)
+        rank = np.maximum(np.round((hours - 1) * 0.95).astype(np.int64), 0)
+        estimated = np.where(hours > 0, np.take_along_axis(ordered, rank[:, None], axis=1)[:, 0], np.nan)
+        free_flow = np.where(np.isnan(free_flow), estimated, free_flow).astype(np.float32)
+        index = np.zeros_like(speed)
+        np.divide(free_flow[:, None], speed, out=index, where=valid)
+        # Missing minutes were left at 0 and end up at 0 again
+        index -= 1
+        np.maximum(index, 0, out=index)
+        return index, free_flow
+
+    # --- Analytics ---
+
+    def congestion(self, junction_ids=None, start=None, end=None, window_minutes=15, top=20):
+        """
+        Rolling congestion index per junction: mean, worst window and latest window
+        """
+        start, end = self._range(start, end, 7, "h")
+        window = min(max(1, int(window_minutes)), _minutes(end - start))
+        results = []
+        with tracing.span("traffic.congestion"):
+            for block, free_flow, data in self._blocks(junction_ids, start, end):
+                speed = data["speed"]
+                valid = speed > 0
+                hourly_speed, _ = self._hourly(speed, valid)
+                index, free_flow = self._congestion(speed, valid, free_flow, hourly_speed)
+                # Rolling mean over readings only, from windowed differences of running sums.
+                # float32 sums are accurate to ~1e-3 over a window, well within the rounding below.
+                sums = np.zeros((len(block), index.shape[1] + 1), dtype=np.float32)
+                np.cumsum(index, axis=1, out=sums[:, 1:])
+                counts = np.zeros((len(block), index.shape[1] + 1), dtype=np.int32)
+                np.cumsum(valid, axis=1, out=counts[:, 1:])
+                window_counts = counts[:, window:] - counts[:, :-window]
+                # Windows without readings get 0 rather than NaN, so plain argmax works
+                rolling = sums[:, window:] - sums[:, :-window]
+                rolling /= np.maximum(window_counts, 1)
+                has_data = counts[:, -1] > 0
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    mean = index.sum(axis=1, dtype=np.float64) / counts[:, -1]
+                worst = rolling.argmax(axis=1)
+                last_valid = rolling.shape[1] - 1 - (window_counts[:, ::-1] > 0).argmax(axis=1)
+                for i, junction_id in enumerate(block):
+                    if not has_data[i]:
+                        continue
+                    results.append({
+                        "junction_id": junction_id,
+                        "free_flow_speed": round(float(free_flow[i]), 1),
+                        "mean_index": round(float(mean[i]), 3),
+                        "max_index": round(float(rolling[i, worst[i]]), 3),
+                        "max_window_end": str(start + (worst[i] + window) * MINUTE),
+                        "latest_index": round(float(rolling[i, last_valid[i]]), 3),
+                        "latest_window_end": str(start + (last_valid[i] + window) * MINUTE),
+                    })
+        results.sort(key=lambda r: r["mean_index"], reverse=True)
+        return {
+            "start": str(start), "end": str(end), "window_minutes": window,
+            "junctions_with_data": len(results),
+            "network_mean_index": round(float(np.mean([r["mean_index"] for r in results])), 3) if results else None,
+            "most_congested": results[:top],
+        }
+
+    def peak_hours(self, junction_ids=None, start=None, end=None, top=3, weekdays_only=False):
+        """
+        Mean congestion index by hour of day, for the network and per junction
+        """
+        start, end = self._range(start, end, 28, "h")
+        hours = np.arange(_minutes(end - start) // 60)
+        hour_starts = start + hours * np.timedelta64(60, "m")
+        hour_of_day = (hour_starts.astype("datetime64[h]").astype(np.int64) % 24)
+        # 1970-01-01 was a Thursday: Monday is 0
+        weekday = (hour_starts.astype("datetime64[D]").astype(np.int64) + 3) % 7
+        included = weekday < 5 if weekdays_only else np.ones(len(hours), dtype=bool)
+
+        profile_sums, profile_counts, per_junction = np.zeros(24), np.zeros(24), []
+        with tracing.span("traffic.peak_hours"):
+            for block, free_flow, data in self._blocks(junction_ids, start, end):
+                speed = data["speed"]
+                valid = speed > 0
+                hourly_speed, _ = self._hourly(speed, valid)
+                index, _ = self._congestion(speed, valid, free_flow, hourly_speed)
+                hourly_sums = index.reshape(len(block), -1, 60).sum(axis=2, dtype=np.float64)[:, included]
+                hourly_counts = valid.reshape(len(block), -1, 60).sum(axis=2)[:, included]
+                by_hour_sums = np.zeros((len(block), 24))
+                by_hour_counts = np.zeros((len(block), 24))
+                np.add.at(by_hour_sums.T, hour_of_day[included], hourly_sums.T)
+                np.add.at(by_hour_counts.T, hour_of_day[included], hourly_counts.T)
+                profile_sums += by_hour_sums.sum(axis=0)
+                profile_counts += by_hour_counts.sum(axis=0)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    profiles = by_hour_sums / by_hour_counts
+                for i, junction_id in enumerate(block):
+                    if by_hour_counts[i].sum() == 0:
+                        continue
+                    peaks = _top_hours(profiles[i], top)
+                    per_junction.append({
+                        "junction_id": junction_id,
+                        "peak_hours": [int(h) for h in peaks],
+                        "peak_index": round(float(profiles[i, peaks[0]]), 3),
+                    })
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            profile = profile_sums / profile_counts
+        ranked = [int(h) for h in _top_hours(profile, top)]
+        per_junction.sort(key=lambda r: r["peak_index"], reverse=True)
+        return {
+            "start": str(start), "end": str(end), "weekdays_only": weekdays_only,
+            "network_profile": [None if np.isnan(v) else round(float(v), 3) for v in profile],
+            "network_peak_hours": ranked,
+            "junctions": per_junction[:50],
+        }
+
+    def anomalies(self, junction_ids=None, start=None, end=None, z_threshold=3.5, min_change=0.15,
+                  min_readings=30, limit=50):
+        """
+        Hours whose mean speed is unusual for that junction at that hour of day.
+
+        An hour is flagged when its robust z-score reaches `z_threshold` and its speed also
+        differs from the usual one by at least `min_change` (a fraction), so junctions with
+        very steady traffic do not flag small wobbles.
+        """
+        start, end = self._range(start, end, 28, "D")
+        days = _minutes(end - start) // (24 * 60)
+        if days < 3:
+            raise ValueError("Anomaly detection needs at least 3 days to form a baseline")
+        flagged = []
+        with tracing.span("traffic.anomalies"):
+            for block, _, data in self._blocks(junction_ids, start, end):
+                speed = data["speed"]
+                hourly_speed, counts = self._hourly(speed, speed > 0)
+                hourly_speed[counts < min_readings] = np.nan
+                by_day = hourly_speed.reshape(len(block), days, 24)
+                with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+                    # All-NaN slices (junction never reported at that hour) are expected
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    median = np.nanmedian(by_day, axis=1, keepdims=True)
+                    mad = np.nanmedian(np.abs(by_day - median), axis=1, keepdims=True)
+                    z = 0.6745 * (by_day - median) / mad
+                    change = np.abs(by_day - median) / median
+                z = np.where(np.isfinite(z), z, 0)
+                for i, day, hour in zip(*np.nonzero((np.abs(z) >= z_threshold) & (change >= min_change))):
+                    flagged.append({
+                        "junction_id": block[i],
+                        "hour": str(start + np.timedelta64(int(day) * 24 + int(hour), "h")),
+                        "mean_speed": round(float(by_day[i, day, hour]), 1),
+                        "expected_speed": round(float(median[i, 0, hour]), 1),
+                        "z_score": round(float(z[i, day, hour]), 2),
+                        "kind": "slowdown" if z[i, day, hour] < 0 else "speedup",
+                    })
+        flagged.sort(key=lambda a: abs(a["z_score"]), reverse=True)
+        return {"start": str(start), "end": str(end), "total": len(flagged), "anomalies": flagged[:limit]}
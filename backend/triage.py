@@ -0,0 +1,281 @@
+"""
+Local fast-path triage of complaint messages.
+
+A linear model per label (department, severity, category) trained on the complaints
+table predicts the labels of a new message in well under a millisecond. When every
+label is predicted with at least TRIAGE_CONFIDENCE probability, the report is built
+locally; anything less certain is escalated to Gemini.
+
+Text is featurized with a stateless hashing vectorizer, so the models can be updated
+with `partial_fit` on just the complaints added since the last update. A full refit
+only happens when a label value appears that the model has never seen. The models
+are pickled to TRIAGE_MODEL_PATH so a restart resumes where training stopped.
+
+scikit-learn is optional: without it every message is escalated. It is imported by
+`initialize()` (run from the app's warm-up) rather than at module load.
+"""
+
+import os
+import time
+import copy
+import pickle
+import random
+import threading
+import importlib.util
+
+import metrics
+import tracing
+from db import get_labeled_complaints
+
+TRIAGE_ENABLED = os.getenv("TRIAGE_ENABLED", "1") == "1"
+TRIAGE_MODEL_PATH = os.getenv("TRIAGE_MODEL_PATH", "triage_model.pkl")
+TRIAGE_CONFIDENCE = float(os.getenv("TRIAGE_CONFIDENCE", "0.85"))
+# A label is only predicted locally once this many labeled complaints have trained it
+TRIAGE_MIN_SAMPLES = int(os.getenv("TRIAGE_MIN_SAMPLES", "50"))
+# New complaints to accumulate before the next incremental update
+TRIAGE_RETRAIN_BATCH = int(os.getenv("TRIAGE_RETRAIN_BATCH", "20"))
+TRIAGE_REFIT_EPOCHS = 5
+
+TARGETS = ("department", "severity", "category")
+TIMELINES = {"High": "1-2 days", "Medium": "3-5 days", "Low": "1-2 weeks"}
+
+TRIAGE_DECISIONS = metrics.counter(
+    "triage_decisions_total", "Local triage outcomes (local, escalated, unavailable)", ("outcome",))
+TRIAGE_LATENCY = metrics.histogram(
+    "triage_duration_seconds", "Local triage prediction latency",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+
+SKLEARN_AVAILABLE = importlib.util.find_spec("sklearn") is not None
+
+
+class _CompiledModels:
+    """
+    All targets' weights stacked into one matrix, for single-message prediction.
+
+    Equivalent to HashingVectorizer.transform + predict_proba per target, minus their
+    input validation, which costs milliseconds for a single short message.
+    """
+
+    def __init__(self, models, vectorizer):
+        import numpy as np
+        from sklearn.utils import murmurhash3_32
+
+        self._np = np
+        self._hash = murmurhash3_32
+        self.analyzer = vectorizer.build_analyzer()
+        self.n_features = vectorizer.n_features
+        self.weights = np.hstack([model.coef_.T for model in models.values()])
+        self.intercepts = np.concatenate([model.intercept_ for model in models.values()])
+        self.targets = []
+        start = 0
+        for target, model in models.items():
+            stop = start + model.coef_.shape[0]
+            self.targets.append((target, start, stop, model.classes_))
+            start = stop
+
+    def predict(self, text):
+        np = self._np
+        counts = {}
+        for token in self.analyzer(text):
+            # Same bucket as HashingVectorizer(alternate_sign=False)
+            index = abs(self._hash(token, seed=0)) % self.n_features
+            counts[index] = counts.get(index, 0) + 1
+        predictions = {}
+        if counts:
+            values = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+            values /= np.sqrt(values @ values)
+            scores = values @ self.weights[list(counts)] + self.intercepts
+        else:
+            scores = self.intercepts
+        for target, start, stop, classes in self.targets:
+            # One-vs-rest logistic probabilities, as SGDClassifier.predict_proba
+            probabilities = 1.0 / (1.0 + np.exp(-scores[start:stop]))
+            if len(classes) == 2:
+                probabilities = np.array([1.0 - probabilities[0], probabilities[0]])
+            else:
+                probabilities /= probabilities.sum()
+            best = probabilities.argmax()
+            predictions[target] = (classes[best], float(probabilities[best]))
+        return predictions
+
+
+def complaint_text(title, description):
+    return f"{title}. {description}" if title else description
+
+
+class TriageClassifier:
+    def __init__(self, model_path=TRIAGE_MODEL_PATH, confidence=TRIAGE_CONFIDENCE,
+                 min_samples=TRIAGE_MIN_SAMPLES, retrain_batch=TRIAGE_RETRAIN_BATCH):
+        self.model_path = model_path
+        self.confidence = confidence
+        self.min_samples = min_samples
+        self.retrain_batch = retrain_batch
+        self.available = TRIAGE_ENABLED and SKLEARN_AVAILABLE
+        # target -> fitted SGDClassifier, and how many labeled rows it has seen
+        self.models = {}
+        self.samples = {}
+        self.last_id = 0
+        self.pending = 0
+        self._loaded_mtime = 0
+        self._update_lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        self._vectorizer = None
+        self._compiled = None
+
+    def initialize(self):
+        """
+        Import scikit-learn and load the saved model; safe to call repeatedly
+        """
+        with self._init_lock:
+            if self._vectorizer is None and self.available:
+                from sklearn.feature_extraction.text import HashingVectorizer
+                self._vectorizer = HashingVectorizer(
+                    n_features=2 ** 16, ngram_range=(1, 2), alternate_sign=False, norm="l2")
+                self.load()
+
+    # --- Persistence ---
+
+    def load(self):
+        if not os.path.exists(self.model_path):
+            return
+        try:
+            mtime = os.path.getmtime(self.model_path)
+            with open(self.model_path, "rb") as f:
+                state = pickle.load(f)
+            self.models, self.samples, self.last_id = state["models"], state["samples"], state["last_id"]
+            self._compiled = _CompiledModels(self.models, self._vectorizer) if self.models else None
+            self._loaded_mtime = mtime
+            print(f"Loaded triage model trained up to complaint {self.last_id}")
+        except Exception as e:
+            print(f"Ignoring unreadable triage model {self.model_path}: {e}")
+
+    def save(self):
+        state = {"models": self.models, "samples": self.samples, "last_id": self.last_id}
+        # Written aside and renamed, so other workers never load a partial file
+        tmp_path = f"{self.model_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f)
+        os.replace(tmp_path, self.model_path)
+        self._loaded_mtime = os.path.getmtime(self.model_path)
+
+    # --- Training ---
+
+    def note_new_complaint(self):
+        """
+        Count a newly stored complaint; returns True when an update is due
+        """
+        self.pending += 1
+        return self.available and self.pending >= self.retrain_batch
+
+    def update(self):
+        """
+        Train on the complaints added since the last update
+        """
+        if not self.available or not self._update_lock.acquire(blocking=False):
+            return
+        try:
+            self.initialize()
+            with tracing.span("triage.update"):
+                # Another worker may have trained (and saved) past our last_id already
+                if os.path.exists(self.model_path) and os.path.getmtime(self.model_path) > self._loaded_mtime:
+                    self.load()
+                rows = get_labeled_complaints(self.last_id)
+                self.pending = 0
+                if not rows:
+                    return
+                # Train copies and swap them in, so predictions never see a half-updated model
+                models = {target: copy.deepcopy(model) for target, model in self.models.items()}
+                samples = dict(self.samples)
+                for target in TARGETS:
+                    labeled = [(complaint_text(r["title"], r["description"]), r[target]) for r in rows if r[target]]
+                    if not labeled:
+                        continue
+                    model = models.get(target)
+                    if model is None or not set(label for _, label in labeled) <= set(model.classes_):
+                        refit = self._refit(target)
+                        if refit is not None:
+                            models[target], samples[target] = refit
+                    else:
+                        texts, labels = zip(*labeled)
+                        model.partial_fit(self._vectorizer.transform(texts), labels)
+                        samples[target] += len(labeled)
+                compiled = _CompiledModels(models, self._vectorizer) if models else None
+                self.models, self.samples, self.last_id, self._compiled = models, samples, rows[-1]["id"], compiled
+                self.save()
+                print(f"Triage model updated with {len(rows)} complaints (up to {self.last_id}): {self.samples}")
+        except Exception as e:
+            # e.g. no complaints table yet; the next update tries again
+            print(f"Triage model update failed: {e}")
+        finally:
+            self._update_lock.release()
+
+    def _refit(self, target):
+        """
+        Fit a fresh model on every labeled complaint, for when a new label value appears.
+
+        Returns (model, samples), or None while there is only one label value.
+        """
+        from sklearn.linear_model import SGDClassifier
+
+        labeled = [(complaint_text(r["title"], r["description"]), r[target])
+                   for r in get_labeled_complaints(0) if r[target]]
+        classes = sorted(set(label for _, label in labeled))
+        if len(classes) < 2:
+            return None
+        model = SGDClassifier(loss="log_loss", alpha=1e-5, random_state=0)
+        shuffler = random.Random(0)
+        for _ in range(TRIAGE_REFIT_EPOCHS):
+            shuffler.shuffle(labeled)
+            texts, labels = zip(*labeled)
+            model.partial_fit(self._vectorizer.transform(texts), labels, classes=classes)
+        return model, len(labeled)
+
+    # --- Prediction ---
+
+    def predict(self, text):
+        """
+        Return {target: (label, probability)} for every trained target
+        """
+        compiled = self._compiled
+        return compiled.predict(text) if compiled is not None else {}
+
+    def triage(self, message):
+        """
+        Build a report locally when every label is confident, else return None to escalate
+        """
+        if not self.available:
+            TRIAGE_DECISIONS.inc(outcome="unavailable")
+            return None
+        self.initialize()
+        start = time.perf_counter()
+        confident = all(self.samples.get(t, 0) >= self.min_samples for t in TARGETS)
+        predictions = self.predict(message) if confident else {}
+        confident = confident and all(p >= self.confidence for _, p in predictions.values())
+        TRIAGE_LATENCY.observe(time.perf_counter() - start)
+        TRIAGE_DECISIONS.inc(outcome="local" if confident else "escalated")
+        if not confident:
+            return None
+
+        department, severity, category = (predictions[t][0] for t in TARGETS)
+        return {
+            "success": True,
+            "source": "triage",
+            "confidence": {t: round(p, 3) for t, (_, p) in predictions.items()},
+            "report": {
+                "title": _title(message),
+                "department": department,
+                "severity": severity,
+                "description": message,
+                "suggested_action": f"Forward to {department} for inspection and resolution",
+                "estimated_timeline": TIMELINES.get(severity, "5-7 days"),
+                "location": "Not specified",
+                "category": category
+            }
+        }
+
+
+def _title(message, max_length=60):
+    first_sentence = message.strip().split(".")[0].strip()
+    if len(first_sentence) > max_length:
+        first_sentence = first_sentence[:max_length].rsplit(" ", 1)[0] + "..."
+    return first_sentence[:1].upper() + first_sentence[1:]
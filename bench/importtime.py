@@ -0,0 +1,97 @@
+"""
+Import-time budget for the server entry points.
+
+Each module is imported in a fresh interpreter with `python -X importtime`; the
+cumulative time of the top-level import (best of `--runs`) is compared with its
+budget, and the slowest nested imports are listed so a regression can be traced to
+the dependency that caused it. Heavy SDKs (google-genai, LangChain, Groq, the MariaDB
+driver) are expected to stay out of these numbers: they are loaded on first use or by
+the warm-up that runs after startup.
+
+Usage:
+    python bench/importtime.py
+    python bench/importtime.py --modules app,agent --runs 5 --fail-over-budget
+    python bench/importtime.py --scale 1.5   # slower machine: multiply every budget
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# name: (module, working directory, budget in ms)
+ENTRY_POINTS = {
+    "app": ("app", ROOT / "backend", 700),
+    "agent": ("backend", ROOT, 700),
+    "hospital_mcp": ("llm", ROOT / "backend", 1300),
+    "traffic_mcp": ("mncp", ROOT / "backend", 1300),
+    "complaint_mcp": ("let_mcp_handle", ROOT, 1300),
+}
+
+
+def parse_importtime(stderr):
+    """Return [(cumulative_us, depth, module)] from `-X importtime` output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:  self_us |  cumulative_us | <indent>module"
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def measure(module, cwd):
+    env = dict(os.environ, WARM_UP="0")
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, env=env, capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{process.stderr[-2000:]}")
+    rows = parse_importtime(process.stderr)
+    total = next(us for us, _, name in reversed(rows) if name == module)
+    return total, rows
+
+
+def main(args):
+    names = args.modules.split(",")
+    unknown = set(names) - set(ENTRY_POINTS)
+    if unknown:
+        raise SystemExit(f"Unknown modules: {', '.join(sorted(unknown))}")
+
+    over_budget = []
+    for name in names:
+        module, cwd, budget_ms = ENTRY_POINTS[name]
+        budget_ms *= args.scale
+        best = None
+        for _ in range(args.runs):
+            total, rows = measure(module, cwd)
+            if best is None or total < best[0]:
+                best = (total, rows)
+        total_ms = best[0] / 1000
+        status = "ok" if total_ms <= budget_ms else "OVER"
+        print(f"{name:<16} import {module:<16} {total_ms:>8.1f} ms  budget {budget_ms:>7.0f} ms  {status}")
+        # Direct dependencies of the entry point, slowest first
+        children = sorted((r for r in best[1] if r[1] == 1), reverse=True)[:args.top]
+        for us, _, child in children:
+            print(f"    {us / 1000:>8.1f} ms  {child}")
+        if status != "ok":
+            over_budget.append(name)
+
+    if over_budget and args.fail_over_budget:
+        raise SystemExit(f"Import time over budget: {', '.join(over_budget)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time budget for the server entry points")
+    parser.add_argument("--modules", default=",".join(ENTRY_POINTS), help="Comma-separated entry point names")
+    parser.add_argument("--runs", type=int, default=3, help="Imports per module; the fastest is kept")
+    parser.add_argument("--top", type=int, default=5, help="Slowest direct imports to list")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier applied to every budget")
+    parser.add_argument("--fail-over-budget", action="store_true", help="Exit non-zero when a budget is exceeded")
+    main(parser.parse_args())
@@ -0,0 +1,382 @@
+"""
+Offline end-to-end load test for the HTTP servers.
+
+The FastAPI apps (backend/app.py and the root backend.py agent) are driven in-process
+through httpx's ASGI transport. Gemini and Groq are replaced by the stubs in
+bench/stubs.py with configurable latency; the MCP tool servers are the real FastMCP
+servers (let_mcp_handle.py ComplaintSystem or backend/mncp.py Traffic), started as
+subprocesses. Everything runs in a scratch directory, so no real database is touched.
+
+With `--llm record` the live models are called once and their answers stored with the
+LLM record/replay transport; `--llm replay` then serves those recordings (with their
+recorded latency) instead of the stubs, so runs use realistic payloads fully offline.
+
+Each run is stored in bench/results/ as JSON named after the time and git revision,
+and `--compare` diffs it against the previous stored run.
+
+Usage:
+    python bench/run.py
+    python bench/run.py --scenarios api_chat,agent_chat --concurrency 1,16,64 --llm-latency 0.5
+    python bench/run.py --scenarios api_chat --llm-slow-share 0.05 --llm-slow-factor 10
+    python bench/run.py --compare --fail-on-regression
+    python bench/run.py --llm replay --cassettes bench/cassettes
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+import importlib.util
+from pathlib import Path
+from datetime import datetime, timezone
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from stubs import Latency, StubGeminiClient, StubChatGroq
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "bench" / "results"
+
+MCP_SERVERS = {
+    "complaint": {
+        "script": ROOT / "let_mcp_handle.py",
+        "tool": "submit_report",
+        "args": {"problem_type": "Streetlight", "description": "Light out"},
+    },
+    "traffic": {
+        "script": ROOT / "backend" / "mncp.py",
+        "tool": "add",
+        "args": {"a": 1, "b": 2},
+    },
+}
+
+
+# --- Setup ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"MCP server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"MCP server did not listen on port {port} within {timeout}s")
+
+
+def start_mcp_server(name, workdir):
+    server = MCP_SERVERS[name]
+    port = free_port()
+    env = dict(os.environ, MCP_PORT=str(port))
+    process = subprocess.Popen(
+        [sys.executable, str(server["script"])], cwd=workdir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_for_port(port, process)
+    return process, f"http://127.0.0.1:{port}/mcp/"
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_backend_app(latency, seed_rows, use_stubs):
+    sys.path.insert(0, str(ROOT / "backend"))
+    if use_stubs:
+        os.environ.setdefault("GEMINI_API_KEY", "bench-offline")
+    # Every api_chat request sends the same message; measure generation, not the report cache
+    os.environ.setdefault("REPORT_CACHE_TTL", "0")
+    module = load_module("app", ROOT / "backend" / "app.py")
+    # Built here rather than by the warm-up, which the ASGI transport does not run
+    gemini_service = module.get_gemini_service()
+    if use_stubs:
+        gemini_service.client = StubGeminiClient(latency)
+
+    module.create_complaints_table()
+    import sqlite3
+    conn = sqlite3.connect("test.db")
+    conn.executemany(
+        "INSERT INTO complaints (title, department, description, image_path, timestamp, status) VALUES (?, ?, ?, ?, ?, ?)",
+        [(f"Complaint {i}", "Roads & Infrastructure", "Seeded complaint for benchmarking " * 4,
+          None, datetime.now().isoformat(), "resolved" if i % 10 == 0 else "pending") for i in range(seed_rows)],
+    )
+    conn.commit()
+    conn.close()
+    # The listing then merges current and archived complaints, as in production
+    module.archive_resolved_complaints(older_than_days=0)
+    return module.app
+
+
+async def load_agent_app(latency, mcp_url, mcp_server, use_stubs):
+    os.environ["MCP_SERVER_URL"] = mcp_url
+    module = load_module("agent_server", ROOT / "backend.py")
+    if use_stubs:
+        os.environ.setdefault("GROQ_API_KEY", "bench-offline")
+        StubChatGroq.latency = latency
+        StubChatGroq.tool_name = MCP_SERVERS[mcp_server]["tool"]
+        StubChatGroq.tool_args = MCP_SERVERS[mcp_server]["args"]
+        module.mcp_chat_client.chat_model_cls = StubChatGroq
+    # The ASGI transport does not run startup events
+    await module.mcp_chat_client.initialize()
+    return module.app
+
+
+SCENARIOS = {
+    "api_chat": ("backend", lambda c: c.post("/api/chat", data={"message": "Streetlight not working near the bus stop"})),
+    "api_complaints_list": ("backend", lambda c: c.get("/api/complaints")),
+    "api_complaints_create": ("backend", lambda c: c.post("/api/complaints", data={
+        "title": "Overflowing drain", "department": "Drainage", "description": "Drain overflowing on 5th Cross"})),
+    "agent_chat": ("agent", lambda c: c.post("/chat", json={"message": "File a complaint about the streetlight", "history": []})),
+}
+
+
+# --- Measurement ---
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def current_rss_mb(pid="self"):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _is_error(response):
+    if response.status_code >= 400:
+        return True
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    return isinstance(body, dict) and body.get("success") is False
+
+
+async def run_scenario(client, request, concurrency, total, warmup):
+    for _ in range(warmup):
+        await request(client)
+
+    latencies = []
+    errors = 0
+    remaining = total
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await request(client)
+                failed = _is_error(response)
+            except Exception:
+                failed = True
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(latencies) / duration, 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2),
+        "rss_mb": round(current_rss_mb() or 0, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if tracemalloc.is_tracing():
+        result["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+    return result
+
+
+# --- Storage ---
+
+def git_revision():
+    try:
+        revision = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return revision, dirty
+
+
+def save_results(run):
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = RESULTS_DIR / f"{stamp}_{run['revision'][:10]}{'-dirty' if run['dirty'] else ''}.json"
+    path.write_text(json.dumps(run, indent=2) + "\n")
+    return path
+
+
+def previous_results(exclude):
+    candidates = sorted(p for p in RESULTS_DIR.glob("*.json") if p != exclude)
+    return candidates[-1] if candidates else None
+
+
+def compare(run, baseline, threshold):
+    """
+    Print throughput and p95 changes per scenario/concurrency; return the regressions found
+    """
+    base = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline['revision'][:10]} ({baseline['timestamp']}):")
+    print(f"{'scenario':<24}{'conc':>6}{'rps':>12}{'Δrps':>9}{'p95 ms':>12}{'Δp95':>9}")
+    for r in run["results"]:
+        b = base.get((r["scenario"], r["concurrency"]))
+        if b is None:
+            continue
+        d_rps = (r["throughput_rps"] - b["throughput_rps"]) / b["throughput_rps"] * 100 if b["throughput_rps"] else 0
+        d_p95 = (r["p95_ms"] - b["p95_ms"]) / b["p95_ms"] * 100 if b["p95_ms"] else 0
+        flag = ""
+        if d_rps < -threshold or d_p95 > threshold:
+            flag = "  REGRESSION"
+            regressions.append(r)
+        print(f"{r['scenario']:<24}{r['concurrency']:>6}{r['throughput_rps']:>12.1f}{d_rps:>+8.1f}%"
+              f"{r['p95_ms']:>12.1f}{d_p95:>+8.1f}%{flag}")
+    return regressions
+
+
+# --- Main ---
+
+async def main(args):
+    latency = Latency(args.llm_latency, args.llm_jitter, seed=args.seed,
+                      slow_share=args.llm_slow_share, slow_factor=args.llm_slow_factor)
+    scenarios = args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    use_stubs = args.llm == "stub"
+    if not use_stubs:
+        # Read by llm_transport when the apps are imported
+        os.environ["LLM_TRANSPORT_MODE"] = args.llm
+        os.environ["LLM_CASSETTE_DIR"] = str(Path(args.cassettes).resolve())
+
+    # Every bench request comes from one client; export these to measure shedding instead
+    os.environ.setdefault("ADMISSION_RATE", "0")
+    os.environ.setdefault("MODEL_CONCURRENCY", "0")
+
+    workdir = tempfile.mkdtemp(prefix="ptp-bench-")
+    os.chdir(workdir)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    apps = {}
+    mcp_process = None
+    try:
+        if any(SCENARIOS[s][0] == "backend" for s in scenarios):
+            apps["backend"] = load_backend_app(latency, args.seed_rows, use_stubs)
+        if any(SCENARIOS[s][0] == "agent" for s in scenarios):
+            mcp_process, mcp_url = start_mcp_server(args.mcp_server, workdir)
+            apps["agent"] = await load_agent_app(latency, mcp_url, args.mcp_server, use_stubs)
+
+        results = []
+        for name in scenarios:
+            app_name, request = SCENARIOS[name]
+            transport = httpx.ASGITransport(app=apps[app_name])
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                    result = await run_scenario(client, request, concurrency, args.requests, args.warmup)
+                    result["scenario"] = name
+                    if app_name == "agent" and mcp_process is not None:
+                        result["mcp_server_rss_mb"] = round(current_rss_mb(mcp_process.pid) or 0, 1)
+                    results.append(result)
+                    print(f"{name:<24} c={concurrency:<4} {result['throughput_rps']:>9.1f} req/s  "
+                          f"p50 {result['p50_ms']:>8.1f}  p95 {result['p95_ms']:>8.1f}  p99 {result['p99_ms']:>8.1f} ms  "
+                          f"errors {result['errors']}  rss {result['rss_mb']} MB")
+    finally:
+        if mcp_process is not None:
+            mcp_process.terminate()
+            mcp_process.wait(timeout=10)
+
+    revision, dirty = git_revision()
+    run = {
+        "revision": revision,
+        "dirty": dirty,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("compare", "fail_on_regression")},
+        "results": results,
+    }
+    path = save_results(run)
+    print(f"\nResults written to {path.relative_to(ROOT)}")
+
+    if args.compare or args.baseline:
+        baseline_path = Path(args.baseline) if args.baseline else previous_results(path)
+        if baseline_path is None:
+            print("No previous results to compare with.")
+            return 0
+        regressions = compare(run, json.loads(baseline_path.read_text()), args.threshold)
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with stub LLMs")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenario names")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--llm", choices=["stub", "record", "replay"], default="stub",
+                        help="Stub LLMs, or record/replay real ones through the LLM transport")
+    parser.add_argument("--cassettes", default=str(ROOT / "bench" / "cassettes"), help="Cassette directory for --llm record/replay")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Mean stub LLM latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.05, help="Uniform jitter around the mean, in seconds")
+    parser.add_argument("--llm-slow-share", type=float, default=0.0, help="Share of stub LLM calls that are slow")
+    parser.add_argument("--llm-slow-factor", type=float, default=10.0, help="How many times slower those calls are")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--seed-rows", type=int, default=500, help="Complaints preloaded for the listing scenario")
+    parser.add_argument("--mcp-server", choices=sorted(MCP_SERVERS), default="complaint")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also record peak Python allocations (slower)")
+    parser.add_argument("--compare", action="store_true", help="Diff against the previous stored run")
+    parser.add_argument("--baseline", help="Diff against this results file instead")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,178 @@
+"""
+In-process stand-ins for the Gemini and Groq clients used by the benchmarks.
+
+Both block for a configurable latency (mean plus uniform jitter) exactly where the
+real SDK would block on the network, so the servers' concurrency behaviour is kept.
+A `slow_share` of calls take `slow_factor` times as long, to give the latency a tail
+for the hedged model routers to cut.
+
+The Gemini stub also stands in for context caching: caches expire after their TTL,
+prompt tokens are estimated at 4 characters each, and the first-token delay shrinks
+with the share of the prompt served from a cache (PREFILL_SHARE of the latency is
+prompt processing).
+"""
+
+import json
+import time
+import random
+import itertools
+from types import SimpleNamespace
+
+# Fraction of a call's latency spent processing the prompt, which a cached prefix skips
+PREFILL_SHARE = 0.5
+
+STUB_REPORT = {
+    "title": "Streetlight out near bus stop",
+    "department": "Electricity",
+    "severity": "Medium",
+    "description": "Streetlight near the Koramangala 4th Block bus stop has been out for a week.",
+    "suggested_action": "Replace the lamp and check the feeder cable",
+    "estimated_timeline": "2-3 days",
+    "location": "Koramangala 4th Block",
+    "category": "Safety",
+}
+
+
+class Latency:
+    def __init__(self, mean=0.2, jitter=0.05, seed=None, slow_share=0.0, slow_factor=10.0):
+        self.mean = mean
+        self.jitter = jitter
+        self.slow_share = slow_share
+        self.slow_factor = slow_factor
+        self._random = random.Random(seed)
+
+    def sleep(self, scale=1.0):
+        delay = (self.mean + self._random.uniform(-self.jitter, self.jitter)) * scale
+        if self._random.random() < self.slow_share:
+            delay *= self.slow_factor
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _tokens(text):
+    return max(1, len(text or "") // 4)
+
+
+def _text(contents):
+    if isinstance(contents, str):
+        return contents
+    return "".join(part.text or "" for content in contents for part in content.parts)
+
+
+class StubAPIError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class _StubGeminiCaches:
+    def __init__(self):
+        self.entries = {}
+        self._ids = itertools.count(1)
+
+    def _ttl(self, config):
+        return float(config.ttl.rstrip("s"))
+
+    def create(self, model, config):
+        name = f"cachedContents/stub-{next(self._ids)}"
+        self.entries[name] = {"tokens": _tokens(config.system_instruction), "expires_at": time.time() + self._ttl(config)}
+        return SimpleNamespace(name=name, model=model)
+
+    def update(self, name, config):
+        self.live(name)["expires_at"] = time.time() + self._ttl(config)
+        return SimpleNamespace(name=name)
+
+    def delete(self, name):
+        self.entries.pop(name, None)
+
+    def live(self, name):
+        entry = self.entries.get(name)
+        if entry is None or entry["expires_at"] <= time.time():
+            self.entries.pop(name, None)
+            raise StubAPIError(404, f"CachedContent not found: {name}")
+        return entry
+
+
+class _StubGeminiModels:
+    def __init__(self, latency, caches):
+        self.latency = latency
+        self.caches = caches
+        self.calls = 0
+
+    def count_tokens(self, model, contents, config=None):
+        return SimpleNamespace(total_tokens=_tokens(_text(contents)))
+
+    def _prompt(self, contents, config):
+        """(prompt tokens, cached tokens) of a request"""
+        prompt = _tokens(_text(contents))
+        if config is not None and config.cached_content:
+            cached = self.caches.live(config.cached_content)["tokens"]
+            return prompt + cached, cached
+        system = _tokens(config.system_instruction) if config is not None and config.system_instruction else 0
+        return prompt + system, 0
+
+    def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        self.latency.sleep()
+        return SimpleNamespace(text="```json\n" + json.dumps(STUB_REPORT) + "\n```")
+
+    def generate_content_stream(self, model, contents, config=None, chunk_size=64):
+        # JSON mode: bare JSON, delivered in chunks after the first-token latency
+        self.calls += 1
+        prompt, cached = self._prompt(contents, config)
+        self.latency.sleep(1 - PREFILL_SHARE * cached / prompt)
+        text = json.dumps(STUB_REPORT)
+        for i in range(0, len(text), chunk_size):
+            usage = SimpleNamespace(prompt_token_count=prompt, cached_content_token_count=cached or None,
+                                    candidates_token_count=_tokens(text[:i + chunk_size]))
+            yield SimpleNamespace(text=text[i:i + chunk_size], usage_metadata=usage)
+
+
+class StubGeminiClient:
+    """Replaces `genai.Client` on a `GeminiReportGenerator`"""
+
+    def __init__(self, latency):
+        self.caches = _StubGeminiCaches()
+        self.models = _StubGeminiModels(latency, self.caches)
+
+
+class StubChatGroq:
+    """
+    Replaces `langchain_groq.ChatGroq` in backend.py.
+
+    While tools are bound, the first turn requests `tool_name` with `tool_args`; the
+    turn after the tool result (or any turn with tools disabled) answers in text.
+    """
+
+    latency = Latency()
+    tool_name = None
+    tool_args = {}
+
+    def __init__(self, model=None, temperature=0, tools=None, tool_choice=None):
+        self.model = model
+        self.temperature = temperature
+        self.tools = tools or []
+        self.tool_choice = tool_choice
+
+    def bind_tools(self, tools, tool_choice=None):
+        return StubChatGroq(self.model, self.temperature, tools, tool_choice)
+
+    def invoke(self, messages):
+        from langchain_core.messages import AIMessage, ToolMessage
+
+        self.latency.sleep()
+        last = messages[-1]
+        wants_tool = (
+            self.tool_name
+            and self.tool_choice != "none"
+            and any(t["function"]["name"] == self.tool_name for t in self.tools)
+            and not isinstance(last, ToolMessage)
+        )
+        if wants_tool:
+            return AIMessage(
+                content="",
+                tool_calls=[{"name": self.tool_name, "args": dict(self.tool_args), "id": "call_0"}],
+            )
+        if isinstance(last, ToolMessage):
+            return AIMessage(content=f"Done. The tool returned: {last.content[:200]}")
+        return AIMessage(content="Stub answer without tools.")
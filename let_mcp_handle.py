@@ -1,11 +1,28 @@
+import os
+import sys
+import asyncio
 import sqlite3
-import base64
+import hashlib
+from typing import Optional
 from fastmcp import FastMCP
+from starlette.responses import JSONResponse, Response
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+import metrics
+import tracing
+import tool_pool
+from image_pipeline import sniff_mime_type
+from group_commit import GroupCommitWriter
 
 # Initialize the FastMCP agent
 mcp = FastMCP("ComplaintSystem")
+metrics.install_mcp(mcp)
 
 DB_FILE = "complaints.db"
+# Images are uploaded once to /blobs and passed to tools by their short image_ref
+BLOB_MAX_BYTES = int(os.getenv("BLOB_MAX_BYTES", str(10 * 1024 * 1024)))
+# Reports and uploads arriving together are committed together
+writer = GroupCommitWriter(DB_FILE, "complaint_system")
 
 def initialize_database():
     """
@@ -27,6 +44,20 @@ def initialize_database():
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        # Uploaded images, content-addressed so re-uploading the same photo is free
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ImageBlob (
+                ref TEXT PRIMARY KEY,
+                mime_type TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Reports filed by reference point at ImageBlob instead of copying the image
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(Complaint)")}
+        if "image_ref" not in columns:
+            cursor.execute("ALTER TABLE Complaint ADD COLUMN image_ref TEXT")
         conn.commit()
         print(f"Database '{DB_FILE}' initialized successfully.")
     except sqlite3.Error as e:
@@ -36,57 +67,95 @@ def initialize_database():
             conn.close()
 
 
+async def store_blob(data: bytes, mime_type: str) -> str:
+    """
+    Store an image and return its reference, the same for identical bytes
+    """
+    ref = "img_" + hashlib.sha256(data).hexdigest()[:24]
+    with tracing.span("db store_blob", **{"db.system": "sqlite"}), \
+            metrics.timed(metrics.DB_QUERY_LATENCY, metrics.DB_QUERIES, db="sqlite", query="store_blob"):
+        await writer.execute_async(
+            "INSERT OR IGNORE INTO ImageBlob (ref, mime_type, size, data) VALUES (?, ?, ?, ?)",
+            (ref, mime_type, len(data), data)
+        )
+    return ref
+
+def load_blob(ref: str):
+    """
+    Return (data, mime_type) for an image reference, or None if it is unknown
+    """
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        with tracing.span("db load_blob", **{"db.system": "sqlite"}), \
+                metrics.timed(metrics.DB_QUERY_LATENCY, metrics.DB_QUERIES, db="sqlite", query="load_blob"):
+            return conn.execute("SELECT data, mime_type FROM ImageBlob WHERE ref = ?", (ref,)).fetchone()
+    finally:
+        conn.close()
+
+@mcp.custom_route("/blobs", methods=["POST"])
+async def upload_blob(request):
+    """
+    Store the raw image in the request body; returns {"image_ref": ...} to pass to submit_report
+    """
+    data = await request.body()
+    if not data:
+        return JSONResponse({"error": "Empty upload", "success": False}, status_code=400)
+    if len(data) > BLOB_MAX_BYTES:
+        return JSONResponse({"error": f"Image larger than {BLOB_MAX_BYTES} bytes", "success": False}, status_code=413)
+    mime_type = sniff_mime_type(data)
+    if mime_type is None:
+        return JSONResponse({"error": "Not a supported image", "success": False}, status_code=415)
+    ref = await store_blob(data, mime_type)
+    return JSONResponse({"image_ref": ref, "mime_type": mime_type, "size": len(data), "success": True})
+
+@mcp.custom_route("/blobs/{ref}", methods=["GET"])
+async def get_blob(request):
+    blob = await asyncio.to_thread(load_blob, request.path_params["ref"])
+    if blob is None:
+        return JSONResponse({"error": "Image not found", "success": False}, status_code=404)
+    # Content-addressed, so the bytes behind a ref never change
+    return Response(blob[0], media_type=blob[1], headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
 @mcp.tool("submit_report")
-def submit_report(problem_type: str, image_base64: str, description: str) -> str:
+@metrics.track_tool("submit_report")
+@tracing.traced_tool("submit_report")
+async def submit_report(problem_type: str, description: str, image_ref: Optional[str] = None) -> str:
     """
     Submits a new complaint report to the database.
 
     Args:
         problem_type (str): The category or type of the problem (e.g., "Pothole", "Broken Streetlight").
-        image_base64 (str): A base64-encoded string of the image file.
         description (str): A text description of the problem.
+        image_ref (str, optional): Reference of a photo uploaded beforehand (e.g. "img_3f2a..."), if any.
 
     Returns:
         str: A confirmation message indicating success or failure.
     """
-    conn = None
     try:
-        # Decode the base64 string to get the raw image bytes
-        image_data = base64.b64decode(image_base64)
-
-        # Connect to the SQLite database
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
-        # Insert the data into the Complaint table using a parameterized query to prevent SQL injection
-        cursor.execute(
-            "INSERT INTO Complaint (problem_type, image, description) VALUES (?, ?, ?)",
-            (problem_type, image_data, description)
-        )
-
-        conn.commit()
-
-        # Get the ID of the newly inserted row
-        new_id = cursor.lastrowid
+        if image_ref is not None and await asyncio.to_thread(load_blob, image_ref) is None:
+            return f"Failed to submit report. Unknown image reference '{image_ref}'; upload the image first."
+
+        # Insert the data into the Complaint table using a parameterized query to prevent SQL injection.
+        # The writer batches it with concurrent reports into one commit.
+        with tracing.span("db submit_report", **{"db.system": "sqlite"}), \
+                metrics.timed(metrics.DB_QUERY_LATENCY, metrics.DB_QUERIES, db="sqlite", query="submit_report"):
+            new_id = await writer.execute_async(
+                "INSERT INTO Complaint (problem_type, image_ref, description) VALUES (?, ?, ?)",
+                (problem_type, image_ref, description)
+            )
 
         return f"Report submitted successfully. Your complaint ID is {new_id}."
 
     except sqlite3.Error as e:
         return f"Failed to submit report. Database error: {e}"
-    except (base64.binascii.Error, TypeError) as e:
-        return f"Failed to submit report. Invalid base64 image data: {e}"
-    finally:
-        if conn:
-            conn.close()
+
+# Imported by the worker processes when MCP_WORKERS > 1
+app = tool_pool.http_app(mcp)
 
 if __name__ == "__main__":
-    # Ensure the database and table are created before starting the server
+    # Ensure the database and table are created before starting the server (and its workers)
     initialize_database()
 
     # Run the FastMCP agent as an HTTP server
-    mcp.run(
-        transport="http",
-        host="0.0.0.0",
-        port=8005,
-        log_level="debug"
-    )
+    tool_pool.run(mcp, "let_mcp_handle:app", port=int(os.getenv("MCP_PORT", "8005")))